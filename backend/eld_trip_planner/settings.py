@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "trips.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "trips.middleware.ServerTimingMiddleware",
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -89,6 +91,23 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# "shared" is visible to every worker; create its table with
+# `python manage.py createcachetable`.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "trips_shared_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,3 +158,217 @@ OSRM_ROUTE_URL = os.environ.get(
 NOMINATIM_URL = os.environ.get(
     "NOMINATIM_URL", "https://nominatim.openstreetmap.org/search"
 )
+
+# Connection pooling, timeouts, retries and circuit breaking per upstream
+UPSTREAM_CLIENTS = {
+    "nominatim": {
+        "CONNECT_TIMEOUT_S": 3.05,
+        "READ_TIMEOUT_S": float(
+            os.environ.get("NOMINATIM_READ_TIMEOUT_S", 10)
+        ),
+        "RETRIES": int(os.environ.get("NOMINATIM_RETRIES", 2)),
+        "BACKOFF_S": 0.5,
+        "POOL_MAXSIZE": 4,
+        "FAILURE_THRESHOLD": 5,
+        "RESET_TIMEOUT_S": 30.0,
+        # Token bucket: public Nominatim allows about 1 request/s
+        "RATE_PER_S": float(os.environ.get("NOMINATIM_RATE_PER_S", 1)),
+        "BURST": int(os.environ.get("NOMINATIM_BURST", 1)),
+        "MAX_QUEUE": int(os.environ.get("NOMINATIM_MAX_QUEUE", 32)),
+    },
+    "osrm": {
+        "CONNECT_TIMEOUT_S": 3.05,
+        "READ_TIMEOUT_S": float(os.environ.get("OSRM_READ_TIMEOUT_S", 20)),
+        "RETRIES": int(os.environ.get("OSRM_RETRIES", 2)),
+        "BACKOFF_S": 0.25,
+        "POOL_MAXSIZE": 10,
+        "FAILURE_THRESHOLD": 5,
+        "RESET_TIMEOUT_S": 15.0,
+        # 0 disables the token bucket
+        "RATE_PER_S": float(os.environ.get("OSRM_RATE_PER_S", 0)),
+        "BURST": int(os.environ.get("OSRM_BURST", 10)),
+        "MAX_QUEUE": int(os.environ.get("OSRM_MAX_QUEUE", 64)),
+    },
+}
+
+# Longest a rate limited upstream call may wait for its turn, by
+# priority: /api/route/ and sweeps are interactive, batch requests and
+# async jobs queue behind them. Calls that would wait longer fail with
+# 503 and a Retry-After header
+UPSTREAM_QUEUE_MAX_WAIT_S = {
+    "interactive": float(os.environ.get("UPSTREAM_INTERACTIVE_MAX_WAIT_S", 5)),
+    "batch": float(os.environ.get("UPSTREAM_BATCH_MAX_WAIT_S", 30)),
+    "background": float(os.environ.get("UPSTREAM_BACKGROUND_MAX_WAIT_S", 120)),
+}
+
+# Number of threads used to run independent upstream calls concurrently
+# (1 runs them one after another)
+UPSTREAM_MAX_WORKERS = int(os.environ.get("UPSTREAM_MAX_WORKERS", 8))
+
+# Geocode cache: in-process LRU in front of the shared cache above
+GEOCODE_CACHE_ALIAS = os.environ.get("GEOCODE_CACHE_ALIAS", "shared")
+GEOCODE_CACHE_MAXSIZE = int(os.environ.get("GEOCODE_CACHE_MAXSIZE", 4096))
+GEOCODE_CACHE_TTL_S = int(
+    os.environ.get("GEOCODE_CACHE_TTL_S", 30 * 24 * 60 * 60)
+)
+GEOCODE_NEGATIVE_CACHE_TTL_S = int(
+    os.environ.get("GEOCODE_NEGATIVE_CACHE_TTL_S", 60 * 60)
+)
+
+# Optional local geocoder consulted before the caches and Nominatim: a
+# gazetteer file built with `manage.py build_gazetteer` (or a CSV/GeoNames
+# source, indexed at startup). Disable the upstream fallback in air-gapped
+# deployments, so unknown addresses fail fast as not found
+GEOCODER_GAZETTEER_PATH = os.environ.get("GEOCODER_GAZETTEER_PATH", "")
+GEOCODER_UPSTREAM_ENABLED = (
+    os.environ.get("GEOCODER_UPSTREAM_ENABLED", "true").lower() == "true"
+)
+
+# Route cache: OSRM routes keyed by their coordinate string, rounded to
+# ROUTE_COORD_PRECISION decimals (5 ~ 1 m) before requesting and keying
+ROUTE_COORD_PRECISION = int(os.environ.get("ROUTE_COORD_PRECISION", 5))
+ROUTE_CACHE_ALIAS = os.environ.get("ROUTE_CACHE_ALIAS", "shared")
+ROUTE_CACHE_MAXSIZE = int(os.environ.get("ROUTE_CACHE_MAXSIZE", 512))
+ROUTE_CACHE_MAX_BYTES = int(
+    os.environ.get("ROUTE_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+)
+ROUTE_CACHE_TTL_S = int(os.environ.get("ROUTE_CACHE_TTL_S", 7 * 24 * 60 * 60))
+
+# Concurrent identical geocode/route requests of a worker share one
+# upstream call. With COALESCE_SHARED_ALIAS set (e.g. "shared"), workers
+# also take a lock there and wait up to COALESCE_WAIT_S for the worker
+# holding it to fill the shared geocode/route cache
+COALESCE_SHARED_ALIAS = os.environ.get("COALESCE_SHARED_ALIAS", "")
+COALESCE_LOCK_TIMEOUT_S = int(os.environ.get("COALESCE_LOCK_TIMEOUT_S", 30))
+COALESCE_WAIT_S = float(os.environ.get("COALESCE_WAIT_S", 10))
+COALESCE_POLL_S = float(os.environ.get("COALESCE_POLL_S", 0.05))
+
+# Optional lane matrix built with `manage.py build_lane_matrix`: routes
+# between its sites are assembled locally instead of requesting OSRM
+LANE_MATRIX_PATH = os.environ.get("LANE_MATRIX_PATH", "")
+
+# Plan cache: full route/stops/logs results keyed by the route coordinates
+# and the exact current cycle hours. A PLAN_CACHE_CYCLE_HOURS_BUCKET above
+# 0 is a lossy opt-in: the cycle hours are rounded to it before the plan
+# is keyed and computed, so the logs are those of the rounded value
+PLAN_CACHE_ALIAS = os.environ.get("PLAN_CACHE_ALIAS", "shared")
+PLAN_CACHE_MAXSIZE = int(os.environ.get("PLAN_CACHE_MAXSIZE", 1024))
+PLAN_CACHE_MAX_BYTES = int(
+    os.environ.get("PLAN_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+PLAN_CACHE_TTL_S = int(os.environ.get("PLAN_CACHE_TTL_S", 24 * 60 * 60))
+PLAN_CACHE_CYCLE_HOURS_BUCKET = float(
+    os.environ.get("PLAN_CACHE_CYCLE_HOURS_BUCKET", 0)
+)
+
+# Shape of the route returned by /api/route/: "slim" keeps the overall
+# geometry, distance, duration and per-leg summaries, "full" returns the
+# raw OSRM route, "simplified" is slim with the pre-simplified geometries
+# below. Clients can pick one with ?route=slim|full|simplified
+ROUTE_RESPONSE_DEFAULT_VIEW = os.environ.get(
+    "ROUTE_RESPONSE_DEFAULT_VIEW", "slim"
+)
+
+# Store the plans of /api/route/ (and its async jobs) as TripPlan rows, so
+# responses carry a plan_id served again by /api/route/<plan_id>/ for
+# reloads and shared links. Off by default: it adds a database write to
+# every new plan. /api/plans/ always stores its plans
+ROUTE_STORE_PLANS = (
+    os.environ.get("ROUTE_STORE_PLANS", "false").lower() == "true"
+)
+
+# Route geometry simplified for the map, as {zoom level: tolerance in
+# meters}. A client at zoom z uses the first level >= z, or the full
+# geometry when zoomed in further than every level. They are sent for
+# ?zoom=z (that level only) or ?route=simplified (every level), computed
+# on first use and kept for ROUTE_SIMPLIFY_CACHE_SIZE (route, level) pairs
+ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M = {
+    5: 1500.0,
+    8: 200.0,
+    11: 25.0,
+}
+ROUTE_SIMPLIFY_CACHE_SIZE = int(
+    os.environ.get("ROUTE_SIMPLIFY_CACHE_SIZE", 1024)
+)
+
+# ELD logs memoized by the exact (route duration, route distance, pickup
+# duration, cycle hours). A quantum above 0 is a lossy opt-in: that input
+# is rounded to it before the logs are computed, so near-identical trips
+# share an entry but get logs of the rounded values, not their own
+ELD_CACHE_ALIAS = os.environ.get("ELD_CACHE_ALIAS", "shared")
+ELD_CACHE_MAXSIZE = int(os.environ.get("ELD_CACHE_MAXSIZE", 4096))
+ELD_CACHE_MAX_BYTES = int(
+    os.environ.get("ELD_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+ELD_CACHE_TTL_S = int(os.environ.get("ELD_CACHE_TTL_S", 7 * 24 * 60 * 60))
+ELD_CACHE_DURATION_QUANTUM_S = float(
+    os.environ.get("ELD_CACHE_DURATION_QUANTUM_S", 0)
+)
+ELD_CACHE_DISTANCE_QUANTUM_M = float(
+    os.environ.get("ELD_CACHE_DISTANCE_QUANTUM_M", 0)
+)
+ELD_CACHE_CYCLE_HOURS_BUCKET = float(
+    os.environ.get("ELD_CACHE_CYCLE_HOURS_BUCKET", 0)
+)
+
+# Maximum number of trips accepted by /api/route/batch/
+BATCH_MAX_TRIPS = int(os.environ.get("BATCH_MAX_TRIPS", 200))
+
+# Maximum number of cycle hour values accepted by /api/route/sweep/
+SWEEP_MAX_CYCLE_HOURS = int(os.environ.get("SWEEP_MAX_CYCLE_HOURS", 10000))
+
+# Trips submitted with /api/route/?async=true are stored in the database
+# and planned by this many in-process worker threads. Jobs are deleted
+# JOB_RETENTION_S after they finish (or were created, if they never did).
+# Jobs left queued or running for JOB_STALE_S by a worker that went away
+# are enqueued again or failed
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", 4))
+JOB_RETENTION_S = int(os.environ.get("JOB_RETENTION_S", 24 * 60 * 60))
+JOB_STALE_S = int(os.environ.get("JOB_STALE_S", 10 * 60))
+
+# Trips stored with /api/plans/ can be re-planned from the driver's live
+# position: positions within REPLAN_OFF_ROUTE_M of the route are projected
+# onto it (through a grid of REPLAN_GRID_CELL_DEG cells over its segments,
+# kept for REPLAN_TRACKER_CACHE_SIZE routes), further ones reroute the
+# trip. Plans not updated for TRIP_PLAN_RETENTION_S are deleted by
+# `manage.py prune_trip_plans`, to be run periodically (e.g. from cron)
+REPLAN_OFF_ROUTE_M = float(os.environ.get("REPLAN_OFF_ROUTE_M", 500))
+REPLAN_GRID_CELL_DEG = float(os.environ.get("REPLAN_GRID_CELL_DEG", 0.01))
+REPLAN_TRACKER_CACHE_SIZE = int(
+    os.environ.get("REPLAN_TRACKER_CACHE_SIZE", 256)
+)
+TRIP_PLAN_RETENTION_S = int(
+    os.environ.get("TRIP_PLAN_RETENTION_S", 7 * 24 * 60 * 60)
+)
+
+# Responses of at least COMPRESSION_MIN_BYTES are compressed with the
+# encoding the client prefers among COMPRESSION_ENCODINGS (in server
+# preference order; br and zstd need the brotli and zstandard packages).
+# Compressed bodies of responses with an ETag (stored plans) are cached,
+# so a plan served again is neither re-serialized nor re-compressed
+COMPRESSION_ENCODINGS = os.environ.get(
+    "COMPRESSION_ENCODINGS", "zstd,br,gzip"
+).split(",")
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+COMPRESSION_LEVELS = {
+    "gzip": int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6)),
+    "br": int(os.environ.get("COMPRESSION_BR_LEVEL", 5)),
+    "zstd": int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3)),
+}
+COMPRESSED_CACHE_ALIAS = os.environ.get("COMPRESSED_CACHE_ALIAS", "shared")
+COMPRESSED_CACHE_MAXSIZE = int(
+    os.environ.get("COMPRESSED_CACHE_MAXSIZE", 1024)
+)
+COMPRESSED_CACHE_MAX_BYTES = int(
+    os.environ.get("COMPRESSED_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+COMPRESSED_CACHE_TTL_S = int(
+    os.environ.get("COMPRESSED_CACHE_TTL_S", 24 * 60 * 60)
+)
+
+# Per-stage durations of each request (geocode, route, stops, ELD logs,
+# upstream calls) are sent in a Server-Timing header when enabled; the
+# latency histograms behind /api/metrics/ are collected either way
+SERVER_TIMING_ENABLED = (
+    os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+)
@@ -0,0 +1,198 @@
+import gc
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Optional
+from . import geometry
+from .geometry import haversine
+from .utils import ELDCalculator
+
+MIN_REGRESSION_MS = 1.0
+
+
+def measure(
+    fn: Callable[[], object],
+    repeat: int,
+    setup: Optional[Callable[[], object]] = None,
+) -> dict:
+    """
+    Best and median wall time of `repeat` runs of `fn` in ms, and the peak
+    memory allocated during one more, traced, run in KiB. `setup` runs
+    untimed before every run.
+    """
+    timings_ms = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings_ms.append((time.perf_counter() - start) * 1000)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "best_ms": round(min(timings_ms), 3),
+        "median_ms": round(statistics.median(timings_ms), 3),
+        "peak_kib": round(peak_bytes / 1024, 1),
+    }
+
+
+def environment() -> dict:
+    """Where a run happened, stored with its results."""
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "numpy": geometry.np.__version__ if geometry.np is not None else None,
+    }
+
+
+def synthetic_polyline(
+    n_points: int, seed: int = 0
+) -> tuple[list[float], list[float]]:
+    """A deterministic westbound route-like polyline of `n_points`."""
+    rng = random.Random(seed)
+    lat, lon = 41.7, -87.6
+    lats, lons = [], []
+
+    for _ in range(n_points):
+        lats.append(lat)
+        lons.append(lon)
+        lat += rng.uniform(-0.0008, 0.0006)
+        lon -= rng.uniform(0.0002, 0.0012)
+
+    return lats, lons
+
+
+def _scalar_kernels(lats, lons, targets_m):
+    cumulative_m = [0.0]
+    for i in range(1, len(lats)):
+        cumulative_m.append(
+            cumulative_m[-1]
+            + haversine((lons[i - 1], lats[i - 1]), (lons[i], lats[i]))
+        )
+
+    return geometry._interpolate_at_python(lats, lons, cumulative_m, targets_m)
+
+
+def _vectorized_kernels(lats, lons, targets_m):
+    cumulative_m = geometry.cumulative_distances_m(lats, lons)
+
+    return geometry.interpolate_at(lats, lons, cumulative_m, targets_m)
+
+
+def bench_geometry(repeat: int, n_points: int) -> list[dict]:
+    """
+    Distance kernels over an `overview=full`-sized polyline: pairwise
+    segment lengths, cumulative sums and interpolation of many targets.
+    """
+    lats, lons = synthetic_polyline(n_points)
+    total_m = geometry.cumulative_distances_m(lats, lons)[-1]
+    targets_m = [total_m * i / 100 for i in range(1, 100)]
+
+    rows = [
+        {
+            "name": f"geometry.scalar[{n_points}]",
+            **measure(lambda: _scalar_kernels(lats, lons, targets_m), repeat),
+        }
+    ]
+    if geometry.np is not None:
+        rows.append(
+            {
+                "name": f"geometry.numpy[{n_points}]",
+                **measure(
+                    lambda: _vectorized_kernels(lats, lons, targets_m), repeat
+                ),
+            }
+        )
+
+    return rows
+
+
+def synthetic_route(driving_hours: float, pickup_hours: float) -> dict:
+    """A two-leg OSRM-like route driven at ~55 mph, without geometry."""
+    legs = [
+        {"duration": hours * 3600, "distance": hours * 3600 * 24.6}
+        for hours in (pickup_hours, driving_hours - pickup_hours)
+    ]
+
+    return {
+        "duration": sum(leg["duration"] for leg in legs),
+        "distance": sum(leg["distance"] for leg in legs),
+        "legs": legs,
+    }
+
+
+def bench_sweep(repeat: int, n_values: int) -> list[dict]:
+    """
+    One route planned for `n_values` cycle hour values: an ELDCalculator
+    per value against a single `sweep_cycle_hours` call.
+    """
+    route = synthetic_route(driving_hours=75, pickup_hours=3)
+    cycle_hours = [70 * i / n_values for i in range(n_values)]
+
+    def calculator_loop():
+        for hours in cycle_hours:
+            ELDCalculator(
+                route=route, curr_cycle_used_hours=hours
+            ).get_eld_logs()
+
+    return [
+        {
+            "name": f"sweep.calculator_loop[{n_values}]",
+            **measure(calculator_loop, repeat),
+        },
+        {
+            "name": f"sweep.vectorized[{n_values}]",
+            **measure(
+                lambda: ELDCalculator(route=route).sweep_cycle_hours(
+                    cycle_hours
+                ),
+                repeat,
+            ),
+        },
+    ]
+
+
+def compare(
+    rows: list[dict], baseline_rows: list[dict], tolerance: float
+) -> list[dict]:
+    """
+    Relative change of best time and peak memory for every row present in
+    both runs with the same upstream responses (recorded or synthetic). A
+    row regressed when either grew by more than `tolerance`
+    (0.2 = 20%); times must also grow by MIN_REGRESSION_MS, so the noise
+    of sub-millisecond rows isn't reported.
+    """
+    baseline = {row["name"]: row for row in baseline_rows}
+    changes = []
+
+    for row in rows:
+        before = baseline.get(row["name"])
+        if before is None or before.get("upstream") != row.get("upstream"):
+            continue
+
+        change = {"name": row["name"]}
+        for field in ("best_ms", "peak_kib"):
+            if before.get(field) and field in row:
+                change[field] = round(row[field] / before[field] - 1, 4)
+
+        slower = (
+            change.get("best_ms", 0) > tolerance
+            and row["best_ms"] - before["best_ms"] >= MIN_REGRESSION_MS
+        )
+        change["regressed"] = slower or change.get("peak_kib", 0) > tolerance
+        changes.append(change)
+
+    return changes
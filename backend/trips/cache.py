@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Every named cache registers itself here so its counters can be reported.
+_registry: dict[str, "TieredCache"] = {}
+
+
+def json_size(value) -> int:
+    """Approximate size of a JSON-able value in bytes, to weigh entries."""
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry.
+
+    Besides the entry count, the cache can be capped by total weight
+    (e.g. approximate bytes) when a `weigher` is given.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        max_weight: Optional[int] = None,
+        weigher: Optional[Callable[[Any], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self._data: OrderedDict[Hashable, tuple[Any, Optional[float], int]] = (
+            OrderedDict()
+        )
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        weight = self.weigher(value) if self.weigher else 0
+
+        if self.max_weight is not None and weight > self.max_weight:
+            # Never let one oversized value flush the whole cache.
+            self.delete(key)
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, expires_at, weight)
+            self._weight += weight
+
+            while len(self._data) > self.maxsize or (
+                self.max_weight is not None and self._weight > self.max_weight
+            ):
+                _, (_, _, evicted_weight) = self._data.popitem(last=False)
+                self._weight -= evicted_weight
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _pop(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._weight -= entry[2]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TieredCache:
+    """
+    An in-process LRU in front of a shared Django cache backend.
+
+    The shared tier is optional and best effort: if the backend is not
+    configured or fails (e.g. the cache table was never created) lookups
+    fall through to the caller as misses instead of failing the request.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        shared_alias: Optional[str] = None,
+        max_weight: Optional[int] = None,
+        weigher: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self.local = LRUCache(
+            maxsize=maxsize, ttl=ttl, max_weight=max_weight, weigher=weigher
+        )
+        self.shared_hits = 0
+        self.misses = 0
+        _registry[name] = self
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = self._shared_get(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+
+        # Promoted for what is left of the entry's own TTL (e.g. the short
+        # one of a negative geocode), not the cache default; 0 never
+        # expires.
+        value, expires_at = value
+        ttl = 0.0
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+            if ttl <= 0:
+                self.misses += 1
+                return default
+
+        self.shared_hits += 1
+        self.local.set(key, value, ttl=ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.local.set(key, value, ttl=ttl)
+        self._shared_set(key, value, ttl=self.ttl if ttl is None else ttl)
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        backend = self._shared_backend()
+        if backend is not None:
+            try:
+                backend.delete(self._shared_key(key))
+            except Exception as e:
+                logger.warning(f"Shared cache {self.name} error: {e}")
+
+    def clear(self):
+        """Drop the in-process tier and reset counters."""
+        self.local.clear()
+        self.shared_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        hits = self.local.hits + self.shared_hits
+        lookups = hits + self.misses
+
+        return {
+            "size": len(self.local),
+            "weight": self.local.weight,
+            "local_hits": self.local.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _shared_backend(self):
+        if not self.shared_alias:
+            return None
+        try:
+            return caches[self.shared_alias]
+        except Exception as e:
+            logger.warning(f"Shared cache {self.name} unavailable: {e}")
+            return None
+
+    def _shared_key(self, key: str) -> str:
+        # Django cache keys must be short and memcached-safe.
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"trips:{self.name}:v2:{digest}"
+
+    def _shared_get(self, key: str) -> Any:
+        backend = self._shared_backend()
+        if backend is None:
+            return _MISSING
+        try:
+            return backend.get(self._shared_key(key), _MISSING)
+        except Exception as e:
+            logger.warning(f"Shared cache {self.name} error: {e}")
+            return _MISSING
+
+    def _shared_set(self, key: str, value: Any, ttl: Optional[float]):
+        backend = self._shared_backend()
+        if backend is None:
+            return
+        # Stored with its wall-clock expiry, so that workers promoting it
+        # to their local tier keep the remaining TTL. A TTL of 0 never
+        # expires, which Django spells timeout=None (0 expires at once).
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            backend.set(
+                self._shared_key(key),
+                (value, expires_at),
+                timeout=ttl or None,
+            )
+        except Exception as e:
+            logger.warning(f"Shared cache {self.name} error: {e}")
+
+
+def cache_stats() -> dict[str, dict]:
+    """Hit/miss counters of every named cache in this process."""
+    return {name: cache.stats() for name, cache in _registry.items()}
@@ -0,0 +1,69 @@
+from .enums import TimeLineChangeType
+
+TIMELINE_KEY = "duty_status_timeline"
+STATUSES = [status.value for status in TimeLineChangeType]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+MINUTES_PER_HOUR = 60
+
+
+def compact_logs(logs: list[dict]) -> dict:
+    """
+    Columnar form of ELD day logs: one array per daily total, and the
+    duty periods of all days as parallel arrays of status codes,
+    start/end minutes of the day and ids into a shared activity table.
+    `periods` holds the number of duty periods of each day.
+    """
+    activities: dict[str, int] = {}
+    totals: dict[str, list] = {}
+    periods, statuses, starts, ends, activity_ids = [], [], [], [], []
+
+    for log in logs:
+        for key, value in log.items():
+            if key != TIMELINE_KEY:
+                totals.setdefault(key, []).append(value)
+
+        timeline = log.get(TIMELINE_KEY, [])
+        periods.append(len(timeline))
+        for period in timeline:
+            statuses.append(STATUS_CODES[period["status"]])
+            starts.append(round(period["start"] * MINUTES_PER_HOUR))
+            ends.append(round(period["end"] * MINUTES_PER_HOUR))
+            activity_ids.append(
+                activities.setdefault(period["activity"], len(activities))
+            )
+
+    return {
+        "statuses": STATUSES,
+        "activities": list(activities),
+        "totals": totals,
+        "periods": periods,
+        "status": statuses,
+        "start": starts,
+        "end": ends,
+        "activity": activity_ids,
+    }
+
+
+def expand_logs(compact: dict) -> list[dict]:
+    """The day logs of `compact_logs`, with times rounded to the minute."""
+    statuses = compact["statuses"]
+    activities = compact["activities"]
+    totals = compact["totals"]
+    logs = []
+    offset = 0
+
+    for day_index, count in enumerate(compact["periods"]):
+        log = {key: values[day_index] for key, values in totals.items()}
+        log[TIMELINE_KEY] = [
+            {
+                "status": statuses[compact["status"][i]],
+                "start": compact["start"][i] / MINUTES_PER_HOUR,
+                "end": compact["end"][i] / MINUTES_PER_HOUR,
+                "activity": activities[compact["activity"][i]],
+            }
+            for i in range(offset, offset + count)
+        ]
+        logs.append(log)
+        offset += count
+
+    return logs
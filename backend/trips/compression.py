@@ -0,0 +1,99 @@
+import gzip
+from typing import Callable, Optional
+from .cache import TieredCache
+from .constants import (
+    COMPRESSED_CACHE_ALIAS,
+    COMPRESSED_CACHE_MAXSIZE,
+    COMPRESSED_CACHE_MAX_BYTES,
+    COMPRESSED_CACHE_TTL_S,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_LEVELS,
+)
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional at runtime
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional at runtime
+    zstandard = None
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    # mtime=0 keeps the bytes of a body identical across compressions.
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _brotli(body: bytes, level: int) -> bytes:
+    return brotli.compress(body, quality=level)
+
+
+def _zstd(body: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+CODECS: dict[str, Optional[Callable[[bytes, int], bytes]]] = {
+    "gzip": _gzip,
+    "br": _brotli if brotli is not None else None,
+    "zstd": _zstd if zstandard is not None else None,
+}
+
+# Encodings offered to clients, in order of preference, without those
+# whose package is not installed.
+AVAILABLE_ENCODINGS = [
+    encoding
+    for encoding in COMPRESSION_ENCODINGS
+    if CODECS.get(encoding) is not None
+]
+
+# Compressed bodies of responses with a strong ETag, keyed by the ETag and
+# the encoding: the same ETag always means the same bytes.
+compressed_cache = TieredCache(
+    name="compressed",
+    maxsize=COMPRESSED_CACHE_MAXSIZE,
+    ttl=COMPRESSED_CACHE_TTL_S,
+    shared_alias=COMPRESSED_CACHE_ALIAS,
+    max_weight=COMPRESSED_CACHE_MAX_BYTES,
+    weigher=lambda value: len(value[1]),
+)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    The available encoding the client prefers per its `Accept-Encoding`
+    q-values, ties going to the server's order; None for no compression.
+    """
+    weights: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    for encoding in AVAILABLE_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return CODECS[encoding](body, COMPRESSION_LEVELS.get(encoding, 6))
+
+
+def compressed_key(etag: str, encoding: str) -> str:
+    return f"{etag}|{encoding}"
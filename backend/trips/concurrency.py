@@ -0,0 +1,79 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Hashable, Iterator, Optional
+from .constants import UPSTREAM_MAX_WORKERS
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool for blocking upstream calls."""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=UPSTREAM_MAX_WORKERS,
+                    thread_name_prefix="trips-upstream",
+                )
+
+    return _executor
+
+
+def run_all(
+    calls: dict[Hashable, Callable[[], Any]],
+) -> tuple[dict[Hashable, Any], dict[Hashable, Exception]]:
+    """
+    Run independent calls concurrently and collect their results and
+    errors by name. A failing call never cancels the others, so the
+    caller can report every error at once.
+    """
+    results: dict[Hashable, Any] = {}
+    errors: dict[Hashable, Exception] = {}
+
+    for name, result, error in iter_completed(calls):
+        if error is None:
+            results[name] = result
+        else:
+            errors[name] = error
+
+    return results, errors
+
+
+def iter_completed(
+    calls: dict[Hashable, Callable[[], Any]],
+) -> Iterator[tuple[Hashable, Any, Optional[Exception]]]:
+    """
+    Like `run_all`, but yield `(name, result, error)` for every call as
+    soon as it finishes, so callers can stream results in completion
+    order.
+    """
+    if UPSTREAM_MAX_WORKERS <= 1 or len(calls) <= 1:
+        for name, call in calls.items():
+            try:
+                result = call()
+            except Exception as e:
+                yield name, None, e
+            else:
+                yield name, result, None
+
+        return
+
+    # Run every call in a copy of the caller's context, so request scoped
+    # state such as the stage timings follows it into the pool.
+    executor = get_executor()
+    futures = {
+        executor.submit(contextvars.copy_context().run, call): name
+        for name, call in calls.items()
+    }
+
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            yield futures[future], None, e
+        else:
+            yield futures[future], result, None
@@ -2,6 +2,70 @@ from django.conf import settings
 
 OSRM_ROUTE_URL = getattr(settings, "OSRM_ROUTE_URL")
 NOMINATIM_URL = getattr(settings, "NOMINATIM_URL")
+UPSTREAM_CLIENTS = getattr(settings, "UPSTREAM_CLIENTS")
+UPSTREAM_MAX_WORKERS = getattr(settings, "UPSTREAM_MAX_WORKERS")
+UPSTREAM_QUEUE_MAX_WAIT_S = getattr(settings, "UPSTREAM_QUEUE_MAX_WAIT_S")
+GEOCODE_CACHE_ALIAS = getattr(settings, "GEOCODE_CACHE_ALIAS")
+GEOCODE_CACHE_MAXSIZE = getattr(settings, "GEOCODE_CACHE_MAXSIZE")
+GEOCODE_CACHE_TTL_S = getattr(settings, "GEOCODE_CACHE_TTL_S")
+GEOCODE_NEGATIVE_CACHE_TTL_S = getattr(
+    settings, "GEOCODE_NEGATIVE_CACHE_TTL_S"
+)
+GEOCODER_GAZETTEER_PATH = getattr(settings, "GEOCODER_GAZETTEER_PATH")
+GEOCODER_UPSTREAM_ENABLED = getattr(settings, "GEOCODER_UPSTREAM_ENABLED")
+ROUTE_COORD_PRECISION = getattr(settings, "ROUTE_COORD_PRECISION")
+ROUTE_CACHE_ALIAS = getattr(settings, "ROUTE_CACHE_ALIAS")
+ROUTE_CACHE_MAXSIZE = getattr(settings, "ROUTE_CACHE_MAXSIZE")
+ROUTE_CACHE_MAX_BYTES = getattr(settings, "ROUTE_CACHE_MAX_BYTES")
+ROUTE_CACHE_TTL_S = getattr(settings, "ROUTE_CACHE_TTL_S")
+LANE_MATRIX_PATH = getattr(settings, "LANE_MATRIX_PATH")
+COALESCE_SHARED_ALIAS = getattr(settings, "COALESCE_SHARED_ALIAS")
+COALESCE_LOCK_TIMEOUT_S = getattr(settings, "COALESCE_LOCK_TIMEOUT_S")
+COALESCE_WAIT_S = getattr(settings, "COALESCE_WAIT_S")
+COALESCE_POLL_S = getattr(settings, "COALESCE_POLL_S")
+PLAN_CACHE_ALIAS = getattr(settings, "PLAN_CACHE_ALIAS")
+PLAN_CACHE_MAXSIZE = getattr(settings, "PLAN_CACHE_MAXSIZE")
+PLAN_CACHE_MAX_BYTES = getattr(settings, "PLAN_CACHE_MAX_BYTES")
+PLAN_CACHE_TTL_S = getattr(settings, "PLAN_CACHE_TTL_S")
+PLAN_CACHE_CYCLE_HOURS_BUCKET = getattr(
+    settings, "PLAN_CACHE_CYCLE_HOURS_BUCKET"
+)
+ROUTE_RESPONSE_DEFAULT_VIEW = getattr(settings, "ROUTE_RESPONSE_DEFAULT_VIEW")
+ROUTE_STORE_PLANS = getattr(settings, "ROUTE_STORE_PLANS")
+ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M = getattr(
+    settings, "ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M"
+)
+ROUTE_SIMPLIFY_CACHE_SIZE = getattr(settings, "ROUTE_SIMPLIFY_CACHE_SIZE")
+ELD_CACHE_ALIAS = getattr(settings, "ELD_CACHE_ALIAS")
+ELD_CACHE_MAXSIZE = getattr(settings, "ELD_CACHE_MAXSIZE")
+ELD_CACHE_MAX_BYTES = getattr(settings, "ELD_CACHE_MAX_BYTES")
+ELD_CACHE_TTL_S = getattr(settings, "ELD_CACHE_TTL_S")
+ELD_CACHE_DURATION_QUANTUM_S = getattr(
+    settings, "ELD_CACHE_DURATION_QUANTUM_S"
+)
+ELD_CACHE_DISTANCE_QUANTUM_M = getattr(
+    settings, "ELD_CACHE_DISTANCE_QUANTUM_M"
+)
+ELD_CACHE_CYCLE_HOURS_BUCKET = getattr(
+    settings, "ELD_CACHE_CYCLE_HOURS_BUCKET"
+)
+BATCH_MAX_TRIPS = getattr(settings, "BATCH_MAX_TRIPS")
+SWEEP_MAX_CYCLE_HOURS = getattr(settings, "SWEEP_MAX_CYCLE_HOURS")
+JOB_MAX_WORKERS = getattr(settings, "JOB_MAX_WORKERS")
+JOB_RETENTION_S = getattr(settings, "JOB_RETENTION_S")
+JOB_STALE_S = getattr(settings, "JOB_STALE_S")
+REPLAN_OFF_ROUTE_M = getattr(settings, "REPLAN_OFF_ROUTE_M")
+REPLAN_GRID_CELL_DEG = getattr(settings, "REPLAN_GRID_CELL_DEG")
+REPLAN_TRACKER_CACHE_SIZE = getattr(settings, "REPLAN_TRACKER_CACHE_SIZE")
+TRIP_PLAN_RETENTION_S = getattr(settings, "TRIP_PLAN_RETENTION_S")
+COMPRESSION_ENCODINGS = getattr(settings, "COMPRESSION_ENCODINGS")
+COMPRESSION_MIN_BYTES = getattr(settings, "COMPRESSION_MIN_BYTES")
+COMPRESSION_LEVELS = getattr(settings, "COMPRESSION_LEVELS")
+COMPRESSED_CACHE_ALIAS = getattr(settings, "COMPRESSED_CACHE_ALIAS")
+COMPRESSED_CACHE_MAXSIZE = getattr(settings, "COMPRESSED_CACHE_MAXSIZE")
+COMPRESSED_CACHE_MAX_BYTES = getattr(settings, "COMPRESSED_CACHE_MAX_BYTES")
+COMPRESSED_CACHE_TTL_S = getattr(settings, "COMPRESSED_CACHE_TTL_S")
+SERVER_TIMING_ENABLED = getattr(settings, "SERVER_TIMING_ENABLED")
 EARTH_RADIUS_M = 6371000
 FUEL_INTERVAL_M = 1609344  # ~1000 miles (meters)
 METERS_TO_MILES = 0.000621371
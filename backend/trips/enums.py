@@ -1,4 +1,4 @@
-from enum import StrEnum
+from enum import IntEnum, StrEnum
 
 
 class TimeLineChangeType(StrEnum):
@@ -6,3 +6,30 @@ class TimeLineChangeType(StrEnum):
     SLEEPER_BERTH = "Sleeper Berth"
     DRIVING = "Driving"
     ON_DUTY = "On Duty"
+
+
+class UpstreamPriority(IntEnum):
+    """Order in which queued upstream calls get rate limit tokens."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+
+class RouteView(StrEnum):
+    SLIM = "slim"
+    FULL = "full"
+    # Slim, with the pre-simplified geometry of every zoom level.
+    SIMPLIFIED = "simplified"
+
+
+class LogFormat(StrEnum):
+    FULL = "full"
+    COMPACT = "compact"
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
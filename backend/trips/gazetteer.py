@@ -0,0 +1,260 @@
+import csv
+import mmap
+import struct
+import sys
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+from .constants import GEOCODER_GAZETTEER_PATH
+
+MAGIC = b"TGZ1"
+# magic, number of entries, number of hash slots (a power of two)
+HEADER = struct.Struct("<4sII")
+SLOT = struct.Struct("<I")
+# key offset and length in the key blob, lat, lon
+ENTRY = struct.Struct("<IIdd")
+
+# GeoNames dump columns (https://download.geonames.org/export/dump/)
+GEONAMES_NAME = 1
+GEONAMES_ASCII_NAME = 2
+GEONAMES_LAT = 4
+GEONAMES_LON = 5
+GEONAMES_COUNTRY = 8
+GEONAMES_ADMIN1 = 10
+GEONAMES_POPULATION = 14
+
+# GeoNames postal code dump columns
+# (https://download.geonames.org/export/zip/)
+POSTAL_COUNTRY = 0
+POSTAL_CODE = 1
+POSTAL_PLACE = 2
+POSTAL_ADMIN1 = 4
+POSTAL_LAT = 9
+POSTAL_LON = 10
+POSTAL_COLUMNS = 12
+
+# CSV sites are named on purpose, so they win over any GeoNames place,
+# whatever its population.
+CSV_PRIORITY = sys.maxsize
+
+# Ways addresses spell the country after "city, state"
+COUNTRY_ALIASES = {"US": ("us", "usa", "united states")}
+
+
+def normalize_address(address: str) -> str:
+    """Case- and whitespace-insensitive key for an address."""
+    parts = (" ".join(part.split()) for part in address.casefold().split(","))
+
+    return ", ".join(part for part in parts if part)
+
+
+def read_csv(path: Path) -> Iterator[tuple[str, float, float, int]]:
+    """
+    `(name, lat, lon, priority)` rows of a CSV with `name`, `lat`, `lon`
+    and optional `aliases` (`|` separated) columns, for terminals, sites
+    and any other place known by name. They take priority over GeoNames
+    places of the same name.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            lat, lon = float(row["lat"]), float(row["lon"])
+            names = [row["name"], *(row.get("aliases") or "").split("|")]
+            for name in names:
+                if name.strip():
+                    yield name, lat, lon, CSV_PRIORITY
+
+
+def read_geonames(path: Path) -> Iterator[tuple[str, float, float, int]]:
+    """
+    `(name, lat, lon, priority)` rows of a GeoNames dump, one per way of
+    writing each place: `city`, `city, state` and `city, state, country`.
+    Bare city names go to the most populated place. Rows of a postal code
+    dump give the centroid of each zip code instead.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) == POSTAL_COLUMNS:
+                yield from _postal_code_rows(columns)
+                continue
+            if len(columns) <= GEONAMES_POPULATION:
+                continue
+
+            lat = float(columns[GEONAMES_LAT])
+            lon = float(columns[GEONAMES_LON])
+            population = int(columns[GEONAMES_POPULATION] or 0)
+            country = columns[GEONAMES_COUNTRY]
+            admin1 = columns[GEONAMES_ADMIN1]
+            countries = COUNTRY_ALIASES.get(country, (country,))
+
+            for name in {columns[GEONAMES_NAME], columns[GEONAMES_ASCII_NAME]}:
+                yield name, lat, lon, population
+                yield f"{name}, {admin1}", lat, lon, population
+                for country_name in countries:
+                    yield f"{name}, {country_name}", lat, lon, population
+                    yield (
+                        f"{name}, {admin1}, {country_name}",
+                        lat,
+                        lon,
+                        population,
+                    )
+
+
+def _postal_code_rows(
+    columns: list[str],
+) -> Iterator[tuple[str, float, float, int]]:
+    """
+    A postal dump row as `zip`, `state zip` and `city, state zip`, each
+    with and without the country. Zip codes never collide with place
+    names, so they need no priority.
+    """
+    if not columns[POSTAL_LAT] or not columns[POSTAL_LON]:
+        return
+
+    lat = float(columns[POSTAL_LAT])
+    lon = float(columns[POSTAL_LON])
+    code = columns[POSTAL_CODE]
+    state_code = f"{columns[POSTAL_ADMIN1]} {code}".strip()
+    country = columns[POSTAL_COUNTRY]
+
+    for name in (code, state_code, f"{columns[POSTAL_PLACE]}, {state_code}"):
+        yield name, lat, lon, 0
+        for country_name in COUNTRY_ALIASES.get(country, (country,)):
+            yield f"{name}, {country_name}", lat, lon, 0
+
+
+def read_source(path: Path) -> Iterator[tuple[str, float, float, int]]:
+    if path.suffix.lower() == ".csv":
+        return read_csv(path)
+
+    return read_geonames(path)
+
+
+def build_index(
+    rows: Iterable[tuple[str, float, float, int]],
+) -> dict[str, tuple[float, float]]:
+    """Coordinates by normalized name; the highest priority row wins."""
+    best: dict[str, tuple[int, float, float]] = {}
+
+    for name, lat, lon, priority in rows:
+        key = normalize_address(name)
+        if key and (key not in best or priority > best[key][0]):
+            best[key] = (priority, lat, lon)
+
+    return {key: (lat, lon) for key, (_, lat, lon) in best.items()}
+
+
+def _slot(key: bytes, mask: int) -> int:
+    return zlib.crc32(key) & mask
+
+
+def write_index(index: dict[str, tuple[float, float]], path: Path) -> None:
+    """
+    Write an index as an open addressing hash table that
+    `MappedGazetteer` reads in place, without parsing it at startup.
+    """
+    keys = [key.encode() for key in index]
+    n_slots = 1
+    while n_slots < 2 * len(keys):
+        n_slots *= 2
+    mask = n_slots - 1
+
+    slots = [0] * n_slots
+    entries = bytearray()
+    blob = bytearray()
+    for entry, (key, (lat, lon)) in enumerate(zip(keys, index.values())):
+        slot = _slot(key, mask)
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = entry + 1
+        entries += ENTRY.pack(len(blob), len(key), lat, lon)
+        blob += key
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys), n_slots))
+        f.write(struct.pack(f"<{n_slots}I", *slots))
+        f.write(entries)
+        f.write(blob)
+
+
+class Gazetteer:
+    """Known places resolved by normalized name, from memory."""
+
+    def __init__(self, index: dict[str, tuple[float, float]]):
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def lookup(self, key: str) -> Optional[tuple[float, float]]:
+        return self.index.get(key)
+
+
+class MappedGazetteer:
+    """Known places resolved from a memory-mapped `write_index` file."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, n_slots = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"Not a gazetteer index: {path}")
+
+        self._mask = n_slots - 1
+        self._entries_at = HEADER.size + n_slots * SLOT.size
+        self._keys_at = self._entries_at + self._count * ENTRY.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def lookup(self, key: str) -> Optional[tuple[float, float]]:
+        encoded = key.encode()
+        slot = _slot(encoded, self._mask)
+
+        while True:
+            (entry,) = SLOT.unpack_from(
+                self._map, HEADER.size + slot * SLOT.size
+            )
+            if not entry:
+                return None
+
+            offset, length, lat, lon = ENTRY.unpack_from(
+                self._map, self._entries_at + (entry - 1) * ENTRY.size
+            )
+            start = self._keys_at + offset
+            if self._map[start : start + length] == encoded:
+                return lat, lon
+
+            slot = (slot + 1) & self._mask
+
+
+def load_gazetteer(path: Path) -> Union[Gazetteer, MappedGazetteer]:
+    """
+    Open a `write_index` file in place, or build an in-memory index from
+    a CSV or GeoNames source.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+
+    if magic == MAGIC:
+        return MappedGazetteer(path)
+
+    return Gazetteer(build_index(read_source(path)))
+
+
+_gazetteer: Optional[Union[Gazetteer, MappedGazetteer]] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Optional[Union[Gazetteer, MappedGazetteer]]:
+    """The configured gazetteer, loaded once per process, or None."""
+    global _gazetteer
+
+    if _gazetteer is None and GEOCODER_GAZETTEER_PATH:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer(Path(GEOCODER_GAZETTEER_PATH))
+
+    return _gazetteer
@@ -0,0 +1,356 @@
+import math
+from typing import Iterable, Optional, Sequence
+import polyline
+from .constants import EARTH_RADIUS_M
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional at runtime
+    np = None
+
+
+def haversine(
+    first_point_coords: list[float, float],
+    second_point_coords: list[float, float],
+) -> float:
+    """
+    Calculate the great-circle distance between two points
+    on the earth (specified in decimal degrees)
+    """
+    # convert decimal degrees to radians
+    lon1, lat1, lon2, lat2 = map(
+        math.radians, [*first_point_coords, *second_point_coords]
+    )
+
+    # haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = (
+        math.sin(dlat / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    )
+    c = 2 * math.asin(math.sqrt(a))
+
+    return c * EARTH_RADIUS_M
+
+
+def segment_lengths_m(lats: Sequence[float], lons: Sequence[float]):
+    """
+    Great-circle length of every segment of a polyline, computed for the
+    whole polyline at once with NumPy, or with `haversine` as a fallback.
+    """
+    if np is None:
+        return [
+            haversine((lon1, lat1), (lon2, lat2))
+            for lat1, lon1, lat2, lon2 in zip(lats, lons, lats[1:], lons[1:])
+        ]
+
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    dlat = lat[1:] - lat[:-1]
+    dlon = lon[1:] - lon[:-1]
+
+    a = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    )
+    return 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0))) * EARTH_RADIUS_M
+
+
+def cumulative_distances_m(lats: Sequence[float], lons: Sequence[float]):
+    """Distance from the first vertex to every vertex of a polyline."""
+    segments_m = segment_lengths_m(lats, lons)
+
+    if np is None:
+        cumulative_m = [0.0]
+        for segment_m in segments_m:
+            cumulative_m.append(cumulative_m[-1] + segment_m)
+        return cumulative_m
+
+    return np.concatenate(([0.0], np.cumsum(segments_m)))
+
+
+def interpolate_at(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    cumulative_m: Sequence[float],
+    targets_m: Iterable[float],
+) -> list[Optional[list[float]]]:
+    """
+    Lat-lons at many distances along a polyline whose vertex distances are
+    `cumulative_m` (non-decreasing). Targets outside the polyline give
+    None. Results are returned in the order of `targets_m`.
+    """
+    targets_m = list(targets_m)
+    if len(cumulative_m) < 2:
+        return [None] * len(targets_m)
+
+    if np is None:
+        return _interpolate_at_python(lats, lons, cumulative_m, targets_m)
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    cumulative_m = np.asarray(cumulative_m, dtype=float)
+    targets = np.asarray(targets_m, dtype=float)
+
+    i = np.searchsorted(cumulative_m, targets, side="left")
+    i = np.clip(i, 1, len(cumulative_m) - 1)
+    start_m = cumulative_m[i - 1]
+    span_m = cumulative_m[i] - start_m
+    fraction = np.divide(
+        targets - start_m,
+        span_m,
+        out=np.zeros_like(targets),
+        where=span_m > 0,
+    ).clip(0, 1)
+
+    lat = lats[i - 1] + fraction * (lats[i] - lats[i - 1])
+    lon = lons[i - 1] + fraction * (lons[i] - lons[i - 1])
+    valid = (targets >= 0) & (targets <= cumulative_m[-1])
+
+    return [
+        [point_lat, point_lon] if is_valid else None
+        for point_lat, point_lon, is_valid in zip(
+            lat.tolist(), lon.tolist(), valid.tolist()
+        )
+    ]
+
+
+def _interpolate_at_python(lats, lons, cumulative_m, targets_m):
+    results: list[Optional[list[float]]] = [None] * len(targets_m)
+    order = sorted(range(len(targets_m)), key=targets_m.__getitem__)
+
+    i = 1
+    last = len(cumulative_m) - 1
+    for position in order:
+        target_m = targets_m[position]
+        if not 0 <= target_m <= cumulative_m[-1]:
+            continue
+
+        while i < last and cumulative_m[i] < target_m:
+            i += 1
+
+        start_m, end_m = cumulative_m[i - 1], cumulative_m[i]
+        fraction = (
+            min(max((target_m - start_m) / (end_m - start_m), 0), 1)
+            if end_m > start_m
+            else 0
+        )
+        results[position] = [
+            lats[i - 1] + fraction * (lats[i] - lats[i - 1]),
+            lons[i - 1] + fraction * (lons[i] - lons[i - 1]),
+        ]
+
+    return results
+
+
+class RouteGeometryIndex:
+    """
+    The step geometries of an OSRM route decoded once into a single
+    polyline with the cumulative distance (in meters) of every vertex.
+
+    Inside each step the haversine segment lengths are scaled to add up
+    to OSRM's `step["distance"]`, so the distance used to pick a step and
+    the distance measured along its geometry always agree. Steps without
+    geometry only shift the distance of the steps after them.
+    """
+
+    def __init__(self, legs: list):
+        step_points: list[list[tuple[float, float]]] = []
+        offsets_m: list[float] = []
+        step_distances_m: list[float] = []
+
+        offset_m = 0.0
+        for leg in legs:
+            for step in leg.get("steps", []):
+                step_m = float(step.get("distance", 0))
+                points = _decode(step.get("geometry"))
+
+                if len(points) >= 2:
+                    step_points.append(points)
+                    offsets_m.append(offset_m)
+                    step_distances_m.append(step_m)
+                offset_m += step_m
+
+        self.lats = [lat for points in step_points for lat, _ in points]
+        self.lons = [lon for points in step_points for _, lon in points]
+        self.cumulative_m = _cumulative_along_steps(
+            self.lats,
+            self.lons,
+            [len(points) for points in step_points],
+            offsets_m,
+            step_distances_m,
+        )
+
+    @property
+    def total_distance_m(self) -> float:
+        return float(self.cumulative_m[-1]) if len(self.cumulative_m) else 0.0
+
+    def point_at(self, distance_m: float) -> Optional[list[float]]:
+        """Lat-lon at `distance_m` from the start of the route."""
+        return self.points_at([distance_m])[0]
+
+    def points_at(
+        self, distances_m: Iterable[float]
+    ) -> list[Optional[list[float]]]:
+        """
+        Lat-lons at many distances, found in one vectorized lookup (or a
+        single forward sweep without NumPy), in the order given.
+        """
+        return interpolate_at(
+            self.lats, self.lons, self.cumulative_m, distances_m
+        )
+
+
+class SegmentGrid:
+    """
+    The segments of a polyline bucketed in a lat/lon grid of `cell_deg`
+    cells, to find the segment nearest to a point by only looking at the
+    cells around it. Each segment is listed in every cell its bounding
+    box touches.
+    """
+
+    def __init__(
+        self,
+        lats: Sequence[float],
+        lons: Sequence[float],
+        cumulative_m: Sequence[float],
+        cell_deg: float,
+    ):
+        self.lats = [float(lat) for lat in lats]
+        self.lons = [float(lon) for lon in lons]
+        self.cumulative_m = [float(m) for m in cumulative_m]
+        self.cell_deg = cell_deg
+        self.cells: dict[tuple[int, int], list[int]] = {}
+
+        for i in range(len(self.lats) - 1):
+            lat1, lat2 = self.lats[i], self.lats[i + 1]
+            lon1, lon2 = self.lons[i], self.lons[i + 1]
+            if lat1 == lat2 and lon1 == lon2:
+                continue
+
+            for row in range(
+                self._cell(min(lat1, lat2)), self._cell(max(lat1, lat2)) + 1
+            ):
+                for col in range(
+                    self._cell(min(lon1, lon2)),
+                    self._cell(max(lon1, lon2)) + 1,
+                ):
+                    self.cells.setdefault((row, col), []).append(i)
+
+    def nearest(
+        self, lat: float, lon: float, max_distance_m: float
+    ) -> Optional[tuple[float, float]]:
+        """
+        `(distance_m, along_m)` of the point of the polyline nearest to
+        `lat, lon`: how far it is and its distance from the start. None
+        when no segment is within `max_distance_m`.
+        """
+        m_per_deg_lat = math.radians(1) * EARTH_RADIUS_M
+        m_per_deg_lon = m_per_deg_lat * max(math.cos(math.radians(lat)), 1e-6)
+        rows = math.ceil(max_distance_m / (m_per_deg_lat * self.cell_deg))
+        cols = math.ceil(max_distance_m / (m_per_deg_lon * self.cell_deg))
+        row, col = self._cell(lat), self._cell(lon)
+
+        candidates = set()
+        for r in range(row - rows, row + rows + 1):
+            for c in range(col - cols, col + cols + 1):
+                candidates.update(self.cells.get((r, c), ()))
+
+        best = None
+        for i in candidates:
+            # Local equirectangular projection centered on the point.
+            ax = (self.lons[i] - lon) * m_per_deg_lon
+            ay = (self.lats[i] - lat) * m_per_deg_lat
+            dx = (self.lons[i + 1] - lon) * m_per_deg_lon - ax
+            dy = (self.lats[i + 1] - lat) * m_per_deg_lat - ay
+            t = min(max(-(ax * dx + ay * dy) / (dx * dx + dy * dy), 0.0), 1.0)
+            distance_m = math.hypot(ax + t * dx, ay + t * dy)
+
+            if distance_m <= max_distance_m and (
+                best is None or distance_m < best[0]
+            ):
+                start_m = self.cumulative_m[i]
+                along_m = start_m + t * (self.cumulative_m[i + 1] - start_m)
+                best = (distance_m, along_m)
+
+        return best
+
+    def _cell(self, degrees: float) -> int:
+        return math.floor(degrees / self.cell_deg)
+
+
+def _decode(geometry: Optional[str]) -> list[tuple[float, float]]:
+    try:
+        return polyline.decode(geometry) if geometry else []
+    except (ValueError, IndexError, TypeError):
+        return []
+
+
+def _cumulative_along_steps(
+    lats: list[float],
+    lons: list[float],
+    counts: list[int],
+    offsets_m: list[float],
+    step_distances_m: list[float],
+):
+    """Per-vertex route distance, scaling each step to its OSRM distance."""
+    if not counts:
+        return []
+
+    if np is None:
+        cumulative_m = []
+        start = 0
+        for count, offset_m, step_m in zip(
+            counts, offsets_m, step_distances_m
+        ):
+            end = start + count
+            segments_m = segment_lengths_m(lats[start:end], lons[start:end])
+            measured_m = sum(segments_m)
+            if measured_m <= 0:
+                segments_m = [1.0] * len(segments_m)
+                measured_m = float(len(segments_m))
+
+            travelled_m = 0.0
+            cumulative_m.append(offset_m)
+            for segment_m in segments_m:
+                travelled_m += segment_m * step_m / measured_m
+                cumulative_m.append(offset_m + travelled_m)
+            cumulative_m[-1] = offset_m + step_m
+            start = end
+
+        return cumulative_m
+
+    counts = np.asarray(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # Length of the segment ending at each vertex; 0 at step starts so
+    # segments never join two different steps.
+    segments_m = np.zeros(len(lats))
+    segments_m[1:] = segment_lengths_m(lats, lons)
+    segments_m[starts] = 0.0
+
+    measured_m = np.add.reduceat(segments_m, starts)
+    unmeasured = measured_m <= 0
+    if unmeasured.any():
+        vertex_steps = np.repeat(np.arange(len(counts)), counts)
+        segments_m[unmeasured[vertex_steps]] = 1.0
+        segments_m[starts] = 0.0
+        measured_m = np.where(unmeasured, counts - 1, measured_m)
+
+    step_distances_m = np.asarray(step_distances_m)
+    offsets_m = np.asarray(offsets_m)
+    scale = step_distances_m / measured_m
+    travelled_m = np.cumsum(segments_m * np.repeat(scale, counts))
+
+    cumulative_m = (
+        np.repeat(offsets_m, counts)
+        + travelled_m
+        - np.repeat(travelled_m[starts], counts)
+    )
+    # Exact step ends, so the end of the route is its OSRM distance and
+    # not a rounding error short of it.
+    cumulative_m[starts + counts - 1] = offsets_m + step_distances_m
+
+    return cumulative_m
@@ -0,0 +1,410 @@
+import math
+from dataclasses import dataclass, field
+from typing import Iterator, NamedTuple, Sequence
+from .enums import TimeLineChangeType
+from .constants import (
+    MAX_CYCLE_HOURS,
+    MAX_CYCLE_DAYS,
+    MAX_DRIVING_HOURS_PER_DAY,
+    MAX_DRIVING_HOURS_TO_REST,
+    BREAK_DURATION_H,
+    PICKUP_DURATION_H,
+    DROPOFF_DURATION_H,
+    TRIP_TIV_DURATION_H,
+    HOURS_IN_DAY,
+    NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX,
+)
+from .geometry import np
+
+OFF_DUTY = TimeLineChangeType.OFF_DUTY
+SLEEPER_BERTH = TimeLineChangeType.SLEEPER_BERTH
+DRIVING = TimeLineChangeType.DRIVING
+ON_DUTY = TimeLineChangeType.ON_DUTY
+
+
+class TripProfile(NamedTuple):
+    """
+    The only inputs the ELD logs depend on. Being a tuple of scalars it is
+    hashable, and `cache_key()` gives a string shared by every worker.
+    """
+
+    duration_s: float
+    distance_m: float
+    pickup_duration_s: float
+    cycle_hours_used: float
+
+    def quantized(
+        self,
+        duration_quantum_s: float = 0,
+        distance_quantum_m: float = 0,
+        cycle_hours_bucket: float = 0,
+    ) -> "TripProfile":
+        """The profile rounded to the given quanta (0 keeps a value)."""
+        return TripProfile(
+            # A route never rounds down to no driving at all, as the
+            # speed is derived from its duration.
+            duration_s=_quantize(
+                self.duration_s, duration_quantum_s, keep_nonzero=True
+            ),
+            distance_m=_quantize(self.distance_m, distance_quantum_m),
+            pickup_duration_s=_quantize(
+                self.pickup_duration_s, duration_quantum_s
+            ),
+            cycle_hours_used=_quantize(
+                self.cycle_hours_used, cycle_hours_bucket
+            ),
+        )
+
+    def cache_key(self) -> str:
+        return "|".join(repr(float(value)) for value in self)
+
+
+def _quantize(
+    value: float, quantum: float, keep_nonzero: bool = False
+) -> float:
+    if quantum <= 0:
+        return value
+
+    steps = round(value / quantum)
+    if keep_nonzero and value > 0:
+        steps = max(steps, 1)
+
+    return steps * quantum
+
+
+@dataclass(slots=True)
+class DutyPeriod:
+    status: TimeLineChangeType
+    start: float
+    end: float
+    activity: str
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "start": self.start,
+            "end": self.end,
+            "activity": self.activity,
+        }
+
+
+@dataclass(slots=True)
+class DayLog:
+    """One day of duty periods with running totals per duty status."""
+
+    day: int
+    periods: list[DutyPeriod] = field(default_factory=list)
+    # Totals start as ints, like the hours they are summed from, so the
+    # JSON output keeps `0` and `6` rather than `0.0` and `6.0`.
+    off_duty_hours: float = 0
+    sleeper_berth_hours: float = 0
+    driving_hours: float = 0
+    on_duty_hours: float = 0
+    time: float = 0
+
+    def add(self, status: TimeLineChangeType, hours: float, activity: str):
+        start = self.time
+        self.time = start + hours
+        self.periods.append(DutyPeriod(status, start, self.time, activity))
+
+        if status is DRIVING:
+            self.driving_hours += hours
+        elif status is OFF_DUTY:
+            self.off_duty_hours += hours
+        elif status is ON_DUTY:
+            self.on_duty_hours += hours
+        else:
+            self.sleeper_berth_hours += hours
+
+    def totals(self, speed_mph: float) -> dict:
+        return {
+            "day": self.day,
+            "off_duty_hours": round(self.off_duty_hours, 2),
+            "sleeper_berth_hours": round(self.sleeper_berth_hours, 2),
+            "driving_hours": round(self.driving_hours, 2),
+            "on_duty_hours": round(self.on_duty_hours, 2),
+            "total_on_duty": round(self.driving_hours + self.on_duty_hours, 2),
+            "daily_distance_miles": round(self.driving_hours * speed_mph, 2),
+        }
+
+    def to_dict(self, speed_mph: float) -> dict:
+        return {
+            **self.totals(speed_mph),
+            "duty_status_timeline": [
+                period.to_dict() for period in self.periods
+            ],
+        }
+
+
+@dataclass(slots=True)
+class HOSEngine:
+    """
+    Hours-of-service schedule for a trip under the 70-hour/8-day cycle.
+
+    `total_hours` is the driving time plus the pickup and dropoff hours.
+    Each day is built straight from its duty periods, and a whole cycle
+    reset (two off-duty days) is emitted as soon as the remaining cycle
+    hours can't cover a day of driving. With `pickup_done` (re-planning
+    past the pickup) `total_hours` only counts the dropoff hour.
+    """
+
+    total_hours: float
+    driving_hours_to_pickup: float
+    cycle_available: float
+    first_day: int = 1
+    pickup_done: bool = False
+
+    def days(self) -> Iterator[DayLog]:
+        remaining_hours = self.total_hours
+        hours_to_pickup = self.driving_hours_to_pickup
+        cycle_available = self.cycle_available
+        pickup_done = self.pickup_done
+        day_index = self.first_day
+        cycle_day = 1
+
+        while remaining_hours > 0:
+            if cycle_available < min(
+                remaining_hours, MAX_DRIVING_HOURS_PER_DAY
+            ):
+                for _ in range(2):
+                    day = DayLog(day_index)
+                    day.add(OFF_DUTY, HOURS_IN_DAY, "Off duty, cycle reset")
+                    yield day
+                    day_index += 1
+
+                cycle_available = MAX_CYCLE_HOURS
+                cycle_day = 0
+                continue
+
+            day = DayLog(day_index)
+            add = day.add
+
+            if day_index == 1:
+                add(OFF_DUTY, NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX, "Off duty")
+            else:
+                add(
+                    SLEEPER_BERTH,
+                    NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX,
+                    "Sleeper berth",
+                )
+            add(ON_DUTY, TRIP_TIV_DURATION_H, "Pre-Trip/TIV (30 min)")
+
+            if (
+                hours_to_pickup <= MAX_DRIVING_HOURS_PER_DAY
+                and not pickup_done
+            ):
+                add(
+                    DRIVING,
+                    min(hours_to_pickup, MAX_DRIVING_HOURS_TO_REST),
+                    "Driving to pickup",
+                )
+                if hours_to_pickup > MAX_DRIVING_HOURS_TO_REST:
+                    hours_to_pickup -= MAX_DRIVING_HOURS_TO_REST
+                    add(
+                        OFF_DUTY,
+                        BREAK_DURATION_H,
+                        "Off duty, 8 hours driving break (30 min)",
+                    )
+                    add(DRIVING, hours_to_pickup, "Driving to pickup")
+                add(ON_DUTY, PICKUP_DURATION_H, "Pickup (1 hour)")
+                pickup_done = True
+
+            add(
+                DRIVING,
+                min(
+                    remaining_hours,
+                    MAX_DRIVING_HOURS_TO_REST - day.driving_hours,
+                ),
+                "Driving before 8 hours rest",
+            )
+            if remaining_hours - day.driving_hours > 0:
+                add(
+                    OFF_DUTY,
+                    BREAK_DURATION_H,
+                    "Off duty, 8 hours driving break (30 min)",
+                )
+                add(
+                    DRIVING,
+                    min(
+                        remaining_hours - day.driving_hours,
+                        MAX_DRIVING_HOURS_PER_DAY - day.driving_hours,
+                    ),
+                    "Driving after 8 hours rest",
+                )
+
+            if remaining_hours - day.driving_hours <= 0:
+                add(ON_DUTY, DROPOFF_DURATION_H, "Dropoff (1 hour)")
+                add(
+                    OFF_DUTY,
+                    BREAK_DURATION_H * 3,
+                    "Off duty, end day rest (1.5 hours)",
+                )
+                add(
+                    OFF_DUTY, HOURS_IN_DAY - day.time, "Off duty, trip is done"
+                )
+            else:
+                add(ON_DUTY, TRIP_TIV_DURATION_H, "Post-Trip/TIV (30 min)")
+                add(
+                    OFF_DUTY,
+                    BREAK_DURATION_H * 3,
+                    "Off duty, end day rest (1.5 hours)",
+                )
+                add(SLEEPER_BERTH, HOURS_IN_DAY - day.time, "Sleeper berth")
+
+            yield day
+
+            remaining_hours -= day.driving_hours
+            cycle_available -= day.driving_hours
+
+            if not pickup_done:
+                hours_to_pickup -= day.driving_hours
+
+            day_index += 1
+            cycle_day += 1
+
+            if cycle_day >= MAX_CYCLE_DAYS:
+                cycle_available += MAX_DRIVING_HOURS_PER_DAY
+
+
+def sweep_cycle_hours(
+    total_hours: float,
+    driving_hours_to_pickup: float,
+    speed_mph: float,
+    cycle_hours_used: Sequence[float],
+) -> list[dict]:
+    """
+    Day count, arrival and per-day totals of one trip for many values of
+    the cycle hours already used, matching a separate ELDCalculator run
+    for each value.
+
+    The working days don't depend on the cycle hours, so they are built
+    once; a value only decides before which working days a cycle reset
+    is inserted. Those reset points are evaluated for every value at once
+    (with NumPy when available), and values sharing the same reset points
+    share their list of day totals.
+    """
+    work_days = list(
+        HOSEngine(total_hours, driving_hours_to_pickup, math.inf).days()
+    )
+    # A reset before the first working day turns its opening off-duty
+    # period into sleeper berth.
+    first_after_reset = next(
+        HOSEngine(
+            total_hours, driving_hours_to_pickup, math.inf, first_day=3
+        ).days()
+    )
+
+    needs = []
+    remaining_hours = total_hours
+    for day in work_days:
+        needs.append(min(remaining_hours, MAX_DRIVING_HOURS_PER_DAY))
+        remaining_hours -= day.driving_hours
+
+    available = [
+        max(0, MAX_CYCLE_HOURS - used_hours) for used_hours in cycle_hours_used
+    ]
+    reset_points = _reset_points(
+        available, needs, [day.driving_hours for day in work_days]
+    )
+
+    reset_day = DayLog(0)
+    reset_day.add(OFF_DUTY, HOURS_IN_DAY, "Off duty, cycle reset")
+    reset_totals = _totals_without_day(reset_day, speed_mph)
+    work_totals = [_totals_without_day(day, speed_mph) for day in work_days]
+    first_after_reset_totals = _totals_without_day(
+        first_after_reset, speed_mph
+    )
+    dropoff_end = next(
+        period.end
+        for period in work_days[-1].periods
+        if period.activity == "Dropoff (1 hour)"
+    )
+
+    schedules: dict[tuple[int, ...], list[dict]] = {}
+    results = []
+    for used_hours, resets in zip(cycle_hours_used, reset_points):
+        daily_totals = schedules.get(resets)
+        if daily_totals is None:
+            daily_totals = []
+            for index, totals in enumerate(work_totals):
+                if index in resets:
+                    for _ in range(2):
+                        daily_totals.append(
+                            {"day": len(daily_totals) + 1, **reset_totals}
+                        )
+                    if index == 0:
+                        totals = first_after_reset_totals
+                daily_totals.append({"day": len(daily_totals) + 1, **totals})
+            schedules[resets] = daily_totals
+
+        results.append(
+            {
+                "current_cycle_hours": used_hours,
+                "days": len(daily_totals),
+                "arrival_hours": (len(daily_totals) - 1) * HOURS_IN_DAY
+                + dropoff_end,
+                "daily_totals": daily_totals,
+            }
+        )
+
+    return results
+
+
+def _totals_without_day(day: DayLog, speed_mph: float) -> dict:
+    totals = day.totals(speed_mph)
+    del totals["day"]
+    return totals
+
+
+def _reset_points(
+    available: list[float], needs: list[float], driven: list[float]
+) -> list[tuple[int, ...]]:
+    """
+    For every starting cycle availability, the indices of the working
+    days that are preceded by a cycle reset.
+    """
+    if np is None:
+        return [
+            _reset_points_python(hours, needs, driven) for hours in available
+        ]
+
+    cycle_available = np.asarray(available, dtype=float)
+    cycle_day = np.ones(len(cycle_available), dtype=int)
+    resets = np.zeros((len(cycle_available), len(needs)), dtype=bool)
+
+    for index, (need, driving_hours) in enumerate(zip(needs, driven)):
+        reset = cycle_available < need
+        resets[:, index] = reset
+        cycle_available[reset] = MAX_CYCLE_HOURS
+        cycle_day[reset] = 0
+
+        cycle_available -= driving_hours
+        cycle_day += 1
+        cycle_available[
+            cycle_day >= MAX_CYCLE_DAYS
+        ] += MAX_DRIVING_HOURS_PER_DAY
+
+    patterns, inverse = np.unique(resets, axis=0, return_inverse=True)
+    pattern_points = [tuple(np.flatnonzero(row).tolist()) for row in patterns]
+
+    return [pattern_points[i] for i in inverse.reshape(-1).tolist()]
+
+
+def _reset_points_python(
+    cycle_available: float, needs: list[float], driven: list[float]
+) -> tuple[int, ...]:
+    points = []
+    cycle_day = 1
+
+    for index, (need, driving_hours) in enumerate(zip(needs, driven)):
+        if cycle_available < need:
+            points.append(index)
+            cycle_available = MAX_CYCLE_HOURS
+            cycle_day = 0
+
+        cycle_available -= driving_hours
+        cycle_day += 1
+        if cycle_day >= MAX_CYCLE_DAYS:
+            cycle_available += MAX_DRIVING_HOURS_PER_DAY
+
+    return tuple(points)
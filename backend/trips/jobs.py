@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .constants import JOB_MAX_WORKERS, JOB_RETENTION_S, JOB_STALE_S
+from .enums import JobStatus, LogFormat, UpstreamPriority
+from .models import PlanningJob
+from .planning import PlanningError, error_event
+from .plans import route_response
+from .upstream import upstream_priority
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_recovered_at: Optional[float] = None
+_recovery_lock = threading.Lock()
+
+
+def get_job_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool running planning jobs. It is separate from the
+    upstream pool because every job fans out its own upstream calls there.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(JOB_MAX_WORKERS, 1),
+                    thread_name_prefix="trips-jobs",
+                )
+
+    return _executor
+
+
+def submit_job(
+    data: dict,
+    route_view: str,
+    zoom: Optional[int] = None,
+    log_format: str = LogFormat.FULL,
+) -> PlanningJob:
+    """Store a trip to plan and hand it to the job workers."""
+    cutoff = timezone.now() - timedelta(seconds=JOB_RETENTION_S)
+    PlanningJob.objects.filter(
+        Q(finished_at__lt=cutoff)
+        | Q(finished_at__isnull=True, created_at__lt=cutoff)
+    ).delete()
+    recover_stale_jobs()
+
+    job = PlanningJob.objects.create(
+        request={
+            "trip": data,
+            "route": route_view,
+            "zoom": zoom,
+            "logs": log_format,
+        }
+    )
+    transaction.on_commit(lambda: _enqueue(job.pk))
+
+    return job
+
+
+def recover_stale_jobs() -> None:
+    """
+    Pick up the jobs a restarted or recycled worker process left behind,
+    as their queue only lived in its memory: jobs still queued after
+    JOB_STALE_S are enqueued again here (running them stays claimed by a
+    single worker), jobs running for longer than that are failed. Runs
+    on the first call in a process, then at most every JOB_STALE_S / 2.
+    """
+    global _recovered_at
+
+    with _recovery_lock:
+        now = time.monotonic()
+        if _recovered_at is not None and now - _recovered_at < JOB_STALE_S / 2:
+            return
+        _recovered_at = now
+
+    stale_before = timezone.now() - timedelta(seconds=JOB_STALE_S)
+    failed = PlanningJob.objects.filter(
+        status=JobStatus.RUNNING, started_at__lt=stale_before
+    ).update(
+        status=JobStatus.FAILED,
+        error={"message": "Job was interrupted", "status": 503},
+        finished_at=timezone.now(),
+    )
+    if failed:
+        logger.warning(f"Failed {failed} interrupted planning jobs")
+
+    stale_ids = list(
+        PlanningJob.objects.filter(
+            status=JobStatus.QUEUED, created_at__lt=stale_before
+        ).values_list("pk", flat=True)
+    )
+    if stale_ids:
+        logger.warning(f"Re-enqueuing {len(stale_ids)} stale planning jobs")
+    for job_id in stale_ids:
+        _enqueue(job_id)
+
+
+def _enqueue(job_id):
+    if JOB_MAX_WORKERS <= 0:
+        run_job(job_id)
+    else:
+        get_job_executor().submit(_run_in_worker, job_id)
+
+
+def _run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id) -> None:
+    """Plan a queued job and store its result or error."""
+    try:
+        claimed = PlanningJob.objects.filter(
+            pk=job_id, status=JobStatus.QUEUED
+        ).update(status=JobStatus.RUNNING, started_at=timezone.now())
+        if not claimed:
+            return
+
+        request = PlanningJob.objects.get(pk=job_id).request
+        outcome = {"result": None, "error": None}
+
+        try:
+            with upstream_priority(UpstreamPriority.BACKGROUND):
+                outcome["result"] = route_response(
+                    request["trip"],
+                    request["route"],
+                    request["zoom"],
+                    request.get("logs", LogFormat.FULL),
+                )
+            outcome["status"] = JobStatus.SUCCEEDED
+        except PlanningError as e:
+            outcome["error"] = error_event(e)["error"]
+            outcome["status"] = JobStatus.FAILED
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            outcome["error"] = {
+                "message": "Internal Server Error",
+                "status": 500,
+            }
+            outcome["status"] = JobStatus.FAILED
+
+        # A job running past JOB_STALE_S may have been failed as
+        # interrupted meanwhile; that outcome has been served, keep it.
+        finished = PlanningJob.objects.filter(
+            pk=job_id, status=JobStatus.RUNNING
+        ).update(finished_at=timezone.now(), **outcome)
+        if not finished:
+            logger.warning(f"Job {job_id} finished after it was failed")
+    except Exception as e:
+        logger.error(f"Error running job {job_id}: {e}")
+
+
+def job_response(job: PlanningJob) -> dict:
+    response = {"job_id": str(job.pk), "status": job.status}
+
+    if job.status == JobStatus.SUCCEEDED:
+        response["result"] = job.result
+    elif job.status == JobStatus.FAILED:
+        response["error"] = job.error
+
+    return response
@@ -0,0 +1,238 @@
+import mmap
+import struct
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+from .constants import LANE_MATRIX_PATH
+
+MAGIC = b"TLM1"
+# magic, number of sites, length of the newline-separated site keys
+HEADER = struct.Struct("<4sIQ")
+# duration (s, negative when the lane could not be routed), distance (m),
+# offset of the geometry then summary in the data blob, their lengths,
+# and the last vertex of the geometry (polyline units, 1e-5 degrees)
+ENTRY = struct.Struct("<ddQIIii")
+MISSING_DURATION = -1.0
+
+
+def write_lane_matrix(
+    path: Path,
+    site_keys: list[str],
+    legs: Iterable[tuple[int, int, Optional[dict]]],
+) -> int:
+    """
+    Write the lanes between every pair of sites, given as
+    `(from, to, leg)` in any order, where `leg` has the `duration`,
+    `distance`, `geometry` and `summary` of the route from site `from` to
+    site `to`, or is None when it could not be routed. Returns the number
+    of lanes written.
+    """
+    n_sites = len(site_keys)
+    keys = "\n".join(site_keys).encode()
+    entries_at = HEADER.size + len(keys)
+    written = 0
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n_sites, len(keys)))
+        f.write(keys)
+        missing = ENTRY.pack(MISSING_DURATION, 0, 0, 0, 0, 0, 0)
+        f.write(missing * (n_sites * n_sites))
+
+        data_offset = 0
+        for i, j, leg in legs:
+            if leg is None:
+                continue
+
+            geometry = (leg.get("geometry") or "").encode()
+            summary = (leg.get("summary") or "").encode()
+            last_lat, last_lon = _last_point(geometry)
+
+            f.seek(0, 2)
+            f.write(geometry)
+            f.write(summary)
+            f.seek(entries_at + (i * n_sites + j) * ENTRY.size)
+            f.write(
+                ENTRY.pack(
+                    float(leg.get("duration", 0)),
+                    float(leg.get("distance", 0)),
+                    data_offset,
+                    len(geometry),
+                    len(summary),
+                    last_lat,
+                    last_lon,
+                )
+            )
+            data_offset += len(geometry) + len(summary)
+            written += 1
+
+    return written
+
+
+class LaneMatrix:
+    """
+    Precomputed lanes between known sites, read in place from a
+    memory-mapped `write_lane_matrix` file. Routes between sites are
+    assembled from their lanes without calling OSRM.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._n_sites, keys_len = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"Not a lane matrix: {path}")
+
+        keys = self._map[HEADER.size : HEADER.size + keys_len].decode()
+        self._sites = {
+            key: index
+            for index, key in enumerate(keys.split("\n") if keys else [])
+        }
+        self._entries_at = HEADER.size + keys_len
+        self._data_at = (
+            self._entries_at + self._n_sites * self._n_sites * ENTRY.size
+        )
+
+    def __len__(self) -> int:
+        return self._n_sites
+
+    def leg(self, from_key: str, to_key: str) -> Optional[dict]:
+        """The lane between two sites, as an OSRM-shaped leg."""
+        i = self._sites.get(from_key)
+        j = self._sites.get(to_key)
+        if i is None or j is None:
+            return None
+
+        duration, distance, offset, geometry_len, summary_len, *last = (
+            ENTRY.unpack_from(
+                self._map,
+                self._entries_at + (i * self._n_sites + j) * ENTRY.size,
+            )
+        )
+        if duration < 0:
+            return None
+
+        start = self._data_at + offset
+        geometry = self._map[start : start + geometry_len].decode()
+        summary = self._map[
+            start + geometry_len : start + geometry_len + summary_len
+        ].decode()
+
+        return {
+            "duration": duration,
+            "distance": distance,
+            "summary": summary,
+            "geometry": geometry,
+            "last_point": last,
+        }
+
+    def route(self, coords: str) -> Optional[dict]:
+        """
+        An OSRM-shaped route through the sites of an OSRM `lon,lat;...`
+        coordinate string, or None unless every lane is known.
+        """
+        keys = coords.split(";")
+        legs = [self.leg(a, b) for a, b in zip(keys, keys[1:])]
+        if not legs or any(leg is None for leg in legs):
+            return None
+
+        geometry, last_point = legs[0]["geometry"], legs[0]["last_point"]
+        for leg in legs[1:]:
+            if leg["geometry"]:
+                geometry = _splice(geometry, last_point, leg["geometry"])
+                last_point = leg["last_point"]
+
+        return {
+            "geometry": geometry,
+            "distance": sum(leg["distance"] for leg in legs),
+            "duration": sum(leg["duration"] for leg in legs),
+            "legs": [
+                {
+                    "distance": leg["distance"],
+                    "duration": leg["duration"],
+                    "summary": leg["summary"],
+                    # One step spanning the lane, for stop placement.
+                    "steps": [
+                        {
+                            "geometry": leg["geometry"],
+                            "distance": leg["distance"],
+                            "duration": leg["duration"],
+                        }
+                    ],
+                }
+                for leg in legs
+            ],
+        }
+
+
+def _read_value(encoded: bytes, index: int) -> tuple[int, int]:
+    """Decode one polyline value starting at `index`."""
+    result = shift = 0
+    while True:
+        chunk = encoded[index] - 63
+        index += 1
+        result |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            break
+
+    value = ~(result >> 1) if result & 1 else result >> 1
+    return value, index
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+    return "".join(chunks)
+
+
+def _last_point(geometry: bytes) -> tuple[int, int]:
+    lat = lon = index = 0
+    while index < len(geometry):
+        d_lat, index = _read_value(geometry, index)
+        d_lon, index = _read_value(geometry, index)
+        lat += d_lat
+        lon += d_lon
+
+    return lat, lon
+
+
+def _splice(head: str, head_last: list[int], tail: str) -> str:
+    """
+    Join two encoded polylines without decoding them: only the first
+    vertex of `tail` is re-encoded relative to the last one of `head`,
+    and dropped when both are the same waypoint.
+    """
+    if not head:
+        return tail
+
+    encoded = tail.encode()
+    lat, index = _read_value(encoded, 0)
+    lon, index = _read_value(encoded, index)
+    d_lat, d_lon = lat - head_last[0], lon - head_last[1]
+
+    if d_lat == 0 and d_lon == 0:
+        return head + tail[index:]
+
+    return head + _encode_value(d_lat) + _encode_value(d_lon) + tail[index:]
+
+
+_lane_matrix: Optional[LaneMatrix] = None
+_lane_matrix_lock = threading.Lock()
+
+
+def get_lane_matrix() -> Optional[LaneMatrix]:
+    """The configured lane matrix, opened once per process, or None."""
+    global _lane_matrix
+
+    if _lane_matrix is None and LANE_MATRIX_PATH:
+        with _lane_matrix_lock:
+            if _lane_matrix is None:
+                _lane_matrix = LaneMatrix(Path(LANE_MATRIX_PATH))
+
+    return _lane_matrix
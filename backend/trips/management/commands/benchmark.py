@@ -0,0 +1,317 @@
+import json
+from contextlib import contextmanager
+from unittest import mock
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from trips.benchmarks import (
+    bench_geometry,
+    bench_sweep,
+    compare,
+    environment,
+    measure,
+)
+from trips.models import TripPlan
+from trips.planning import LOCATION_FIELDS, plan_cache, route_cache
+from trips.plans import input_hash
+from trips.stub_upstream import (
+    RECORDED_DIR,
+    StubUpstreamServer,
+    load_responses,
+    load_scenarios,
+    record_responses,
+    recorded_path,
+    scenario_coords,
+)
+from trips.upstream import nominatim_client, osrm_client
+from trips.utils import (
+    ELDCalculator,
+    call_osrm_route,
+    eld_cache,
+    geocode,
+    geocode_cache,
+    get_stops,
+    interpolate_point_along_legs,
+)
+from trips.views import TripRouteView
+
+# Caches used while benchmarking: no shared tier, so every cold run
+# really misses.
+BENCH_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+def bench_pipeline(
+    repeat: int, scenarios: list[dict], responses: dict[str, dict]
+) -> list[dict]:
+    """
+    Every stage of planning each scenario trip, from geocoding to the
+    rendered TripRouteView response. Upstream calls go over HTTP to a
+    local StubUpstreamServer answering with `responses`, which is not
+    rate limited.
+    """
+    rows = []
+
+    with StubUpstreamServer(responses) as stub, mock.patch(
+        "trips.utils.NOMINATIM_URL", stub.nominatim_url
+    ), mock.patch(
+        "trips.utils.OSRM_ROUTE_URL", stub.osrm_route_url
+    ), mock.patch.object(
+        nominatim_client, "rate_limiter", None
+    ), mock.patch.object(
+        osrm_client, "rate_limiter", None
+    ), override_settings(
+        CACHES=BENCH_CACHES
+    ):
+        for scenario in scenarios:
+            rows.extend(
+                _bench_scenario(repeat, scenario, responses[scenario["name"]])
+            )
+
+    return rows
+
+
+@contextmanager
+def bench_database():
+    """
+    Run on a freshly migrated throwaway database, like the test runner,
+    so the pipeline neither needs the configured database migrated nor
+    leaves benchmark plans in it.
+    """
+    name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+
+
+def _clear_caches():
+    for cache in (geocode_cache, route_cache, plan_cache, eld_cache):
+        cache.clear()
+
+
+def _bench_scenario(repeat: int, scenario: dict, responses: dict) -> list:
+    upstream = "recorded" if recorded_path(scenario).exists() else "synthetic"
+    name = scenario["name"]
+    trip = scenario["trip"]
+    addresses = [trip[field] for field in LOCATION_FIELDS]
+    coords = [
+        [
+            float(responses["nominatim"][address][0][key])
+            for key in ("lat", "lon")
+        ]
+        for address in addresses
+    ]
+    route = next(iter(responses["osrm"].values()))["routes"][0]
+
+    factory = APIRequestFactory()
+    view = TripRouteView.as_view()
+
+    def geocode_all():
+        for address in addresses:
+            geocode(address)
+
+    def post_trip():
+        view(factory.post("/api/route/", trip, format="json")).render()
+
+    def forget_trip():
+        # A cold run plans the trip again instead of serving it stored.
+        _clear_caches()
+        TripPlan.objects.filter(input_hash=input_hash(trip)).delete()
+
+    stages = [
+        ("geocode", geocode_all, _clear_caches),
+        (
+            "call_osrm_route",
+            lambda: call_osrm_route(scenario_coords(scenario)),
+            None,
+        ),
+        ("get_stops", lambda: get_stops(route, *coords), None),
+        (
+            "interpolate_point_along_legs",
+            lambda: interpolate_point_along_legs(
+                route["legs"], route["distance"] / 2
+            ),
+            None,
+        ),
+        (
+            "eld_logs",
+            lambda: ELDCalculator(
+                route=route,
+                curr_cycle_used_hours=trip["current_cycle_hours"],
+            ).get_eld_logs(),
+            None,
+        ),
+        ("view.cold", post_trip, forget_trip),
+        ("view.warm", post_trip, None),
+    ]
+
+    return [
+        {
+            "name": f"{stage}[{name}]",
+            "upstream": upstream,
+            **measure(fn, repeat, setup=setup),
+        }
+        for stage, fn, setup in stages
+    ]
+
+
+SUITES = ("geometry", "sweep", "pipeline")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the hot paths of the trip planning pipeline. Upstream "
+        "calls are served by a local stub from recorded (or synthetic) "
+        "Nominatim/OSRM responses; save a run with --output and check a "
+        "later one against it with --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--suite",
+            action="append",
+            choices=SUITES,
+            help="Suite to run, can be repeated (default: all)",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            help="Pipeline scenario to run, can be repeated (default: all)",
+        )
+        parser.add_argument(
+            "--points",
+            type=int,
+            default=50000,
+            help="Number of vertices of the synthetic route geometry",
+        )
+        parser.add_argument(
+            "--sweep-values",
+            type=int,
+            default=2000,
+            help="Number of cycle hour values of the what-if sweep",
+        )
+        parser.add_argument(
+            "--record",
+            action="store_true",
+            help="Fetch the scenario responses from the real upstreams "
+            f"into {RECORDED_DIR} before running",
+        )
+        parser.add_argument("--output", help="Write the results as JSON")
+        parser.add_argument(
+            "--compare", help="Results JSON of a previous run to compare to"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Relative slowdown or memory growth counted as a "
+            "regression (default: 0.2)",
+        )
+
+    def handle(self, *args, **options):
+        suites = options["suite"] or SUITES
+        repeat = options["repeat"]
+        rows = []
+
+        if "geometry" in suites:
+            rows += bench_geometry(repeat=repeat, n_points=options["points"])
+        if "sweep" in suites:
+            rows += bench_sweep(
+                repeat=repeat, n_values=options["sweep_values"]
+            )
+        if "pipeline" in suites:
+            scenarios = self._scenarios(options["scenario"])
+            if options["record"]:
+                self._record(scenarios)
+            synthetic = [
+                scenario["name"]
+                for scenario in scenarios
+                if not recorded_path(scenario).exists()
+            ]
+            if synthetic:
+                self.stderr.write(
+                    "No recorded responses for "
+                    f"{', '.join(synthetic)}, using synthetic ones; "
+                    "record them with --record"
+                )
+            responses = {
+                scenario["name"]: load_responses(scenario)
+                for scenario in scenarios
+            }
+            with bench_database():
+                rows += bench_pipeline(repeat, scenarios, responses)
+
+        width = max(len(row["name"]) for row in rows)
+        for row in rows:
+            self.stdout.write(
+                f"{row['name']:<{width}}  "
+                f"best {row['best_ms']:>10.3f} ms  "
+                f"median {row['median_ms']:>10.3f} ms  "
+                f"peak {row['peak_kib']:>10.1f} KiB"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"environment": environment(), "rows": rows}, f)
+
+        if options["compare"]:
+            self._compare(rows, options["compare"], options["tolerance"])
+
+    def _scenarios(self, names):
+        scenarios = load_scenarios()
+        if not names:
+            return scenarios
+
+        unknown = set(names) - {scenario["name"] for scenario in scenarios}
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+
+        return [
+            scenario for scenario in scenarios if scenario["name"] in names
+        ]
+
+    def _record(self, scenarios):
+        RECORDED_DIR.mkdir(parents=True, exist_ok=True)
+        for scenario in scenarios:
+            path = RECORDED_DIR / f"{scenario['name']}.json"
+            path.write_text(json.dumps(record_responses(scenario)))
+            self.stdout.write(f"Recorded {path}")
+
+    def _compare(self, rows, path, tolerance):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        if baseline.get("environment") != environment():
+            self.stderr.write(
+                "Baseline was recorded in a different environment: "
+                f"{baseline.get('environment')}"
+            )
+
+        changes = compare(rows, baseline.get("rows", []), tolerance)
+        for change in changes:
+            line = (
+                f"{change['name']}: "
+                f"best {change.get('best_ms', 0):+.1%}, "
+                f"peak {change.get('peak_kib', 0):+.1%}"
+            )
+            self.stdout.write(
+                self.style.ERROR(line) if change["regressed"] else line
+            )
+
+        regressed = [change for change in changes if change["regressed"]]
+        if regressed:
+            raise CommandError(
+                f"{len(regressed)} of {len(changes)} benchmarks regressed "
+                f"by more than {tolerance:.0%}"
+            )
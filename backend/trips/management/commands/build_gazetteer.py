@@ -0,0 +1,38 @@
+from itertools import chain
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from trips.gazetteer import build_index, read_source, write_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the local geocoder index from CSV (name, lat, lon, aliases) "
+        "and GeoNames dump sources, place or postal code (zip centroid) "
+        "dumps. CSV names win over GeoNames places. Point "
+        "GEOCODER_GAZETTEER_PATH at the output to resolve those places "
+        "without Nominatim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sources",
+            nargs="+",
+            help="CSV files (.csv) or GeoNames place or postal code dumps "
+            "(any other extension)",
+        )
+        parser.add_argument(
+            "--output", required=True, help="Path of the index file to write"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            index = build_index(
+                chain.from_iterable(
+                    read_source(Path(source)) for source in options["sources"]
+                )
+            )
+            write_index(index, Path(options["output"]))
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(e)
+
+        self.stdout.write(f"Indexed {len(index)} names to {options['output']}")
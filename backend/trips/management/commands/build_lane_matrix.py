@@ -0,0 +1,76 @@
+from functools import partial
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from trips.concurrency import iter_completed
+from trips.gazetteer import read_csv
+from trips.lanes import write_lane_matrix
+from trips.planning import format_coords
+from trips.utils import call_osrm_route
+
+
+def route_lane(from_key: str, to_key: str) -> dict:
+    route = call_osrm_route(f"{from_key};{to_key}")["routes"][0]
+
+    return {
+        "duration": route["duration"],
+        "distance": route["distance"],
+        "geometry": route.get("geometry"),
+        "summary": route["legs"][0].get("summary", ""),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Route every pair of sites of a CSV (name, lat, lon) with OSRM and "
+        "store the lanes in a memory-mapped file. Point LANE_MATRIX_PATH at "
+        "the output to plan trips between those sites without OSRM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("sites", help="Path to the sites CSV file")
+        parser.add_argument(
+            "--output", required=True, help="Path of the matrix file to write"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            site_keys = list(
+                dict.fromkeys(
+                    format_coords([(lat, lon)])
+                    for _, lat, lon, _ in read_csv(Path(options["sites"]))
+                )
+            )
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(e)
+
+        calls = {
+            (i, j): partial(route_lane, a, b)
+            for i, a in enumerate(site_keys)
+            for j, b in enumerate(site_keys)
+            if i != j
+        }
+        failed = []
+
+        def legs():
+            for i in range(len(site_keys)):
+                yield i, i, {"duration": 0, "distance": 0}
+
+            for (i, j), leg, error in iter_completed(calls):
+                if error is not None:
+                    failed.append((site_keys[i], site_keys[j], error))
+                yield i, j, leg
+
+        try:
+            written = write_lane_matrix(
+                Path(options["output"]), site_keys, legs()
+            )
+        except OSError as e:
+            raise CommandError(e)
+
+        for a, b, error in failed:
+            self.stderr.write(f"{a} -> {b}: {error}")
+
+        self.stdout.write(
+            f"Stored {written} lanes between {len(site_keys)} sites "
+            f"in {options['output']}"
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from trips.plans import prune_trip_plans
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored trip plans not updated (saved, reused, served or "
+        "re-planned) for TRIP_PLAN_RETENTION_S. Run it periodically."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_trip_plans()
+        self.stdout.write(f"Deleted {deleted} trip plans")
@@ -0,0 +1,61 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from trips.enums import UpstreamPriority
+from trips.planning import (
+    LOCATION_FIELDS,
+    PlanningError,
+    format_coords,
+    geocode_locations,
+    get_route,
+    plan_trip,
+)
+from trips.upstream import upstream_priority
+
+
+class Command(BaseCommand):
+    help = (
+        "Warm the geocode, route and plan caches from a CSV lane list with "
+        "current_location, pickup_location, dropoff_location and optional "
+        "current_cycle_hours columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("lanes", help="Path to the lane list CSV file")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["lanes"], newline="") as f:
+                lanes = list(csv.DictReader(f))
+        except OSError as e:
+            raise CommandError(e)
+
+        warmed = 0
+        # Waits its turn for upstream tokens rather than failing fast.
+        with upstream_priority(UpstreamPriority.BACKGROUND):
+            for line_number, lane in enumerate(lanes, start=2):
+                try:
+                    if lane.get("current_cycle_hours"):
+                        plan_trip(
+                            {
+                                **lane,
+                                "current_cycle_hours": float(
+                                    lane["current_cycle_hours"]
+                                ),
+                            }
+                        )
+                    else:
+                        locations = geocode_locations(lane)
+                        get_route(
+                            format_coords(
+                                [locations[field] for field in LOCATION_FIELDS]
+                            )
+                        )
+                except (PlanningError, KeyError, ValueError) as e:
+                    self.stderr.write(f"Line {line_number}: {e}")
+                    continue
+
+                warmed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Warmed {warmed} of {len(lanes)} lanes")
+        )
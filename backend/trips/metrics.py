@@ -0,0 +1,293 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS_S = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+METRIC_HELP = {
+    "trips_request_seconds": "Time to answer a request, by URL name.",
+    "trips_stage_seconds": "Time spent in each trip planning stage.",
+    "trips_upstream_request_seconds": (
+        "Time of each upstream HTTP attempt, by upstream and outcome."
+    ),
+}
+
+
+class Histogram:
+    """Thread-safe cumulative histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS_S):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+# Histograms of this worker process, by (metric name, sorted labels).
+_histograms: dict[tuple[str, tuple[tuple[str, str], ...]], Histogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(metric: str, seconds: float, **labels: str):
+    key = (metric, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+
+    histogram.observe(seconds)
+
+
+class StageTimings:
+    """
+    Time spent per stage while answering one request, reported in its
+    `Server-Timing` header. Stages that run several times (e.g. one
+    geocode per address, in parallel) are summed and counted.
+    """
+
+    def __init__(self):
+        self._stages: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            total = self._stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def as_dict(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                stage: {"seconds": seconds, "count": count}
+                for stage, (seconds, count) in self._stages.items()
+            }
+
+    def header(self, total_s: Optional[float] = None) -> str:
+        entries = []
+        for stage, timing in self.as_dict().items():
+            entry = f"{stage};dur={timing['seconds'] * 1000:.1f}"
+            if timing["count"] > 1:
+                entry += f';desc="{timing["count"]} calls"'
+            entries.append(entry)
+
+        if total_s is not None:
+            entries.append(f"total;dur={total_s * 1000:.1f}")
+
+        return ", ".join(entries)
+
+
+# Timings of the request being handled. Worker pool calls inherit it, see
+# `concurrency.iter_completed`.
+request_timings: ContextVar[Optional[StageTimings]] = ContextVar(
+    "trips_request_timings", default=None
+)
+
+
+def record(
+    metric: str,
+    seconds: float,
+    server_timing: Optional[str] = None,
+    **labels: str,
+):
+    """
+    Observe a duration in the `metric` histogram and, as `server_timing`,
+    in the timings of the current request if there is one.
+    """
+    observe(metric, seconds, **labels)
+
+    timings = request_timings.get()
+    if server_timing and timings is not None:
+        timings.add(server_timing, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a planning stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(
+            "trips_stage_seconds",
+            time.perf_counter() - start,
+            server_timing=stage,
+            stage=stage,
+        )
+
+
+def render_prometheus() -> str:
+    """
+    The metrics of this worker process in the Prometheus text format:
+    latency histograms, cache counters and circuit breaker states.
+    """
+    from .cache import cache_stats
+    from .singleflight import single_flight_stats
+    from .upstream import nominatim_client, osrm_client
+
+    lines = []
+
+    with _histograms_lock:
+        histograms = sorted(_histograms.items())
+
+    described = set()
+    for (metric, labels), histogram in histograms:
+        if metric not in described:
+            described.add(metric)
+            lines.append(f"# HELP {metric} {METRIC_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip([*histogram.buckets, "+Inf"], counts):
+            cumulative += bucket_count
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            lines.append(
+                f"{metric}_bucket{_labels(labels, le=le)} {cumulative}"
+            )
+        lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+        lines.append(f"{metric}_count{_labels(labels)} {count}")
+
+    stats = cache_stats()
+    for metric, kind, help_text, value in (
+        (
+            "trips_cache_hits_total",
+            "counter",
+            "Cache hits by cache and tier.",
+            None,
+        ),
+        (
+            "trips_cache_misses_total",
+            "counter",
+            "Cache lookups missing both tiers.",
+            "misses",
+        ),
+        (
+            "trips_cache_hit_ratio",
+            "gauge",
+            "Share of lookups served by either tier.",
+            "hit_ratio",
+        ),
+        (
+            "trips_cache_entries",
+            "gauge",
+            "Entries in the in-process tier.",
+            "size",
+        ),
+        (
+            "trips_cache_weight_bytes",
+            "gauge",
+            "Approximate size of the in-process tier.",
+            "weight",
+        ),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, cache in sorted(stats.items()):
+            if value is None:
+                for tier in ("local", "shared"):
+                    lines.append(
+                        f"{metric}{_labels((), cache=name, tier=tier)} "
+                        f"{cache[f'{tier}_hits']}"
+                    )
+            else:
+                lines.append(
+                    f"{metric}{_labels((), cache=name)} {cache[value]}"
+                )
+
+    lines.append(
+        "# HELP trips_singleflight_calls_total "
+        "Coalesced calls by role: leaders called upstream, followers "
+        "shared a call of this or (shared_followers) another worker."
+    )
+    lines.append("# TYPE trips_singleflight_calls_total counter")
+    for name, flight in sorted(single_flight_stats().items()):
+        for role, count in flight.items():
+            lines.append(
+                "trips_singleflight_calls_total"
+                f"{_labels((), flight=name, role=role)} {count}"
+            )
+
+    limited = [
+        client
+        for client in (nominatim_client, osrm_client)
+        if client.rate_limiter is not None
+    ]
+    lines.append(
+        "# HELP trips_upstream_queued " "Calls waiting for a rate limit token."
+    )
+    lines.append("# TYPE trips_upstream_queued gauge")
+    for client in limited:
+        lines.append(
+            f"trips_upstream_queued{_labels((), upstream=client.name)} "
+            f"{client.rate_limiter.queued}"
+        )
+    lines.append(
+        "# HELP trips_upstream_rejected_total "
+        "Calls rejected because they would wait too long for a token."
+    )
+    lines.append("# TYPE trips_upstream_rejected_total counter")
+    for client in limited:
+        lines.append(
+            f"trips_upstream_rejected_total"
+            f"{_labels((), upstream=client.name)} "
+            f"{client.rate_limiter.rejected}"
+        )
+
+    lines.append(
+        "# HELP trips_upstream_circuit_open "
+        "1 while the upstream circuit breaker is open."
+    )
+    lines.append("# TYPE trips_upstream_circuit_open gauge")
+    for client in (nominatim_client, osrm_client):
+        lines.append(
+            f"trips_upstream_circuit_open{_labels((), upstream=client.name)} "
+            f"{int(client.breaker.is_open)}"
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple[tuple[str, str], ...], **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
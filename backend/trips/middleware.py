@@ -0,0 +1,105 @@
+import time
+from django.utils.cache import patch_vary_headers
+from .compression import (
+    compress,
+    compressed_cache,
+    compressed_key,
+    negotiate_encoding,
+)
+from .constants import COMPRESSION_MIN_BYTES, SERVER_TIMING_ENABLED
+from .metrics import StageTimings, observe, request_timings
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/msgpack",
+    "text/",
+)
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the stage timings of each request, report them in a
+    `Server-Timing` header and observe the total request latency.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = StageTimings()
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+
+        # Streaming responses are timed up to their first byte.
+        total_s = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        observe(
+            "trips_request_seconds",
+            total_s,
+            view=(match.url_name if match else None) or "unmatched",
+        )
+
+        if SERVER_TIMING_ENABLED:
+            response["Server-Timing"] = timings.header(total_s)
+            # Let cross-origin pages read the timings too.
+            response["Timing-Allow-Origin"] = "*"
+
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compress response bodies of at least COMPRESSION_MIN_BYTES with the
+    encoding negotiated from `Accept-Encoding`. Bodies of responses with
+    a strong ETag are compressed once and reused from `compressed_cache`.
+    Streamed responses are left alone so their lines are flushed as they
+    come.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if (
+            response.streaming
+            or response.status_code != 200
+            or response.has_header("Content-Encoding")
+            or len(response.content) < COMPRESSION_MIN_BYTES
+            or not response.get("Content-Type", "").startswith(
+                COMPRESSIBLE_TYPES
+            )
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate_encoding(
+            request.headers.get("Accept-Encoding", "")
+        )
+        if encoding is None:
+            return response
+
+        etag = response.get("ETag", "")
+        if etag and not etag.startswith("W/"):
+            key = compressed_key(etag, encoding)
+            cached = compressed_cache.get(key)
+            if cached is not None:
+                body = cached[1]
+            else:
+                body = compress(response.content, encoding)
+                compressed_cache.set(key, (response["Content-Type"], body))
+            # Compressed bytes differ from the identity ones.
+            response["ETag"] = f"W/{etag}"
+        else:
+            body = compress(response.content, encoding)
+
+        response.content = body
+        response["Content-Length"] = str(len(body))
+        response["Content-Encoding"] = encoding
+
+        return response
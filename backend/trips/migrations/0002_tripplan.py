@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:33
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TripPlan",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("trip", models.JSONField()),
+                ("locations", models.JSONField()),
+                ("plan", models.JSONField()),
+                ("version", models.PositiveIntegerField(default=1)),
+                ("pickup_done", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, db_index=True),
+                ),
+            ],
+        ),
+    ]
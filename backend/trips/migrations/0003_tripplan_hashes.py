@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0002_tripplan"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tripplan",
+            name="input_hash",
+            field=models.CharField(db_index=True, default="", max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="tripplan",
+            name="content_hash",
+            field=models.CharField(default="", max_length=64),
+            preserve_default=False,
+        ),
+    ]
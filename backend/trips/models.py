@@ -1,3 +1,47 @@
+import uuid
 from django.db import models
+from .enums import JobStatus
 
-# Create your models here.
+
+class PlanningJob(models.Model):
+    """A trip submitted with `async=true`, planned by the job workers."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(
+        max_length=16,
+        choices=[(status.value, status.value) for status in JobStatus],
+        default=JobStatus.QUEUED.value,
+    )
+    request = models.JSONField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
+class TripPlan(models.Model):
+    """
+    A planned trip, kept to serve it again by id (or for identical
+    inputs, looked up by `input_hash`) and to re-plan it from the
+    driver's live position. `version` changes whenever the trip is
+    rerouted, along with the `content_hash` of its plan; `pickup_done` is
+    set once a position past the pickup is seen.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    trip = models.JSONField()
+    input_hash = models.CharField(max_length=64, db_index=True)
+    locations = models.JSONField()
+    plan = models.JSONField()
+    content_hash = models.CharField(max_length=64)
+    version = models.PositiveIntegerField(default=1)
+    pickup_done = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.id} (v{self.version})"
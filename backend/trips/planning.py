@@ -0,0 +1,563 @@
+import hashlib
+import json
+import logging
+from functools import partial
+from typing import Callable, Iterable, Iterator, Optional, Union
+from .cache import LRUCache, TieredCache, json_size
+from .concurrency import iter_completed, run_all
+from .constants import (
+    ROUTE_COORD_PRECISION,
+    ROUTE_CACHE_ALIAS,
+    ROUTE_CACHE_MAXSIZE,
+    ROUTE_CACHE_MAX_BYTES,
+    ROUTE_CACHE_TTL_S,
+    PLAN_CACHE_ALIAS,
+    PLAN_CACHE_MAXSIZE,
+    PLAN_CACHE_MAX_BYTES,
+    PLAN_CACHE_TTL_S,
+    PLAN_CACHE_CYCLE_HOURS_BUCKET,
+    ROUTE_SIMPLIFY_CACHE_SIZE,
+    ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M,
+)
+from .compact import compact_logs
+from .enums import LogFormat, RouteView
+from .lanes import get_lane_matrix
+from .metrics import timed
+from .simplify import simplify_geometry
+from .singleflight import single_flight
+from .upstream import UpstreamUnavailableError
+from .utils import (
+    geocode,
+    call_osrm_route,
+    get_stops,
+    normalize_address,
+    ELDCalculator,
+    eld_cache,
+    eld_logs_for_profile,
+    eld_profile,
+)
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = ("current_location", "pickup_location", "dropoff_location")
+
+
+route_cache = TieredCache(
+    name="route",
+    maxsize=ROUTE_CACHE_MAXSIZE,
+    ttl=ROUTE_CACHE_TTL_S,
+    shared_alias=ROUTE_CACHE_ALIAS,
+    max_weight=ROUTE_CACHE_MAX_BYTES,
+    weigher=json_size,
+)
+route_flight = single_flight("route")
+plan_cache = TieredCache(
+    name="plan",
+    maxsize=PLAN_CACHE_MAXSIZE,
+    ttl=PLAN_CACHE_TTL_S,
+    shared_alias=PLAN_CACHE_ALIAS,
+    max_weight=PLAN_CACHE_MAX_BYTES,
+    weigher=json_size,
+)
+
+
+class PlanningError(Exception):
+    """A planning step failed with a message that is safe to return."""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: int,
+        retry_after_s: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+
+
+def format_coords(points: list) -> str:
+    """
+    OSRM `lon,lat;...` string for (lat, lon) points, rounded so nearby
+    requests for the same lane share one cache entry.
+    """
+    return ";".join(
+        f"{lon:.{ROUTE_COORD_PRECISION}f},{lat:.{ROUTE_COORD_PRECISION}f}"
+        for lat, lon in points
+    )
+
+
+@timed("geocode")
+def geocode_locations(data: dict) -> dict[str, tuple[float, float]]:
+    locations, errors = run_all(
+        {field: partial(geocode, data[field]) for field in LOCATION_FIELDS}
+    )
+
+    if errors:
+        for field, e in errors.items():
+            logger.error(f"Error geocoding {field}: {e}")
+        raise _geocoding_error(errors.values())
+
+    return locations
+
+
+def _geocoding_error(errors: Iterable[Exception]) -> PlanningError:
+    unavailable = [
+        e for e in errors if isinstance(e, UpstreamUnavailableError)
+    ]
+    if unavailable:
+        return PlanningError(
+            "Geocoding service unavailable",
+            503,
+            retry_after_s=max(e.retry_after_s for e in unavailable),
+        )
+
+    return PlanningError("Invalid location", 400)
+
+
+@timed("route")
+def get_route(coords: str) -> dict:
+    lane_matrix = get_lane_matrix()
+    if lane_matrix is not None:
+        route = lane_matrix.route(coords)
+        if route is not None:
+            return route
+
+    route = route_cache.get(coords)
+    if route is not None:
+        return route
+
+    # Concurrent requests for the same lane share one OSRM request.
+    return route_flight.do(
+        coords,
+        partial(_route_and_cache, coords),
+        lookup=partial(route_cache.get, coords),
+    )
+
+
+def _route_and_cache(coords: str) -> dict:
+    try:
+        route_resp = call_osrm_route(coords=coords)
+
+        route = route_resp.get("routes", [])[0]
+    except UpstreamUnavailableError as e:
+        logger.error(f"Error: {e}")
+        raise PlanningError(
+            "Routing service unavailable", 503, retry_after_s=e.retry_after_s
+        )
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise PlanningError("No valid route found", 400)
+
+    route_cache.set(coords, route)
+    return route
+
+
+def _plan_stops(
+    route: dict, locations: dict[str, tuple[float, float]]
+) -> list[dict]:
+    with timed("stops"):
+        return get_stops(
+            route=route,
+            cur_coords=list(locations["current_location"]),
+            pickup_coords=list(locations["pickup_location"]),
+            dropoff_coords=list(locations["dropoff_location"]),
+        )
+
+
+def build_plan(
+    route: dict,
+    locations: dict[str, tuple[float, float]],
+    current_cycle_hours: float,
+) -> dict:
+    try:
+        stops = _plan_stops(route, locations)
+
+        with timed("eld"):
+            logs = eld_logs_for_profile(
+                eld_profile(route, current_cycle_hours)
+            )
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise PlanningError("Internal Server Error", 500)
+
+    return {"route": route, "stops": stops, "logs": logs}
+
+
+def slim_route(plan: dict) -> dict:
+    """The parts of an OSRM route clients use, without steps/annotations."""
+    route = plan["route"]
+
+    return {
+        "geometry": route.get("geometry"),
+        "distance": route.get("distance", 0),
+        "duration": route.get("duration", 0),
+        "legs": [
+            {
+                "distance": leg.get("distance", 0),
+                "duration": leg.get("duration", 0),
+                "summary": leg.get("summary", ""),
+            }
+            for leg in route.get("legs", [])
+        ],
+    }
+
+
+ROUTE_STEP_FIELDS = ("distance", "duration", "geometry", "name", "maneuver")
+
+
+def compact_route(route: dict) -> dict:
+    """
+    The route as stored with a plan: the full route without the OSRM
+    intersections, annotations and weights, keeping the step geometries
+    stops and re-planning are computed from.
+    """
+    return {
+        "geometry": route.get("geometry"),
+        "distance": route.get("distance", 0),
+        "duration": route.get("duration", 0),
+        "legs": [
+            {
+                "distance": leg.get("distance", 0),
+                "duration": leg.get("duration", 0),
+                "summary": leg.get("summary", ""),
+                "steps": [
+                    {
+                        field: step[field]
+                        for field in ROUTE_STEP_FIELDS
+                        if field in step
+                    }
+                    for step in leg.get("steps", [])
+                ],
+            }
+            for leg in route.get("legs", [])
+        ],
+    }
+
+
+# Simplified route geometries by (route geometry, stops, zoom level).
+_simplified = LRUCache(maxsize=ROUTE_SIMPLIFY_CACHE_SIZE)
+
+
+def simplified_geometry(plan: dict, level: int) -> Optional[str]:
+    """
+    The route geometry of a plan simplified for zoom `level`, computed
+    the first time a plan of that route and stops asks for it.
+    """
+    geometry = plan["route"].get("geometry")
+    if not isinstance(geometry, str):
+        return None
+
+    key = hashlib.sha256(
+        json.dumps(
+            [geometry, [stop.get("coords") for stop in plan["stops"]], level]
+        ).encode()
+    ).hexdigest()
+    simplified = _simplified.get(key)
+    if simplified is None:
+        with timed("simplify"):
+            simplified = simplify_geometry(
+                geometry, plan["stops"], [level]
+            ).get(str(level), geometry)
+        _simplified.set(key, simplified)
+
+    return simplified
+
+
+def geometry_for_zoom(plan: dict, zoom: int) -> Optional[str]:
+    """The coarsest simplified geometry detailed enough for `zoom`."""
+    for level in sorted(ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M):
+        if zoom <= level:
+            return simplified_geometry(plan, level)
+
+    return plan["route"].get("geometry")
+
+
+def project_route(
+    plan: dict, route_view: str, zoom: Optional[int] = None
+) -> dict:
+    """
+    Shape the route of a plan for the response. When the client sends its
+    map `zoom`, only the geometry matching it is returned; the simplified
+    geometries of every zoom level are only added for the "simplified"
+    view. Geometries are simplified on first request, not with the plan.
+    """
+    route = plan["route"] if route_view == RouteView.FULL else slim_route(plan)
+
+    if zoom is not None:
+        return {**route, "geometry": geometry_for_zoom(plan, zoom)}
+    if route_view == RouteView.SIMPLIFIED:
+        geometries = {
+            str(level): simplified_geometry(plan, level)
+            for level in sorted(ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M)
+        }
+        return {
+            **route,
+            "geometries": {
+                level: geometry
+                for level, geometry in geometries.items()
+                if geometry is not None
+            },
+        }
+
+    return route
+
+
+def project_plan(
+    plan: dict,
+    route_view: str,
+    zoom: Optional[int] = None,
+    log_format: str = LogFormat.FULL,
+) -> dict:
+    """Shape a computed plan for the response."""
+    return {
+        "route": project_route(plan, route_view, zoom),
+        "stops": plan["stops"],
+        "logs": (
+            compact_logs(plan["logs"])
+            if log_format == LogFormat.COMPACT
+            else plan["logs"]
+        ),
+    }
+
+
+def error_event(e: PlanningError) -> dict:
+    error = {"message": e.message, "status": e.status_code}
+    if e.retry_after_s is not None:
+        error["retry_after_s"] = e.retry_after_s
+
+    return {"error": error}
+
+
+def bucket_cycle_hours(current_cycle_hours: float) -> float:
+    """
+    The cycle hours a plan is keyed and computed with: exact by default,
+    rounded to PLAN_CACHE_CYCLE_HOURS_BUCKET when that lossy sharing is
+    opted into, so every trip of a bucket then gets the same logs.
+    """
+    if PLAN_CACHE_CYCLE_HOURS_BUCKET > 0:
+        bucket = round(current_cycle_hours / PLAN_CACHE_CYCLE_HOURS_BUCKET)
+        return bucket * PLAN_CACHE_CYCLE_HOURS_BUCKET
+
+    return current_cycle_hours
+
+
+def plan_cache_key(coords: str, current_cycle_hours: float) -> str:
+    """Plan cache key of a lane, for `bucket_cycle_hours` hours."""
+    if PLAN_CACHE_CYCLE_HOURS_BUCKET > 0:
+        return f"{coords}|{current_cycle_hours:g}"
+
+    return f"{coords}|{current_cycle_hours!r}"
+
+
+def plan_trip(data: dict) -> dict:
+    """Geocode, route and compute the stops and ELD logs for a trip."""
+    locations = geocode_locations(data)
+
+    return plan_for_locations(locations, data.get("current_cycle_hours", 0))
+
+
+def stream_trip(
+    data: dict, route_view: str, zoom: Optional[int] = None
+) -> Iterator[dict]:
+    """
+    Plan a trip as a stream of events: the route, then the stops, then one
+    event per day log as soon as ELDCalculator computes it (or straight
+    from the ELD cache), then "end".
+
+    Geocoding, routing and stop placement run before the iterator is
+    returned, so their failures still raise PlanningError and can be
+    answered with a regular error response.
+    """
+    locations = geocode_locations(data)
+    current_cycle_hours = bucket_cycle_hours(
+        data.get("current_cycle_hours", 0)
+    )
+    coords = format_coords([locations[field] for field in LOCATION_FIELDS])
+
+    key = plan_cache_key(coords, current_cycle_hours)
+    plan = plan_cache.get(key)
+    if plan is not None:
+        return _plan_events(plan, plan["logs"], route_view, zoom)
+
+    route = get_route(coords)
+    try:
+        profile = eld_profile(route, current_cycle_hours)
+
+        stops = _plan_stops(route, locations)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise PlanningError("Internal Server Error", 500)
+
+    plan = {"route": route, "stops": stops}
+    eld_key = profile.cache_key()
+    cached_logs = eld_cache.get(eld_key)
+
+    def on_complete(logs: list[dict]):
+        if cached_logs is None:
+            eld_cache.set(eld_key, logs)
+        plan_cache.set(key, {**plan, "logs": logs})
+
+    return _plan_events(
+        plan,
+        (
+            cached_logs
+            if cached_logs is not None
+            else ELDCalculator.from_profile(profile).iter_eld_logs()
+        ),
+        route_view,
+        zoom,
+        on_complete=on_complete,
+    )
+
+
+def _plan_events(
+    plan: dict,
+    logs: Iterable[dict],
+    route_view: str,
+    zoom: Optional[int],
+    on_complete: Optional[Callable[[list[dict]], None]] = None,
+) -> Iterator[dict]:
+    yield {"type": "route", "route": project_route(plan, route_view, zoom)}
+    yield {"type": "stops", "stops": plan["stops"]}
+
+    streamed_logs = []
+    try:
+        for log in logs:
+            streamed_logs.append(log)
+            yield {"type": "log", "log": log}
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        yield {
+            "type": "error",
+            **error_event(PlanningError("Internal Server Error", 500)),
+        }
+        return
+
+    if on_complete is not None:
+        on_complete(streamed_logs)
+
+    yield {"type": "end"}
+
+
+def sweep_trip(
+    data: dict, route_view: str, zoom: Optional[int] = None
+) -> dict:
+    """
+    Plan one trip for many `current_cycle_hours` values. The route and
+    stops don't depend on the cycle hours and are computed once.
+    """
+    locations = geocode_locations(data)
+    route = get_route(
+        format_coords([locations[field] for field in LOCATION_FIELDS])
+    )
+
+    try:
+        stops = _plan_stops(route, locations)
+        with timed("eld"):
+            results = ELDCalculator(route=route).sweep_cycle_hours(
+                data["current_cycle_hours"]
+            )
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise PlanningError("Internal Server Error", 500)
+
+    plan = {"route": route, "stops": stops}
+
+    return {
+        "route": project_route(plan, route_view, zoom),
+        "stops": stops,
+        "results": results,
+    }
+
+
+def plan_for_locations(
+    locations: dict[str, tuple[float, float]],
+    current_cycle_hours: float,
+    route: Optional[dict] = None,
+) -> dict:
+    coords = format_coords([locations[field] for field in LOCATION_FIELDS])
+    current_cycle_hours = bucket_cycle_hours(current_cycle_hours)
+
+    key = plan_cache_key(coords, current_cycle_hours)
+    plan = plan_cache.get(key)
+    if plan is not None:
+        return plan
+
+    plan = build_plan(
+        route or get_route(coords), locations, current_cycle_hours
+    )
+    plan_cache.set(key, plan)
+
+    return plan
+
+
+def plan_trips(trips: list[dict]) -> list[Union[dict, PlanningError]]:
+    """
+    Plan many trips at once. Results come back in input order, with a
+    PlanningError in place of each failed trip.
+    """
+    results: list[Union[dict, PlanningError]] = [None] * len(trips)
+    for index, result in iter_planned_trips(trips):
+        results[index] = result
+
+    return results
+
+
+def iter_planned_trips(
+    trips: list[dict],
+) -> Iterator[tuple[int, Union[dict, PlanningError]]]:
+    """
+    Plan many trips at once, yielding `(index, plan or PlanningError)` as
+    each trip finishes. Addresses shared by several trips are geocoded
+    once and identical lanes are routed once, concurrently on the worker
+    pool.
+    """
+    addresses: dict[str, str] = {}
+    for trip in trips:
+        for field in LOCATION_FIELDS:
+            addresses.setdefault(normalize_address(trip[field]), trip[field])
+    coordinates, geocode_errors = run_all(
+        {key: partial(geocode, address) for key, address in addresses.items()}
+    )
+    for key, e in geocode_errors.items():
+        logger.error(f"Error geocoding {addresses[key]}: {e}")
+
+    trip_locations: dict[int, dict[str, tuple[float, float]]] = {}
+    for index, trip in enumerate(trips):
+        keys = [normalize_address(trip[field]) for field in LOCATION_FIELDS]
+        failed = [geocode_errors[key] for key in keys if key in geocode_errors]
+
+        if failed:
+            yield index, _geocoding_error(failed)
+        else:
+            trip_locations[index] = {
+                field: coordinates[key]
+                for field, key in zip(LOCATION_FIELDS, keys)
+            }
+
+    lanes: dict[str, list[int]] = {}
+    for index, locations in trip_locations.items():
+        coords = format_coords([locations[field] for field in LOCATION_FIELDS])
+        lanes.setdefault(coords, []).append(index)
+
+    # Only the routing runs on the pool: stops and ELD logs are CPU bound,
+    # so threads can't speed them up. They are computed here as each
+    # lane's route comes back, overlapping the routes still in flight.
+    for coords, route, e in iter_completed(
+        {coords: partial(get_route, coords) for coords in lanes}
+    ):
+        for index in lanes[coords]:
+            if e is None:
+                try:
+                    yield index, plan_for_locations(
+                        trip_locations[index],
+                        trips[index].get("current_cycle_hours", 0),
+                        route=route,
+                    )
+                except PlanningError as plan_error:
+                    yield index, plan_error
+            elif isinstance(e, PlanningError):
+                yield index, e
+            else:
+                yield index, PlanningError("Internal Server Error", 500)
@@ -0,0 +1,139 @@
+import hashlib
+import json
+from datetime import timedelta
+from typing import Optional
+from django.utils import timezone
+from django.utils.http import quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+from .constants import ROUTE_STORE_PLANS, TRIP_PLAN_RETENTION_S
+from .enums import LogFormat
+from .models import TripPlan
+from .planning import (
+    LOCATION_FIELDS,
+    compact_route,
+    geocode_locations,
+    plan_for_locations,
+    plan_trip,
+    project_plan,
+)
+from .utils import normalize_address
+
+# Serving a stored plan pushes back its expiry, at most this often.
+TRIP_PLAN_TOUCH_INTERVAL_S = min(24 * 60 * 60, TRIP_PLAN_RETENTION_S / 2)
+
+
+def input_hash(data: dict) -> str:
+    """Hash of the normalized addresses and cycle hours of a trip."""
+    inputs = [normalize_address(data[field]) for field in LOCATION_FIELDS]
+    inputs.append(float(data.get("current_cycle_hours", 0)))
+
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+
+def content_hash(plan: dict) -> str:
+    encoded = json.dumps(
+        plan, cls=JSONEncoder, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def stored_plan(plan: dict) -> dict:
+    """A computed plan as stored, with its route compacted."""
+    return {**plan, "route": compact_route(plan["route"])}
+
+
+def save_trip_plan(data: dict, trip_hash: Optional[str] = None) -> TripPlan:
+    """Plan a trip and store it."""
+    locations = geocode_locations(data)
+    plan = stored_plan(
+        plan_for_locations(locations, data.get("current_cycle_hours", 0))
+    )
+
+    return TripPlan.objects.create(
+        trip=data,
+        input_hash=trip_hash or input_hash(data),
+        locations={field: list(coords) for field, coords in locations.items()},
+        plan=plan,
+        content_hash=content_hash(plan),
+    )
+
+
+def route_plan(data: dict) -> TripPlan:
+    """
+    The stored plan of a trip: the plan of identical inputs when one is
+    stored and hasn't been rerouted since, planned and stored otherwise.
+    """
+    trip_hash = input_hash(data)
+    # The plan itself is loaded when the response is serialized.
+    trip_plan = (
+        TripPlan.objects.filter(input_hash=trip_hash, version=1)
+        .defer("trip", "locations", "plan")
+        .order_by("created_at")
+        .first()
+    )
+    if trip_plan is not None:
+        touch_trip_plan(trip_plan.pk, trip_plan.updated_at)
+        return trip_plan
+
+    return save_trip_plan(data, trip_hash)
+
+
+def route_response(
+    data: dict,
+    route_view: str,
+    zoom: Optional[int] = None,
+    log_format: str = LogFormat.FULL,
+) -> dict:
+    """
+    The /api/route/ body of a trip: its stored plan with ROUTE_STORE_PLANS,
+    otherwise the (cached) plan alone, without a plan id.
+    """
+    if ROUTE_STORE_PLANS:
+        return trip_plan_response(
+            route_plan(data), route_view, zoom, log_format
+        )
+
+    return project_plan(plan_trip(data), route_view, zoom, log_format)
+
+
+def prune_trip_plans() -> int:
+    """Delete plans not updated for TRIP_PLAN_RETENTION_S; their count."""
+    deleted, _ = TripPlan.objects.filter(
+        updated_at__lt=timezone.now()
+        - timedelta(seconds=TRIP_PLAN_RETENTION_S)
+    ).delete()
+
+    return deleted
+
+
+def touch_trip_plan(plan_id, updated_at) -> None:
+    """Keep a plan still in use (reused, or a shared link) from expiring."""
+    now = timezone.now()
+    if updated_at < now - timedelta(seconds=TRIP_PLAN_TOUCH_INTERVAL_S):
+        TripPlan.objects.filter(pk=plan_id).update(updated_at=now)
+
+
+def plan_etag(plan_id, content_hash: str, version: int, *variant) -> str:
+    """
+    Strong ETag of a stored plan as shaped for one response `variant`
+    (route view, zoom, log format, media type). The id is part of it, as
+    plans of identical inputs share a content hash but not their body.
+    """
+    key = "|".join(
+        str(part) for part in (plan_id, content_hash, version, *variant)
+    )
+    return quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+
+def trip_plan_response(
+    trip_plan: TripPlan,
+    route_view: str,
+    zoom: Optional[int] = None,
+    log_format: str = LogFormat.FULL,
+) -> dict:
+    """Shape a stored plan for the response."""
+    return {
+        "plan_id": str(trip_plan.pk),
+        "version": trip_plan.version,
+        **project_plan(trip_plan.plan, route_view, zoom, log_format),
+    }
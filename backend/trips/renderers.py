@@ -0,0 +1,33 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional at runtime
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+class MsgPackRenderer(BaseRenderer):
+    """Render responses as MessagePack for `Accept: application/msgpack`."""
+
+    media_type = MSGPACK_MEDIA_TYPE
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+# Renderers of the planning views: the defaults, plus MessagePack when
+# the package is installed.
+PLANNING_RENDERER_CLASSES = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    *([MsgPackRenderer] if msgpack is not None else []),
+]
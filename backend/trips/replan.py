@@ -0,0 +1,288 @@
+import math
+from typing import Optional
+from django.db.models import F
+from django.utils import timezone
+from .cache import LRUCache
+from .constants import (
+    DROPOFF_DURATION_H,
+    FUEL_INTERVAL_M,
+    MAX_CYCLE_HOURS,
+    METERS_TO_MILES,
+    PICKUP_DURATION_H,
+    REPLAN_GRID_CELL_DEG,
+    REPLAN_OFF_ROUTE_M,
+    REPLAN_TRACKER_CACHE_SIZE,
+    SECONDS_TO_HOURS,
+)
+from .geometry import RouteGeometryIndex, SegmentGrid
+from .hos import HOSEngine
+from .models import TripPlan
+from .compact import compact_logs
+from .enums import LogFormat
+from .planning import (
+    LOCATION_FIELDS,
+    PlanningError,
+    format_coords,
+    get_route,
+    project_route,
+)
+from .plans import content_hash, stored_plan
+
+
+class RouteTracker:
+    """
+    What re-planning needs from one stored route, built once per route
+    version: its geometry with per-vertex distances, a segment grid to
+    project positions onto it, and where each leg starts and ends.
+    """
+
+    def __init__(self, route: dict, locations: dict[str, list[float]]):
+        self.route = route
+        self.locations = locations
+        self.geometry = RouteGeometryIndex(route.get("legs", []))
+        self.grid = SegmentGrid(
+            self.geometry.lats,
+            self.geometry.lons,
+            self.geometry.cumulative_m,
+            REPLAN_GRID_CELL_DEG,
+        )
+
+        self.distance_m = route.get("distance", 0)
+        duration_s = route.get("duration", 0)
+        self.speed_mph = (
+            self.distance_m * METERS_TO_MILES / (duration_s / SECONDS_TO_HOURS)
+            if duration_s
+            else 0.0
+        )
+
+        self.legs = []
+        start_m = 0.0
+        for leg in route.get("legs", []):
+            end_m = start_m + leg.get("distance", 0)
+            self.legs.append((start_m, end_m, leg.get("duration", 0)))
+            start_m = end_m
+
+    def project(self, lat: float, lon: float) -> Optional[tuple[float, float]]:
+        """`(off_route_m, along_m)` of a position, or None if off route."""
+        return self.grid.nearest(lat, lon, REPLAN_OFF_ROUTE_M)
+
+    def passed_pickup(self, along_m: float) -> bool:
+        return bool(self.legs) and along_m >= self.legs[0][1]
+
+    def remaining(
+        self,
+        along_m: float,
+        position: list[float],
+        current_cycle_hours: float,
+        pickup_done: bool,
+    ) -> dict:
+        """Progress, stops and ELD logs of the rest of the trip."""
+        remaining_s = [
+            (
+                duration_s
+                * min(
+                    max(
+                        (end_m - max(along_m, start_m)) / (end_m - start_m), 0
+                    ),
+                    1,
+                )
+                if end_m > start_m
+                else 0.0
+            )
+            for start_m, end_m, duration_s in self.legs
+        ]
+        driving_hours = sum(remaining_s) / SECONDS_TO_HOURS
+        hours_to_pickup = (
+            0.0 if pickup_done else remaining_s[0] / SECONDS_TO_HOURS
+        )
+
+        engine = HOSEngine(
+            total_hours=driving_hours
+            + (0 if pickup_done else PICKUP_DURATION_H)
+            + DROPOFF_DURATION_H,
+            driving_hours_to_pickup=hours_to_pickup,
+            cycle_available=max(0.0, MAX_CYCLE_HOURS - current_cycle_hours),
+            pickup_done=pickup_done,
+        )
+
+        return {
+            "progress": {
+                "distance_m": along_m,
+                "remaining_distance_m": max(self.distance_m - along_m, 0.0),
+                "remaining_duration_s": sum(remaining_s),
+                "pickup_done": pickup_done,
+            },
+            "stops": self._remaining_stops(along_m, position, pickup_done),
+            "logs": [day.to_dict(self.speed_mph) for day in engine.days()],
+        }
+
+    def _remaining_stops(
+        self, along_m: float, position: list[float], pickup_done: bool
+    ) -> list[dict]:
+        stops = [
+            {
+                "type": "current",
+                "coords": position,
+                "label": "Current location",
+            }
+        ]
+        if not pickup_done:
+            stops.append(
+                {
+                    "type": "pickup",
+                    "coords": self.locations["pickup_location"],
+                    "label": "Pickup (1h)",
+                }
+            )
+
+        # Fuel stops keep their place (and number) along the route.
+        fuel_stops = [
+            (i, min(i * FUEL_INTERVAL_M, self.distance_m - 1))
+            for i in range(
+                1, math.floor(self.distance_m / FUEL_INTERVAL_M) + 1
+            )
+        ]
+        fuel_stops = [(i, m) for i, m in fuel_stops if m > along_m]
+        positions = self.geometry.points_at([m for _, m in fuel_stops])
+        for (i, target_m), coords in zip(fuel_stops, positions):
+            stop = {"type": "fuel", "label": f"Fuel stop #{i}"}
+            if coords:
+                stop["coords"] = coords
+            else:
+                stop["progress"] = target_m / self.distance_m
+            stops.append(stop)
+
+        stops.append(
+            {
+                "type": "dropoff",
+                "coords": self.locations["dropoff_location"],
+                "label": "Dropoff (1h)",
+            }
+        )
+        return stops
+
+
+_trackers = LRUCache(maxsize=REPLAN_TRACKER_CACHE_SIZE)
+
+
+def get_tracker(trip_plan: TripPlan) -> RouteTracker:
+    key = (trip_plan.pk, trip_plan.version)
+    tracker = _trackers.get(key)
+
+    if tracker is None:
+        tracker = RouteTracker(trip_plan.plan["route"], trip_plan.locations)
+        _trackers.set(key, tracker)
+
+    return tracker
+
+
+def replan_trip(
+    plan_id, lat: float, lon: float, current_cycle_hours: float
+) -> tuple[TripPlan, dict]:
+    """
+    Re-plan the rest of a stored trip from the driver's position. On the
+    route, the position is projected onto it and only the remaining stops
+    and day logs are computed, with no upstream call. Off the route, the
+    trip is rerouted from the position and stored as a new version.
+    """
+    trip_plan = (
+        TripPlan.objects.filter(pk=plan_id)
+        .only("version", "pickup_done", "locations")
+        .first()
+    )
+    if trip_plan is None:
+        raise PlanningError("Plan not found", 404)
+
+    # The deferred plan is only loaded when this version's tracker isn't
+    # cached yet.
+    tracker = get_tracker(trip_plan)
+
+    position = [lat, lon]
+    projection = tracker.project(lat, lon)
+
+    if projection is None:
+        return _reroute(trip_plan, position, current_cycle_hours)
+
+    off_route_m, along_m = projection
+    pickup_done = trip_plan.pickup_done or tracker.passed_pickup(along_m)
+    if pickup_done and not trip_plan.pickup_done:
+        TripPlan.objects.filter(pk=trip_plan.pk).update(pickup_done=True)
+        trip_plan.pickup_done = True
+
+    return trip_plan, {
+        "rerouted": False,
+        "off_route_m": off_route_m,
+        **tracker.remaining(
+            along_m, position, current_cycle_hours, pickup_done
+        ),
+    }
+
+
+def _reroute(
+    trip_plan: TripPlan, position: list[float], current_cycle_hours: float
+) -> tuple[TripPlan, dict]:
+    locations = {
+        "current_location": position,
+        # Past the pickup, the new route starts with an empty pickup leg.
+        "pickup_location": (
+            position
+            if trip_plan.pickup_done
+            else trip_plan.locations["pickup_location"]
+        ),
+        "dropoff_location": trip_plan.locations["dropoff_location"],
+    }
+    route = get_route(
+        format_coords([locations[field] for field in LOCATION_FIELDS])
+    )
+
+    tracker = RouteTracker(route, locations)
+    remaining = tracker.remaining(
+        0.0, position, current_cycle_hours, trip_plan.pickup_done
+    )
+    plan = stored_plan(
+        {
+            "route": route,
+            "stops": remaining["stops"],
+            "logs": remaining["logs"],
+        }
+    )
+
+    plan_hash = content_hash(plan)
+    TripPlan.objects.filter(pk=trip_plan.pk).update(
+        locations=locations,
+        plan=plan,
+        content_hash=plan_hash,
+        version=F("version") + 1,
+        updated_at=timezone.now(),
+    )
+    trip_plan.refresh_from_db(fields=["version"])
+    trip_plan.locations = locations
+    trip_plan.plan = plan
+    trip_plan.content_hash = plan_hash
+    _trackers.set((trip_plan.pk, trip_plan.version), tracker)
+
+    return trip_plan, {"rerouted": True, "off_route_m": None, **remaining}
+
+
+def replan_response(
+    trip_plan: TripPlan,
+    replan: dict,
+    route_view: str,
+    zoom: Optional[int] = None,
+    log_format: str = LogFormat.FULL,
+) -> dict:
+    """
+    Shape a re-plan for the response. The route is only sent back when
+    it changed.
+    """
+    response = {
+        "plan_id": str(trip_plan.pk),
+        "version": trip_plan.version,
+        **replan,
+    }
+    if log_format == LogFormat.COMPACT:
+        response["logs"] = compact_logs(replan["logs"])
+    if replan["rerouted"]:
+        response["route"] = project_route(trip_plan.plan, route_view, zoom)
+
+    return response
@@ -1,4 +1,10 @@
 from rest_framework import serializers
+from .constants import (
+    BATCH_MAX_TRIPS,
+    ROUTE_RESPONSE_DEFAULT_VIEW,
+    SWEEP_MAX_CYCLE_HOURS,
+)
+from .enums import LogFormat, RouteView
 
 
 class TripInputSerializer(serializers.Serializer):
@@ -8,6 +14,49 @@ class TripInputSerializer(serializers.Serializer):
     current_cycle_hours = serializers.FloatField()
 
 
+class TripBatchInputSerializer(serializers.Serializer):
+    trips = TripInputSerializer(
+        many=True, allow_empty=False, max_length=BATCH_MAX_TRIPS
+    )
+
+
+class TripSweepInputSerializer(serializers.Serializer):
+    current_location = serializers.CharField()
+    pickup_location = serializers.CharField()
+    dropoff_location = serializers.CharField()
+    current_cycle_hours = serializers.ListField(
+        child=serializers.FloatField(),
+        allow_empty=False,
+        max_length=SWEEP_MAX_CYCLE_HOURS,
+    )
+
+
+class ReplanInputSerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    current_cycle_hours = serializers.FloatField()
+
+
+class TripRouteQuerySerializer(serializers.Serializer):
+    route = serializers.ChoiceField(
+        choices=[view.value for view in RouteView],
+        default=ROUTE_RESPONSE_DEFAULT_VIEW,
+    )
+    zoom = serializers.IntegerField(required=False, min_value=0, max_value=22)
+    stream = serializers.BooleanField(default=False)
+    # Defaults to compact for MessagePack responses, full otherwise.
+    logs = serializers.ChoiceField(
+        choices=[log_format.value for log_format in LogFormat],
+        required=False,
+    )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # `async` is a keyword, so it can't be declared as an attribute.
+        fields["async"] = serializers.BooleanField(default=False)
+        return fields
+
+
 class RouteResponseSerializer(serializers.Serializer):
     route = serializers.DictField()
     stops = serializers.ListField()
@@ -0,0 +1,192 @@
+import math
+from typing import Iterable, Optional, Sequence
+import polyline
+from .constants import EARTH_RADIUS_M, ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M
+from .geometry import np
+
+
+def _scales_m(lats: Sequence[float]) -> tuple[float, float]:
+    """Meters per degree of lon and lat around the mean latitude."""
+    mean_lat = math.radians(sum(lats) / len(lats))
+    y_scale = EARTH_RADIUS_M * math.pi / 180
+
+    return y_scale * math.cos(mean_lat), y_scale
+
+
+def _project_m(lats: Sequence[float], lons: Sequence[float]):
+    """Equirectangular projection to meters, good enough for tolerances."""
+    x_scale, y_scale = _scales_m(lats)
+
+    if np is None:
+        return [lon * x_scale for lon in lons], [lat * y_scale for lat in lats]
+
+    return (
+        np.asarray(lons, dtype=float) * x_scale,
+        np.asarray(lats, dtype=float) * y_scale,
+    )
+
+
+def douglas_peucker(
+    lats: Sequence[float],
+    lons: Sequence[float],
+    tolerance_m: float,
+    keep: Iterable[int] = (),
+) -> list[int]:
+    """
+    Indices of the vertices kept by Douglas-Peucker simplification.
+    Vertices in `keep` and both endpoints are always kept.
+
+    With NumPy every pending range of a level is split in one vectorized
+    pass; without it ranges are processed with an explicit stack. Neither
+    recurses, so long routes can't hit the recursion limit.
+    """
+    n = len(lats)
+    if n <= 2:
+        return list(range(n))
+
+    xs, ys = _project_m(lats, lons)
+    anchors = sorted({0, n - 1, *(i for i in keep if 0 <= i < n)})
+
+    if np is None:
+        return _douglas_peucker_python(xs, ys, anchors, tolerance_m)
+
+    return _douglas_peucker_numpy(xs, ys, anchors, tolerance_m)
+
+
+def _douglas_peucker_numpy(xs, ys, anchors: list[int], tolerance_m: float):
+    kept = np.zeros(len(xs), dtype=bool)
+    kept[anchors] = True
+    starts = np.asarray(anchors[:-1])
+    ends = np.asarray(anchors[1:])
+
+    while True:
+        inner_counts = ends - starts - 1
+        pending = inner_counts > 0
+        starts, ends = starts[pending], ends[pending]
+        inner_counts = inner_counts[pending]
+        if not len(starts):
+            break
+
+        # Every inner vertex of every pending range, flattened.
+        range_ids = np.repeat(np.arange(len(starts)), inner_counts)
+        offsets = np.concatenate(([0], np.cumsum(inner_counts)[:-1]))
+        vertices = (
+            np.arange(inner_counts.sum())
+            - np.repeat(offsets, inner_counts)
+            + np.repeat(starts + 1, inner_counts)
+        )
+
+        dx = (xs[ends] - xs[starts])[range_ids]
+        dy = (ys[ends] - ys[starts])[range_ids]
+        px = xs[vertices] - xs[starts][range_ids]
+        py = ys[vertices] - ys[starts][range_ids]
+        chord_2 = dx * dx + dy * dy
+        t = np.divide(
+            px * dx + py * dy,
+            chord_2,
+            out=np.zeros_like(chord_2),
+            where=chord_2 > 0,
+        ).clip(0, 1)
+        distances = np.hypot(px - t * dx, py - t * dy)
+
+        max_distances = np.maximum.reduceat(distances, offsets)
+        split = max_distances > tolerance_m
+        if not split.any():
+            break
+
+        # First farthest vertex of each range that needs splitting.
+        candidates = np.flatnonzero(
+            (distances == max_distances[range_ids]) & split[range_ids]
+        )
+        _, first = np.unique(range_ids[candidates], return_index=True)
+        split_ranges = range_ids[candidates[first]]
+        split_vertices = vertices[candidates[first]]
+
+        kept[split_vertices] = True
+        starts = np.concatenate((starts[split_ranges], split_vertices))
+        ends = np.concatenate((split_vertices, ends[split_ranges]))
+
+    return np.flatnonzero(kept).tolist()
+
+
+def _douglas_peucker_python(xs, ys, anchors: list[int], tolerance_m: float):
+    kept = set(anchors)
+    stack = list(zip(anchors, anchors[1:]))
+
+    while stack:
+        start, end = stack.pop()
+        dx, dy = xs[end] - xs[start], ys[end] - ys[start]
+        chord_2 = dx * dx + dy * dy
+
+        farthest, max_distance = start, -1.0
+        for i in range(start + 1, end):
+            px, py = xs[i] - xs[start], ys[i] - ys[start]
+            if chord_2 > 0:
+                t = min(max((px * dx + py * dy) / chord_2, 0), 1)
+                px, py = px - t * dx, py - t * dy
+            distance = math.hypot(px, py)
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+
+        if max_distance > tolerance_m:
+            kept.add(farthest)
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+
+    return sorted(kept)
+
+
+def nearest_vertices(
+    lats: Sequence[float], lons: Sequence[float], points: Iterable
+) -> list[int]:
+    """Index of the vertex closest to each (lat, lon) point."""
+    x_scale, y_scale = _scales_m(lats)
+    xs, ys = _project_m(lats, lons)
+    indices = []
+
+    for lat, lon in points:
+        x, y = lon * x_scale, lat * y_scale
+        if np is not None:
+            indices.append(int(np.argmin((xs - x) ** 2 + (ys - y) ** 2)))
+        else:
+            indices.append(
+                min(
+                    range(len(xs)),
+                    key=lambda i: (xs[i] - x) ** 2 + (ys[i] - y) ** 2,
+                )
+            )
+
+    return indices
+
+
+def simplify_geometry(
+    geometry: str, stops: list[dict], zooms: Optional[Iterable[int]] = None
+) -> dict[str, str]:
+    """
+    Simplified copies of an encoded route polyline, one per zoom level of
+    ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M (or of `zooms` only), keyed by that
+    zoom level. The vertices nearest to the stops are kept at every level
+    so markers stay on the line.
+    """
+    if zooms is not None:
+        zooms = set(zooms)
+    if not ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M or not isinstance(geometry, str):
+        return {}
+
+    points = polyline.decode(geometry)
+    if len(points) <= 2:
+        return {}
+
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    keep = nearest_vertices(
+        lats, lons, [stop["coords"] for stop in stops if stop.get("coords")]
+    )
+
+    return {
+        str(zoom): polyline.encode(
+            [points[i] for i in douglas_peucker(lats, lons, tolerance_m, keep)]
+        )
+        for zoom, tolerance_m in ROUTE_SIMPLIFY_ZOOM_TOLERANCES_M.items()
+        if zooms is None or zoom in zooms
+    }
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+from django.core.cache import caches
+from .constants import (
+    COALESCE_LOCK_TIMEOUT_S,
+    COALESCE_POLL_S,
+    COALESCE_SHARED_ALIAS,
+    COALESCE_WAIT_S,
+)
+
+logger = logging.getLogger(__name__)
+
+_registry: dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: while a call for a key is in
+    flight, other threads asking for the same key wait for it and share
+    its result or exception instead of repeating it.
+
+    With a shared cache alias, the first worker process to start a call
+    also takes a lock there. Other workers then poll `lookup` (typically
+    the shared cache the leader writes the result to) instead of calling
+    upstream themselves, until the lock is released or COALESCE_WAIT_S
+    passes.
+    """
+
+    def __init__(self, name: str, shared_alias: Optional[str] = None):
+        self.name = name
+        self.shared_alias = shared_alias
+        self.leaders = 0
+        self.followers = 0
+        self.shared_followers = 0
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        lookup: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(key, fn, lookup)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "shared_followers": self.shared_followers,
+        }
+
+    def clear(self):
+        self.leaders = self.followers = self.shared_followers = 0
+
+    def _lead(
+        self, key: str, fn: Callable[[], Any], lookup: Optional[Callable]
+    ) -> Any:
+        backend = self._shared_backend() if lookup is not None else None
+        if backend is None:
+            return fn()
+
+        lock_key = self._lock_key(key)
+        try:
+            acquired = backend.add(
+                lock_key, 1, timeout=COALESCE_LOCK_TIMEOUT_S
+            )
+        except Exception as e:
+            logger.warning(f"Single flight {self.name} lock error: {e}")
+            return fn()
+
+        if not acquired:
+            result = self._wait_for_other_worker(backend, lock_key, lookup)
+            if result is not None:
+                self.shared_followers += 1
+                return result
+
+            return fn()
+
+        try:
+            return fn()
+        finally:
+            try:
+                backend.delete(lock_key)
+            except Exception as e:
+                logger.warning(f"Single flight {self.name} lock error: {e}")
+
+    def _wait_for_other_worker(
+        self, backend, lock_key: str, lookup: Callable[[], Any]
+    ) -> Any:
+        deadline = time.monotonic() + COALESCE_WAIT_S
+
+        while time.monotonic() < deadline:
+            time.sleep(COALESCE_POLL_S)
+
+            result = lookup()
+            if result is not None:
+                return result
+
+            try:
+                if backend.get(lock_key) is None:
+                    # Released without a result (the call failed):
+                    # one more look, then call upstream ourselves.
+                    return lookup()
+            except Exception:
+                return None
+
+        return None
+
+    def _shared_backend(self):
+        if not self.shared_alias:
+            return None
+        try:
+            return caches[self.shared_alias]
+        except Exception as e:
+            logger.warning(f"Single flight {self.name} unavailable: {e}")
+            return None
+
+    def _lock_key(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"trips:flight:{self.name}:{digest}"
+
+
+def single_flight(name: str) -> SingleFlight:
+    """A named SingleFlight using the COALESCE_SHARED_ALIAS lock store."""
+    return SingleFlight(name, shared_alias=COALESCE_SHARED_ALIAS)
+
+
+def single_flight_stats() -> dict[str, dict]:
+    """Coalescing counters of every named single flight in this process."""
+    return {name: flight.stats() for name, flight in _registry.items()}
@@ -0,0 +1,251 @@
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+import polyline
+from .constants import NOMINATIM_URL, OSRM_ROUTE_URL
+from .geometry import segment_lengths_m
+from .planning import LOCATION_FIELDS, format_coords
+from .upstream import nominatim_client, osrm_client
+
+BENCH_DATA_DIR = Path(__file__).parent / "testdata" / "bench"
+SCENARIOS_PATH = BENCH_DATA_DIR / "scenarios.json"
+RECORDED_DIR = BENCH_DATA_DIR / "recorded"
+
+# Synthetic routes: one vertex every VERTEX_SPACING_M along straight
+# lines, with road distances ROAD_FACTOR times the straight-line ones.
+VERTEX_SPACING_M = 150.0
+VERTICES_PER_STEP = 40
+ROAD_FACTOR = 1.2
+SPEED_M_S = 24.6
+
+
+def load_scenarios(path: Path = SCENARIOS_PATH) -> list[dict]:
+    """Benchmark trips with the coordinates of every address."""
+    return json.loads(path.read_text())
+
+
+def scenario_coords(scenario: dict) -> str:
+    """The OSRM `lon,lat;...` string planning requests for a scenario."""
+    trip = scenario["trip"]
+    return format_coords(
+        [scenario["points"][trip[field]] for field in LOCATION_FIELDS]
+    )
+
+
+def recorded_path(scenario: dict, recorded_dir: Path = RECORDED_DIR) -> Path:
+    """Where the recorded upstream responses of a scenario are kept."""
+    return recorded_dir / f"{scenario['name']}.json"
+
+
+def load_responses(scenario: dict, recorded_dir: Path = RECORDED_DIR) -> dict:
+    """
+    Upstream responses for a scenario as `{"nominatim": {address: json},
+    "osrm": {coords: json}}`: recorded ones when `recorded_dir` has them,
+    otherwise deterministic synthetic ones.
+    """
+    path = recorded_path(scenario, recorded_dir)
+    if path.exists():
+        return json.loads(path.read_text())
+
+    return synthetic_responses(scenario)
+
+
+def synthetic_responses(scenario: dict) -> dict:
+    trip = scenario["trip"]
+    points = [scenario["points"][trip[field]] for field in LOCATION_FIELDS]
+
+    return {
+        "nominatim": {
+            address: [{"lat": str(lat), "lon": str(lon)}]
+            for address, (lat, lon) in scenario["points"].items()
+        },
+        "osrm": {
+            scenario_coords(scenario): synthetic_osrm_response(
+                points, seed=scenario["name"]
+            )
+        },
+    }
+
+
+def synthetic_osrm_response(points: list, seed: str = "") -> dict:
+    """An OSRM `route` response shaped like `overview=full&steps=true`."""
+    rng = random.Random(seed)
+    legs = []
+    route_points = []
+
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        straight_m = segment_lengths_m([lat1, lat2], [lon1, lon2])[0]
+        n = max(int(straight_m / VERTEX_SPACING_M), 1)
+        leg_points = [
+            (
+                round(lat1 + (lat2 - lat1) * i / n + rng.gauss(0, 2e-4), 5),
+                round(lon1 + (lon2 - lon1) * i / n + rng.gauss(0, 2e-4), 5),
+            )
+            for i in range(n + 1)
+        ]
+        legs.append(_synthetic_leg(leg_points))
+        route_points.extend(leg_points if not route_points else leg_points[1:])
+
+    return {
+        "code": "Ok",
+        "routes": [
+            {
+                "geometry": polyline.encode(route_points),
+                "legs": legs,
+                "distance": sum(leg["distance"] for leg in legs),
+                "duration": sum(leg["duration"] for leg in legs),
+                "weight_name": "routability",
+                "weight": sum(leg["duration"] for leg in legs),
+            }
+        ],
+        "waypoints": [
+            {"location": [lon, lat], "name": ""} for lat, lon in points
+        ],
+    }
+
+
+def _synthetic_leg(points: list[tuple[float, float]]) -> dict:
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    segments_m = [
+        float(segment_m) * ROAD_FACTOR
+        for segment_m in segment_lengths_m(lats, lons)
+    ]
+
+    steps = []
+    for start in range(0, len(points) - 1, VERTICES_PER_STEP):
+        end = min(start + VERTICES_PER_STEP, len(points) - 1)
+        distance_m = sum(segments_m[start:end])
+        steps.append(
+            {
+                "geometry": polyline.encode(points[start : end + 1]),
+                "distance": round(distance_m, 1),
+                "duration": round(distance_m / SPEED_M_S, 1),
+                "name": "",
+                "mode": "driving",
+                "maneuver": {
+                    "location": [lons[start], lats[start]],
+                    "type": "turn" if start else "depart",
+                },
+            }
+        )
+
+    distance_m = sum(step["distance"] for step in steps)
+    return {
+        "steps": steps,
+        "summary": "",
+        "distance": round(distance_m, 1),
+        "duration": round(distance_m / SPEED_M_S, 1),
+        "annotation": {
+            "distance": [round(m, 1) for m in segments_m],
+            "duration": [round(m / SPEED_M_S, 1) for m in segments_m],
+        },
+    }
+
+
+def record_responses(scenario: dict) -> dict:
+    """Fetch a scenario's responses from the configured upstreams."""
+    trip = scenario["trip"]
+    nominatim = {
+        trip[field]: nominatim_client.get_json(
+            NOMINATIM_URL,
+            params={"q": trip[field], "format": "json", "limit": 1},
+        )
+        for field in LOCATION_FIELDS
+    }
+    points = [
+        (float(results[0]["lat"]), float(results[0]["lon"]))
+        for results in (nominatim[trip[field]] for field in LOCATION_FIELDS)
+    ]
+
+    coords = format_coords(points)
+    return {
+        "nominatim": nominatim,
+        "osrm": {
+            coords: osrm_client.get_json(OSRM_ROUTE_URL.format(coords=coords))
+        },
+    }
+
+
+class StubUpstreamServer:
+    """
+    Local HTTP server answering Nominatim `/search` and OSRM
+    `/route/v1/<profile>/<coords>` requests from canned responses, so the
+    whole HTTP path can be benchmarked without the public services.
+    """
+
+    def __init__(self, responses: dict):
+        self.nominatim = {}
+        self.osrm = {}
+        for scenario_responses in responses.values():
+            self.nominatim.update(scenario_responses["nominatim"])
+            self.osrm.update(scenario_responses["osrm"])
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def nominatim_url(self) -> str:
+        return f"{self.base_url}/search"
+
+    @property
+    def osrm_route_url(self) -> str:
+        query = urlsplit(OSRM_ROUTE_URL).query
+        return f"{self.base_url}/route/v1/driving/{{coords}}?{query}"
+
+    def __enter__(self) -> "StubUpstreamServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled sessions reuse their connections, and
+            # no Nagle delay between the headers and the body.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/search":
+                    query = parse_qs(url.query).get("q", [""])[0]
+                    body = stub.nominatim.get(query, [])
+                elif url.path.startswith("/route/v1/"):
+                    coords = unquote(url.path.rsplit("/", 1)[-1])
+                    body = stub.osrm.get(coords)
+                else:
+                    body = None
+
+                if body is None:
+                    self.send_response(400)
+                    body = {"code": "NoRoute"}
+                else:
+                    self.send_response(200)
+
+                payload = json.dumps(body).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
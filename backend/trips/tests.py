@@ -1,3 +1,1758 @@
-from django.test import TestCase
+import gzip
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from unittest import mock
+import polyline
+import requests
+from django.core.cache import caches
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from . import geometry, hos, planning, simplify
+from .benchmarks import compare, synthetic_polyline
+from .cache import LRUCache
+from .compact import compact_logs, expand_logs
+from .compression import compressed_cache, negotiate_encoding
+from .concurrency import run_all
+from .geometry import RouteGeometryIndex, haversine
+from .gazetteer import (
+    MappedGazetteer,
+    build_index,
+    read_source,
+    write_index,
+)
+from .jobs import run_job
+from .lanes import LaneMatrix
+from .planning import (
+    LOCATION_FIELDS,
+    plan_cache,
+    plan_for_locations,
+    route_cache,
+)
+from .renderers import msgpack
+from .simplify import douglas_peucker
+from .singleflight import SingleFlight
+from .enums import JobStatus, UpstreamPriority
+from .models import PlanningJob, TripPlan
+from .upstream import (
+    RateLimiter,
+    UpstreamClient,
+    UpstreamUnavailableError,
+    nominatim_client,
+)
+from .stub_upstream import (
+    StubUpstreamServer,
+    synthetic_osrm_response,
+    load_scenarios,
+    scenario_coords,
+    synthetic_responses,
+)
+from .utils import (
+    GEOCODE_NOT_FOUND,
+    GEOCODE_NEGATIVE_CACHE_TTL_S,
+    ELDCalculator,
+    call_osrm_route,
+    eld_cache,
+    eld_logs_for_profile,
+    eld_profile,
+    geocode,
+    geocode_cache,
+    geocode_flight,
+    interpolate_point_along_legs,
+)
 
-# Create your tests here.
+
+def make_route(pickup_leg_duration_s: float, dropoff_leg_duration_s: float):
+    """A minimal two-leg OSRM route driven at ~55 mph."""
+    legs = [
+        {
+            "duration": duration_s,
+            "distance": duration_s * 24.6,
+            "steps": [],
+        }
+        for duration_s in (pickup_leg_duration_s, dropoff_leg_duration_s)
+    ]
+
+    return {
+        "duration": sum(leg["duration"] for leg in legs),
+        "distance": sum(leg["distance"] for leg in legs),
+        "legs": legs,
+        "geometry": "",
+    }
+
+
+# Geocodes of the addresses of TRIP, the trip most tests plan.
+SITES = {
+    "Lemont, USA": (41.67, -88.0),
+    "Rockford, USA": (42.27, -89.09),
+    "LA, USA": (34.05, -118.24),
+}
+TRIP = {
+    "current_location": "Lemont, USA",
+    "pickup_location": "Rockford, USA",
+    "dropoff_location": "LA, USA",
+    "current_cycle_hours": 10,
+}
+TRIP_LOCATIONS = {field: SITES[TRIP[field]] for field in LOCATION_FIELDS}
+
+
+def route_between(coords: str) -> dict:
+    """A synthetic OSRM response for an OSRM `lon,lat;...` string."""
+    points = [
+        tuple(reversed([float(x) for x in point.split(",")]))
+        for point in coords.split(";")
+    ]
+    return synthetic_osrm_response(points, seed=coords)
+
+
+def store_route_plans(test):
+    """Run `test` with /api/route/ plans stored, as ROUTE_STORE_PLANS."""
+    for target in (
+        "trips.views.ROUTE_STORE_PLANS",
+        "trips.plans.ROUTE_STORE_PLANS",
+    ):
+        test = mock.patch(target, True)(test)
+
+    return test
+
+
+class ELDCalculatorPickupLegTests(TestCase):
+    def test_logs_match_separate_pickup_route(self):
+        for pickup_leg_s, dropoff_leg_s in [
+            (1800, 7200),
+            (6 * 3600, 30 * 3600),
+            (10 * 3600, 50 * 3600),
+            (20 * 3600, 15 * 3600),
+        ]:
+            route = make_route(pickup_leg_s, dropoff_leg_s)
+            # A separately requested pickup route that disagrees with the
+            # route's first leg.
+            separate_s = pickup_leg_s + 2 * 3600
+            for cycle_hours in (0, 35.5, 62, 70):
+                with self.subTest(
+                    pickup_leg_s=pickup_leg_s,
+                    dropoff_leg_s=dropoff_leg_s,
+                    cycle_hours=cycle_hours,
+                ):
+                    from_legs = ELDCalculator(
+                        route=route, curr_cycle_used_hours=cycle_hours
+                    )
+                    separate = ELDCalculator(
+                        route=route,
+                        route_from_curr_to_pickup_location={
+                            "duration": separate_s
+                        },
+                        curr_cycle_used_hours=cycle_hours,
+                    )
+
+                    self.assertEqual(
+                        from_legs.profile.pickup_duration_s, pickup_leg_s
+                    )
+                    self.assertEqual(
+                        separate.profile.pickup_duration_s, separate_s
+                    )
+                    self.assertEqual(
+                        from_legs.get_eld_logs(),
+                        ELDCalculator(
+                            route=route,
+                            route_from_curr_to_pickup_location={
+                                "duration": pickup_leg_s
+                            },
+                            curr_cycle_used_hours=cycle_hours,
+                        ).get_eld_logs(),
+                    )
+                    self.assertNotEqual(
+                        from_legs.get_eld_logs(), separate.get_eld_logs()
+                    )
+
+
+class ELDCalculatorGoldenLogTests(TestCase):
+    """
+    The HOS engine must keep producing the exact JSON of the original
+    day-by-day pipeline, recorded in testdata/eld_logs_golden.json.
+    """
+
+    def test_logs_match_recorded_output(self):
+        golden_path = Path(__file__).parent / "testdata/eld_logs_golden.json"
+        cases = json.loads(golden_path.read_text())
+
+        for case in cases:
+            with self.subTest(
+                pickup_leg_s=case["pickup_leg_s"],
+                dropoff_leg_s=case["dropoff_leg_s"],
+                cycle_hours=case["cycle_hours"],
+            ):
+                logs = ELDCalculator(
+                    route=make_route(
+                        case["pickup_leg_s"], case["dropoff_leg_s"]
+                    ),
+                    curr_cycle_used_hours=case["cycle_hours"],
+                ).get_eld_logs()
+
+                self.assertEqual(json.dumps(logs), json.dumps(case["logs"]))
+
+
+class CompactLogTests(TestCase):
+    def test_compact_logs_round_trip_to_the_minute(self):
+        golden_path = Path(__file__).parent / "testdata/eld_logs_golden.json"
+
+        for case in json.loads(golden_path.read_text()):
+            logs = case["logs"]
+            expected = [
+                {
+                    **log,
+                    "duty_status_timeline": [
+                        {
+                            **period,
+                            "start": round(period["start"] * 60) / 60,
+                            "end": round(period["end"] * 60) / 60,
+                        }
+                        for period in log["duty_status_timeline"]
+                    ],
+                }
+                for log in logs
+            ]
+
+            self.assertEqual(expand_logs(compact_logs(logs)), expected)
+
+
+class CycleHoursSweepTests(TestCase):
+    def test_sweep_matches_separate_calculators(self):
+        cycle_hours = [hours / 4 for hours in range(0, 300)] + [-5, 80]
+
+        for pickup_leg_s, dropoff_leg_s in [
+            (1800, 7200),
+            (10 * 3600, 50 * 3600),
+            (3 * 3600, 70 * 3600),
+        ]:
+            route = make_route(pickup_leg_s, dropoff_leg_s)
+            expected = []
+            for hours in cycle_hours:
+                logs = ELDCalculator(
+                    route=route, curr_cycle_used_hours=hours
+                ).get_eld_logs()
+                dropoff = next(
+                    period
+                    for period in logs[-1]["duty_status_timeline"]
+                    if period["activity"] == "Dropoff (1 hour)"
+                )
+                expected.append(
+                    {
+                        "current_cycle_hours": hours,
+                        "days": len(logs),
+                        "arrival_hours": (len(logs) - 1) * 24 + dropoff["end"],
+                        "daily_totals": [
+                            {
+                                key: value
+                                for key, value in log.items()
+                                if key != "duty_status_timeline"
+                            }
+                            for log in logs
+                        ],
+                    }
+                )
+
+            for numpy in (hos.np, None):
+                with self.subTest(
+                    pickup_leg_s=pickup_leg_s,
+                    dropoff_leg_s=dropoff_leg_s,
+                    numpy=numpy is not None,
+                ), mock.patch("trips.hos.np", numpy):
+                    self.assertEqual(
+                        json.dumps(
+                            ELDCalculator(route=route).sweep_cycle_hours(
+                                cycle_hours
+                            )
+                        ),
+                        json.dumps(expected),
+                    )
+
+
+class GeometryKernelTests(TestCase):
+    lats, lons = synthetic_polyline(500, seed=7)
+
+    def test_numpy_kernels_match_python_fallback(self):
+        for n_points in (2, 3, 500):
+            lats, lons = self.lats[:n_points], self.lons[:n_points]
+            with mock.patch("trips.geometry.np", None):
+                expected_m = geometry.cumulative_distances_m(lats, lons)
+            targets_m = [
+                -1.0,
+                0.0,
+                *(expected_m[-1] * i / 37 for i in (36, 1, 20, 5)),
+                expected_m[-1],
+                expected_m[-1] + 1,
+            ]
+            with mock.patch("trips.geometry.np", None):
+                expected_points = geometry.interpolate_at(
+                    lats, lons, expected_m, targets_m
+                )
+
+            for numpy in (geometry.np, None):
+                with self.subTest(
+                    n_points=n_points, numpy=numpy is not None
+                ), mock.patch("trips.geometry.np", numpy):
+                    cumulative_m = geometry.cumulative_distances_m(lats, lons)
+                    self.assertEqual(len(cumulative_m), n_points)
+                    for got, expected in zip(cumulative_m, expected_m):
+                        self.assertAlmostEqual(got, expected, places=6)
+
+                    points = geometry.interpolate_at(
+                        lats, lons, cumulative_m, targets_m
+                    )
+                    self.assertEqual(
+                        [point is None for point in points],
+                        [point is None for point in expected_points],
+                    )
+                    for got, expected in zip(points, expected_points):
+                        if expected is not None:
+                            self.assertAlmostEqual(got[0], expected[0])
+                            self.assertAlmostEqual(got[1], expected[1])
+
+
+class RouteGeometryIndexTests(TestCase):
+    legs = synthetic_osrm_response(
+        [(41.67, -88.0), (41.9, -88.3), (42.27, -89.09)], seed="index"
+    )["routes"][0]["legs"]
+
+    def scalar_points(self):
+        """Every vertex with its distance, each step scaled to its length."""
+        points = []
+        offset_m = 0.0
+        for leg in self.legs:
+            for step in leg["steps"]:
+                step_points = polyline.decode(step["geometry"])
+                lengths_m = [
+                    haversine((lon1, lat1), (lon2, lat2))
+                    for (lat1, lon1), (lat2, lon2) in zip(
+                        step_points, step_points[1:]
+                    )
+                ]
+                along_m = offset_m
+                points.append((along_m, step_points[0]))
+                for point, length_m in zip(step_points[1:], lengths_m):
+                    along_m += length_m * step["distance"] / sum(lengths_m)
+                    points.append((along_m, point))
+                offset_m += step["distance"]
+
+        return points
+
+    def scalar_point_at(self, target_m):
+        points = self.scalar_points()
+        for (start_m, start), (end_m, end) in zip(points, points[1:]):
+            if start_m <= target_m <= end_m and end_m > start_m:
+                fraction = (target_m - start_m) / (end_m - start_m)
+                return [
+                    start[0] + fraction * (end[0] - start[0]),
+                    start[1] + fraction * (end[1] - start[1]),
+                ]
+
+        return None
+
+    def test_lookups_match_scalar_interpolation(self):
+        total_m = sum(
+            step["distance"] for leg in self.legs for step in leg["steps"]
+        )
+        targets_m = [total_m * i / 53 for i in (40, 0, 7, 26, 52, 19)]
+
+        for numpy in (geometry.np, None):
+            with self.subTest(numpy=numpy is not None), mock.patch(
+                "trips.geometry.np", numpy
+            ):
+                index = RouteGeometryIndex(self.legs)
+                self.assertAlmostEqual(index.total_distance_m, total_m)
+
+                points = index.points_at(targets_m)
+                for target_m, point in zip(targets_m, points):
+                    self.assertEqual(point, index.point_at(target_m))
+                    single = interpolate_point_along_legs(self.legs, target_m)
+                    self.assertAlmostEqual(point[0], single[0])
+                    self.assertAlmostEqual(point[1], single[1])
+                    expected = self.scalar_point_at(target_m)
+                    self.assertAlmostEqual(point[0], expected[0])
+                    self.assertAlmostEqual(point[1], expected[1])
+
+                first_lat, first_lon = self.scalar_points()[0][1]
+                last_lat, last_lon = self.scalar_points()[-1][1]
+                self.assertEqual(index.point_at(0), [first_lat, first_lon])
+                self.assertAlmostEqual(index.point_at(total_m)[0], last_lat)
+                self.assertAlmostEqual(index.point_at(total_m)[1], last_lon)
+                self.assertIsNone(index.point_at(total_m + 1))
+                self.assertIsNone(index.point_at(-1))
+
+    def test_route_without_geometry_has_no_points(self):
+        index = RouteGeometryIndex(make_route(3600, 7200)["legs"])
+
+        self.assertEqual(index.total_distance_m, 0.0)
+        self.assertEqual(index.points_at([0, 100]), [None, None])
+
+
+class DouglasPeuckerTests(TestCase):
+    lats, lons = synthetic_polyline(2000, seed=3)
+    keep = [17, 500, 1234]
+
+    def simplify(self, tolerance_m, numpy):
+        with mock.patch("trips.simplify.np", numpy):
+            return douglas_peucker(
+                self.lats, self.lons, tolerance_m, self.keep
+            )
+
+    def test_numpy_and_python_keep_the_same_vertices(self):
+        for tolerance_m in (1.0, 10.0, 100.0, 1000.0):
+            with self.subTest(tolerance_m=tolerance_m):
+                self.assertEqual(
+                    self.simplify(tolerance_m, simplify.np),
+                    self.simplify(tolerance_m, None),
+                )
+
+    def test_endpoints_and_kept_vertices_are_kept(self):
+        for numpy in (simplify.np, None):
+            with self.subTest(numpy=numpy is not None):
+                self.assertEqual(
+                    self.simplify(1e9, numpy), [0, *self.keep, 1999]
+                )
+
+    def test_dropped_vertices_are_within_tolerance(self):
+        tolerance_m = 50.0
+        xs, ys = simplify._project_m(self.lats, self.lons)
+        kept = self.simplify(tolerance_m, simplify.np)
+        self.assertLess(len(kept), len(self.lats))
+
+        for start, end in zip(kept, kept[1:]):
+            dx, dy = xs[end] - xs[start], ys[end] - ys[start]
+            for i in range(start + 1, end):
+                px, py = xs[i] - xs[start], ys[i] - ys[start]
+                t = min(max((px * dx + py * dy) / (dx * dx + dy * dy), 0), 1)
+                self.assertLessEqual(
+                    math.hypot(px - t * dx, py - t * dy), tolerance_m
+                )
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "trips-tests",
+        },
+    }
+)
+class PlanningTestCase(TestCase):
+    """
+    Starts every test with empty geocode, route, plan, ELD, simplified
+    geometry and compressed response caches.
+    """
+
+    def setUp(self):
+        caches["shared"].clear()
+        for cache in (
+            geocode_cache,
+            route_cache,
+            plan_cache,
+            eld_cache,
+            planning._simplified,
+            compressed_cache,
+        ):
+            cache.clear()
+
+
+class CacheTests(PlanningTestCase):
+    def test_lru_evicts_by_count_and_weight(self):
+        cache = LRUCache(maxsize=3, max_weight=10, weigher=len)
+        cache.set("a", "xxxx")
+        cache.set("b", "xxxx")
+        cache.get("a")
+        cache.set("c", "xxxx")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "xxxx")
+        self.assertEqual(cache.weight, 8)
+
+        cache.set("d", "x" * 11)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_entries_are_misses(self):
+        cache = LRUCache(maxsize=4, ttl=60)
+        cache.set("a", 1, ttl=0.01)
+        cache.set("b", 2)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+    def test_shared_entry_keeps_its_ttl_when_promoted(self):
+        geocode_cache.set(
+            "nowhere", GEOCODE_NOT_FOUND, ttl=GEOCODE_NEGATIVE_CACHE_TTL_S
+        )
+        geocode_cache.set("lemont", (41.67, -88.0))
+        # Another worker: only the shared tier has the entries.
+        geocode_cache.local.clear()
+
+        self.assertEqual(geocode_cache.get("nowhere"), GEOCODE_NOT_FOUND)
+        self.assertEqual(geocode_cache.get("lemont"), (41.67, -88.0))
+        self.assertEqual(geocode_cache.shared_hits, 2)
+
+        _, expires_at, _ = geocode_cache.local._data["nowhere"]
+        self.assertLessEqual(
+            expires_at - time.monotonic(), GEOCODE_NEGATIVE_CACHE_TTL_S
+        )
+        _, expires_at, _ = geocode_cache.local._data["lemont"]
+        self.assertGreater(
+            expires_at - time.monotonic(), GEOCODE_NEGATIVE_CACHE_TTL_S
+        )
+
+    def test_zero_ttl_never_expires_in_either_tier(self):
+        geocode_cache.set("lemont", (41.67, -88.0), ttl=0)
+        geocode_cache.local.clear()
+
+        self.assertEqual(geocode_cache.get("lemont"), (41.67, -88.0))
+        self.assertEqual(geocode_cache.shared_hits, 1)
+        _, expires_at, _ = geocode_cache.local._data["lemont"]
+        self.assertIsNone(expires_at)
+
+
+class ELDCacheTests(PlanningTestCase):
+    @mock.patch("trips.utils.ELD_CACHE_DURATION_QUANTUM_S", 60)
+    @mock.patch("trips.utils.ELD_CACHE_DISTANCE_QUANTUM_M", 10)
+    @mock.patch("trips.utils.ELD_CACHE_CYCLE_HOURS_BUCKET", 0.25)
+    def test_opted_in_quanta_share_logs_of_near_identical_trips(self):
+        route = make_route(2 * 3600, 28 * 3600)
+        near_route = {**route, "duration": route["duration"] + 10}
+
+        with mock.patch.object(
+            ELDCalculator,
+            "get_eld_logs",
+            autospec=True,
+            side_effect=ELDCalculator.get_eld_logs,
+        ) as get_eld_logs:
+            logs = eld_logs_for_profile(eld_profile(route, 10))
+            near_logs = eld_logs_for_profile(eld_profile(near_route, 10.1))
+
+        get_eld_logs.assert_called_once()
+        self.assertEqual(near_logs, logs)
+        self.assertEqual(
+            logs,
+            ELDCalculator(
+                route=route, curr_cycle_used_hours=10
+            ).get_eld_logs(),
+        )
+
+    def test_plans_use_the_exact_cycle_hours(self):
+        route = make_route(2 * 3600, 28 * 3600)
+        for hours in (38, 38.1):
+            self.assertEqual(
+                plan_for_locations(TRIP_LOCATIONS, hours, route=route)["logs"],
+                ELDCalculator(
+                    route=route, curr_cycle_used_hours=hours
+                ).get_eld_logs(),
+            )
+
+    def test_exact_trips_get_their_own_logs(self):
+        route = make_route(2 * 3600, 28 * 3600)
+        near_route = {**route, "duration": route["duration"] + 10}
+
+        self.assertNotEqual(
+            eld_profile(near_route, 10.1).cache_key(),
+            eld_profile(route, 10).cache_key(),
+        )
+
+    @mock.patch("trips.utils.ELD_CACHE_DURATION_QUANTUM_S", 60)
+    def test_short_route_is_not_quantized_to_zero_duration(self):
+        route = make_route(5, 10)
+        profile = eld_profile(route, 10)
+
+        self.assertGreater(profile.duration_s, 0)
+        self.assertEqual(len(eld_logs_for_profile(profile)), 1)
+
+
+class TripRouteViewTests(PlanningTestCase):
+    def test_route_is_requested_once(self):
+        route = make_route(2 * 3600, 28 * 3600)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value={"routes": [route]}
+        ) as call_osrm_route:
+            response = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        call_osrm_route.assert_called_once()
+        self.assertEqual(
+            response.json()["logs"],
+            ELDCalculator(
+                route=route,
+                route_from_curr_to_pickup_location={"duration": 2 * 3600},
+                curr_cycle_used_hours=10,
+            ).get_eld_logs(),
+        )
+
+    def test_simplified_geometries_are_sent_on_request(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value=synthetic_osrm_response(
+                list(TRIP_LOCATIONS.values())
+            ),
+        ):
+            routes = {
+                query: self.client.post(
+                    f"/api/route/{query}",
+                    TRIP,
+                    content_type="application/json",
+                ).json()["route"]
+                for query in ("", "?route=simplified", "?zoom=5")
+            }
+
+        self.assertNotIn("geometries", routes[""])
+        self.assertEqual(
+            set(routes["?route=simplified"]["geometries"]), {"5", "8", "11"}
+        )
+        self.assertNotIn("geometries", routes["?zoom=5"])
+        self.assertEqual(
+            routes["?zoom=5"]["geometry"],
+            routes["?route=simplified"]["geometries"]["5"],
+        )
+
+    def test_route_is_slim_unless_full_is_requested(self):
+        osrm_response = synthetic_osrm_response(list(TRIP_LOCATIONS.values()))
+
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value=osrm_response
+        ):
+            routes = {
+                query: self.client.post(
+                    f"/api/route/{query}",
+                    TRIP,
+                    content_type="application/json",
+                ).json()["route"]
+                for query in ("", "?route=full")
+            }
+
+        self.assertEqual(
+            set(routes[""]), {"geometry", "distance", "duration", "legs"}
+        )
+        for leg in routes[""]["legs"]:
+            self.assertEqual(set(leg), {"distance", "duration", "summary"})
+        self.assertEqual(routes["?route=full"], osrm_response["routes"][0])
+
+    def test_geometries_are_simplified_once_on_request(self):
+        simplify_geometry = planning.simplify_geometry
+
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value=synthetic_osrm_response(
+                list(TRIP_LOCATIONS.values())
+            ),
+        ), mock.patch(
+            "trips.planning.simplify_geometry", side_effect=simplify_geometry
+        ) as simplify:
+            self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+            self.assertFalse(simplify.called)
+
+            for _ in range(2):
+                self.client.post(
+                    "/api/route/?zoom=5",
+                    TRIP,
+                    content_type="application/json",
+                )
+
+        simplify.assert_called_once()
+        self.assertEqual(simplify.call_args.args[2], [5])
+
+    def test_stage_timings_are_reported(self):
+        route = make_route(2 * 3600, 28 * 3600)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value={"routes": [route]}
+        ):
+            response = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+
+        stages = [
+            entry.split(";")[0]
+            for entry in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(stages, ["geocode", "route", "stops", "eld", "total"])
+
+        metrics = self.client.get("/api/metrics/")
+        self.assertEqual(metrics.status_code, 200)
+        body = metrics.content.decode()
+        self.assertIn('trips_stage_seconds_count{stage="geocode"}', body)
+        self.assertIn(
+            'trips_request_seconds_bucket{view="trip-route",le="+Inf"}', body
+        )
+        self.assertIn('trips_cache_hit_ratio{cache="plan"}', body)
+
+    def test_logs_can_be_requested_compact(self):
+        route = make_route(2 * 3600, 28 * 3600)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value={"routes": [route]}
+        ):
+            full = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+            compact = self.client.post(
+                "/api/route/?logs=compact",
+                TRIP,
+                content_type="application/json",
+            )
+            if msgpack is not None:
+                packed = self.client.post(
+                    "/api/route/",
+                    TRIP,
+                    content_type="application/json",
+                    HTTP_ACCEPT="application/msgpack",
+                )
+                self.assertEqual(
+                    msgpack.unpackb(packed.content)["logs"],
+                    compact.json()["logs"],
+                )
+
+        self.assertEqual(
+            compact.json()["logs"], compact_logs(full.json()["logs"])
+        )
+
+    def test_repeat_lane_is_served_from_cache(self):
+        route = make_route(2 * 3600, 28 * 3600)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value={"routes": [route]}
+        ) as call_osrm_route:
+            first = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+            second = self.client.post(
+                "/api/route/",
+                {**TRIP, "current_cycle_hours": 65},
+                content_type="application/json",
+            )
+            third = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+
+        call_osrm_route.assert_called_once()
+        self.assertEqual(third.json(), first.json())
+        self.assertNotEqual(second.json()["logs"], first.json()["logs"])
+
+    @store_route_plans
+    def test_stored_plan_is_served_by_id_with_etag(self):
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            first = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+
+        plan_id = first.json()["plan_id"]
+        self.assertEqual(first["Content-Location"], f"/api/route/{plan_id}/")
+
+        # Same trip, differently spelled: served from the stored plan.
+        plan_cache.clear()
+        with mock.patch("trips.planning.geocode") as geocode:
+            second = self.client.post(
+                "/api/route/",
+                {
+                    **TRIP,
+                    "current_location": "  lemont,  usa ",
+                },
+                content_type="application/json",
+            )
+
+        geocode.assert_not_called()
+        self.assertEqual(second.json(), first.json())
+
+        response = self.client.get(first["Content-Location"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), first.json())
+        self.assertEqual(response["ETag"], first["ETag"])
+
+        not_modified = self.client.get(
+            first["Content-Location"], HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+        compact = self.client.get(
+            f"{first['Content-Location']}?logs=compact",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(compact.status_code, 200)
+        self.assertNotEqual(compact["ETag"], response["ETag"])
+
+    @store_route_plans
+    def test_plans_in_use_do_not_expire(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            plan_url = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )["Content-Location"]
+
+        # Not touched again while recently served.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(plan_url)
+        self.assertFalse(
+            any(
+                q["sql"].startswith("UPDATE") for q in queries.captured_queries
+            )
+        )
+
+        two_days_ago = timezone.now() - timedelta(days=2)
+        TripPlan.objects.update(updated_at=two_days_ago)
+        self.client.get(plan_url)
+        self.assertGreater(
+            TripPlan.objects.get().updated_at, two_days_ago + timedelta(days=1)
+        )
+
+        TripPlan.objects.update(updated_at=two_days_ago)
+        with mock.patch("trips.planning.geocode") as geocode:
+            self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+        geocode.assert_not_called()
+        self.assertGreater(
+            TripPlan.objects.get().updated_at, two_days_ago + timedelta(days=1)
+        )
+
+    def test_route_plans_are_not_stored_by_default(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            response = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("logs", response.json())
+        self.assertNotIn("plan_id", response.json())
+        self.assertFalse(response.has_header("Content-Location"))
+        self.assertFalse(TripPlan.objects.exists())
+
+    @store_route_plans
+    def test_expired_plans_are_pruned_by_command(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            for hours in (10, 20):
+                self.client.post(
+                    "/api/route/",
+                    {**TRIP, "current_cycle_hours": hours},
+                    content_type="application/json",
+                )
+        kept = TripPlan.objects.earliest("created_at")
+        TripPlan.objects.exclude(pk=kept.pk).update(
+            updated_at=timezone.now() - timedelta(days=30)
+        )
+
+        call_command("prune_trip_plans", stdout=mock.Mock())
+
+        self.assertEqual(list(TripPlan.objects.all()), [kept])
+
+    def test_stream_emits_each_day_log(self):
+        route = make_route(2 * 3600, 28 * 3600)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", return_value={"routes": [route]}
+        ):
+            streamed = self.client.post(
+                "/api/route/?stream=true",
+                TRIP,
+                content_type="application/json",
+            )
+            events = [
+                json.loads(line)
+                for line in b"".join(streamed.streaming_content).splitlines()
+            ]
+            plain = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            ).json()
+
+        self.assertEqual(streamed["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["route", "stops"] + ["log"] * len(plain["logs"]) + ["end"],
+        )
+        self.assertEqual(events[0]["route"], plain["route"])
+        self.assertEqual(events[1]["stops"], plain["stops"])
+        self.assertEqual(
+            [event["log"] for event in events if event["type"] == "log"],
+            plain["logs"],
+        )
+
+
+class TripRouteBatchViewTests(PlanningTestCase):
+    def test_batch_dedupes_upstream_calls_and_keeps_order(self):
+
+        def geocode(address):
+            if address not in SITES:
+                raise ValueError(f"Address not found: {address}")
+            return SITES[address]
+
+        plan_threads = []
+        real_build_plan = planning.build_plan
+
+        def build_plan(*args):
+            plan_threads.append(threading.current_thread())
+            return real_build_plan(*args)
+
+        trips = [
+            TRIP,
+            {**TRIP, "dropoff_location": "Nowhere"},
+            {
+                **TRIP,
+                "current_location": " lemont,  usa",
+                "current_cycle_hours": 65,
+            },
+        ]
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=geocode
+        ) as geocode_mock, mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ) as call_osrm_route, mock.patch(
+            "trips.planning.build_plan", side_effect=build_plan
+        ):
+            response = self.client.post(
+                "/api/route/batch/",
+                {"trips": trips},
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(geocode_mock.call_count, 4)
+        call_osrm_route.assert_called_once()
+        # Stops and ELD logs are computed in the request thread, not on
+        # the upstream pool.
+        self.assertEqual(plan_threads, [threading.current_thread()] * 2)
+
+        results = response.json()["results"]
+        self.assertEqual(len(results), 3)
+        self.assertIn("logs", results[0])
+        self.assertEqual(
+            results[1],
+            {"error": {"message": "Invalid location", "status": 400}},
+        )
+        self.assertNotEqual(results[2]["logs"], results[0]["logs"])
+
+
+@mock.patch("trips.jobs.JOB_MAX_WORKERS", 0)
+class JobViewTests(PlanningTestCase):
+
+    def submit(self, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/route/?async=true",
+                payload,
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], response.json()["status_url"])
+        return self.client.get(response["Location"])
+
+    def test_job_result_matches_sync_response(self):
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            job = self.submit(TRIP).json()
+            sync = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            ).json()
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], sync)
+
+    def test_failed_job_reports_error(self):
+        with mock.patch(
+            "trips.planning.geocode", side_effect=ValueError("not found")
+        ):
+            job = self.submit(TRIP).json()
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(
+            job["error"], {"message": "Invalid location", "status": 400}
+        )
+
+    def test_jobs_left_behind_are_recovered_and_pruned(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        request = {"trip": TRIP, "route": "slim", "zoom": None}
+        queued, running, abandoned = (
+            PlanningJob.objects.create(request=request) for _ in range(3)
+        )
+        PlanningJob.objects.filter(pk=queued.pk).update(created_at=long_ago)
+        PlanningJob.objects.filter(pk=running.pk).update(
+            status=JobStatus.RUNNING, started_at=long_ago
+        )
+        PlanningJob.objects.filter(pk=abandoned.pk).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            with mock.patch("trips.jobs._recovered_at", None):
+                self.submit(TRIP)
+
+        queued.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(queued.status, JobStatus.SUCCEEDED)
+        self.assertEqual(running.status, JobStatus.FAILED)
+        self.assertEqual(
+            running.error, {"message": "Job was interrupted", "status": 503}
+        )
+        self.assertFalse(PlanningJob.objects.filter(pk=abandoned.pk).exists())
+
+    def test_job_failed_as_interrupted_keeps_its_failure(self):
+        job = PlanningJob.objects.create(
+            request={"trip": TRIP, "route": "slim", "zoom": None}
+        )
+        interrupted = {"message": "Job was interrupted", "status": 503}
+
+        def recovered_meanwhile(*args):
+            PlanningJob.objects.filter(pk=job.pk).update(
+                status=JobStatus.FAILED, error=interrupted
+            )
+            return {"route": {}}
+
+        with mock.patch(
+            "trips.jobs.route_response", side_effect=recovered_meanwhile
+        ):
+            run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.error, interrupted)
+        self.assertIsNone(job.result)
+
+    def test_unknown_job_is_not_found(self):
+        response = self.client.get(
+            "/api/jobs/00000000-0000-0000-0000-000000000000/"
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+
+class StubUpstreamTests(PlanningTestCase):
+    def test_stub_serves_scenario_responses(self):
+        scenario = load_scenarios()[0]
+        responses = synthetic_responses(scenario)
+        coords = scenario_coords(scenario)
+
+        with StubUpstreamServer(
+            {scenario["name"]: responses}
+        ) as stub, mock.patch(
+            "trips.utils.NOMINATIM_URL", stub.nominatim_url
+        ), mock.patch(
+            "trips.utils.OSRM_ROUTE_URL", stub.osrm_route_url
+        ), mock.patch.object(
+            nominatim_client, "rate_limiter", None
+        ):
+            locations = {
+                address: geocode(address) for address in scenario["points"]
+            }
+            osrm_response = call_osrm_route(coords)
+
+        self.assertEqual(
+            locations,
+            {
+                address: tuple(point)
+                for address, point in scenario["points"].items()
+            },
+        )
+        self.assertEqual(osrm_response, responses["osrm"][coords])
+
+    def test_compare_skips_rows_of_other_upstream_responses(self):
+        row = {"best_ms": 20.0, "peak_kib": 10.0}
+        baseline = [
+            {"name": "view.cold[short]", "upstream": "synthetic", **row},
+            {"name": "view.warm[short]", "upstream": "recorded", **row},
+        ]
+        rows = [
+            {"name": name, "upstream": "recorded", **row, "best_ms": 40.0}
+            for name in ("view.cold[short]", "view.warm[short]")
+        ]
+
+        changes = compare(rows, baseline, tolerance=0.2)
+
+        self.assertEqual(
+            changes,
+            [
+                {
+                    "name": "view.warm[short]",
+                    "best_ms": 1.0,
+                    "peak_kib": 0.0,
+                    "regressed": True,
+                }
+            ],
+        )
+
+
+class GazetteerTests(PlanningTestCase):
+    geonames_row = "\t".join(
+        [
+            "4887398",
+            "Chicago",
+            "Chicago",
+            "",
+            "41.85003",
+            "-87.65005",
+            "P",
+            "PPLA2",
+            "US",
+            "",
+            "IL",
+            "031",
+            "",
+            "",
+            "2720546",
+        ]
+    )
+
+    def test_mapped_index_resolves_known_places(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sites = Path(tmp) / "sites.csv"
+            sites.write_text(
+                "name,lat,lon,aliases\n"
+                "Joliet Terminal,41.52,-88.08,JOL|Joliet DC\n"
+            )
+            cities = Path(tmp) / "cities.txt"
+            cities.write_text(self.geonames_row + "\n")
+            index = build_index([*read_source(sites), *read_source(cities)])
+            write_index(index, Path(tmp) / "gazetteer.bin")
+            gazetteer = MappedGazetteer(Path(tmp) / "gazetteer.bin")
+
+            self.assertEqual(len(gazetteer), len(index))
+            for key, coords in index.items():
+                self.assertEqual(gazetteer.lookup(key), coords)
+            self.assertEqual(gazetteer.lookup("joliet dc"), (41.52, -88.08))
+            self.assertEqual(
+                gazetteer.lookup("chicago, il, usa"), (41.85003, -87.65005)
+            )
+            self.assertIsNone(gazetteer.lookup("springfield, il"))
+
+            with mock.patch(
+                "trips.utils.get_gazetteer", return_value=gazetteer
+            ), mock.patch(
+                "trips.utils.nominatim_client.get_json",
+                return_value=[{"lat": "39.8", "lon": "-89.65"}],
+            ) as get_json:
+                self.assertEqual(
+                    geocode("  Chicago,IL "), (41.85003, -87.65005)
+                )
+                get_json.assert_not_called()
+
+                self.assertEqual(geocode("Springfield, IL"), (39.8, -89.65))
+                get_json.assert_called_once()
+
+    def test_csv_sites_win_over_cities_and_zips_are_indexed(self):
+        postal_row = "\t".join(
+            [
+                "US",
+                "60601",
+                "Chicago",
+                "Illinois",
+                "IL",
+                "Cook",
+                "031",
+                "",
+                "",
+                "41.8858",
+                "-87.6181",
+                "4",
+            ]
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            sites = Path(tmp) / "sites.csv"
+            sites.write_text(
+                "name,lat,lon,aliases\n"
+                'Chicago Yard,41.8,-87.7,"Chicago, IL"\n'
+            )
+            cities = Path(tmp) / "cities.txt"
+            cities.write_text(self.geonames_row + "\n")
+            zips = Path(tmp) / "US.txt"
+            zips.write_text(postal_row + "\n")
+
+            for sources in ((cities, sites, zips), (sites, zips, cities)):
+                with self.subTest(order=[path.name for path in sources]):
+                    index = build_index(
+                        row for path in sources for row in read_source(path)
+                    )
+
+                    self.assertEqual(index["chicago, il"], (41.8, -87.7))
+                    self.assertEqual(index["chicago"], (41.85003, -87.65005))
+                    for key in (
+                        "60601",
+                        "il 60601",
+                        "chicago, il 60601",
+                        "chicago, il 60601, usa",
+                    ):
+                        self.assertEqual(index[key], (41.8858, -87.6181))
+
+
+class LaneMatrixTests(PlanningTestCase):
+    def test_known_lanes_are_planned_without_osrm(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sites = Path(tmp) / "sites.csv"
+            sites.write_text(
+                "name,lat,lon\n"
+                + "".join(
+                    f"{name.split(',')[0]},{lat},{lon}\n"
+                    for name, (lat, lon) in SITES.items()
+                )
+            )
+            with mock.patch(
+                "trips.management.commands.build_lane_matrix.call_osrm_route",
+                side_effect=route_between,
+            ):
+                call_command(
+                    "build_lane_matrix",
+                    str(sites),
+                    output=str(Path(tmp) / "lanes.bin"),
+                    stdout=mock.Mock(),
+                )
+            lane_matrix = LaneMatrix(Path(tmp) / "lanes.bin")
+
+            with mock.patch(
+                "trips.planning.get_lane_matrix", return_value=lane_matrix
+            ), mock.patch(
+                "trips.planning.geocode", side_effect=SITES.__getitem__
+            ), mock.patch(
+                "trips.planning.call_osrm_route"
+            ) as call_osrm_route:
+                response = self.client.post(
+                    "/api/route/?route=full",
+                    {
+                        "current_location": "Lemont, USA",
+                        "pickup_location": "Rockford, USA",
+                        "dropoff_location": "LA, USA",
+                        "current_cycle_hours": 10,
+                    },
+                    content_type="application/json",
+                )
+
+        self.assertEqual(response.status_code, 200)
+        call_osrm_route.assert_not_called()
+
+        first, second = (
+            route_between(coords)["routes"][0]
+            for coords in (
+                "-88.00000,41.67000;-89.09000,42.27000",
+                "-89.09000,42.27000;-118.24000,34.05000",
+            )
+        )
+        route = response.json()["route"]
+        self.assertEqual(
+            route["distance"], first["distance"] + second["distance"]
+        )
+
+        first_points = polyline.decode(first["geometry"])
+        second_points = polyline.decode(second["geometry"])
+        if second_points[0] == first_points[-1]:
+            second_points = second_points[1:]
+        self.assertEqual(
+            polyline.decode(route["geometry"]), first_points + second_points
+        )
+
+
+class CompressionTests(PlanningTestCase):
+    def test_negotiates_the_preferred_available_encoding(self):
+        with mock.patch(
+            "trips.compression.AVAILABLE_ENCODINGS", ["zstd", "gzip"]
+        ):
+            self.assertEqual(negotiate_encoding("gzip, zstd"), "zstd")
+            self.assertEqual(negotiate_encoding("br;q=1, gzip;q=0.5"), "gzip")
+            self.assertEqual(negotiate_encoding("*;q=0.1, zstd;q=0"), "gzip")
+            self.assertIsNone(negotiate_encoding("identity"))
+            self.assertIsNone(negotiate_encoding(""))
+
+    @store_route_plans
+    def test_stored_plan_reuses_its_compressed_body(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            plain = self.client.post(
+                "/api/route/", TRIP, content_type="application/json"
+            )
+            compressed = self.client.post(
+                "/api/route/",
+                TRIP,
+                content_type="application/json",
+                HTTP_ACCEPT_ENCODING="gzip",
+            )
+
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertEqual(compressed["ETag"], f"W/{plain['ETag']}")
+        self.assertEqual(
+            json.loads(gzip.decompress(compressed.content)), plain.json()
+        )
+
+        with mock.patch("trips.middleware.compress") as compress, mock.patch(
+            "trips.views.trip_plan_response"
+        ) as trip_plan_response:
+            again = self.client.get(
+                plain["Content-Location"], HTTP_ACCEPT_ENCODING="gzip"
+            )
+
+        compress.assert_not_called()
+        trip_plan_response.assert_not_called()
+        self.assertEqual(again.content, compressed.content)
+        self.assertEqual(again["ETag"], compressed["ETag"])
+        self.assertIn("Accept", again["Vary"])
+
+        not_modified = self.client.get(
+            plain["Content-Location"],
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=again["ETag"],
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], compressed["ETag"])
+        self.assertIn("Accept", not_modified["Vary"])
+        self.assertIn("Accept-Encoding", not_modified["Vary"])
+
+        identity = self.client.get(
+            plain["Content-Location"], HTTP_IF_NONE_MATCH=plain["ETag"]
+        )
+        self.assertEqual(identity.status_code, 304)
+        self.assertEqual(identity["ETag"], plain["ETag"])
+
+    def test_plans_with_identical_content_keep_their_own_body(self):
+        with mock.patch(
+            "trips.planning.geocode",
+            side_effect=SITES.__getitem__,
+        ), mock.patch(
+            "trips.planning.call_osrm_route",
+            return_value={"routes": [make_route(2 * 3600, 28 * 3600)]},
+        ):
+            first, second = (
+                self.client.post(
+                    "/api/plans/",
+                    TRIP,
+                    content_type="application/json",
+                )["Location"]
+                for _ in range(2)
+            )
+
+        first_response = self.client.get(first, HTTP_ACCEPT_ENCODING="gzip")
+        second_response = self.client.get(second, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertNotEqual(first_response["ETag"], second_response["ETag"])
+        self.assertEqual(
+            json.loads(gzip.decompress(second_response.content))["plan_id"],
+            second.split("/")[-2],
+        )
+        revalidated = self.client.get(
+            second, HTTP_IF_NONE_MATCH=first_response["ETag"]
+        )
+        self.assertEqual(revalidated.status_code, 200)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get("/api/health/", HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.json(), {"status": "ok"})
+
+
+class ReplanTests(PlanningTestCase):
+    def test_replans_on_route_and_reroutes_off_route(self):
+        with mock.patch(
+            "trips.planning.geocode", side_effect=SITES.__getitem__
+        ), mock.patch(
+            "trips.planning.call_osrm_route", side_effect=route_between
+        ):
+            response = self.client.post(
+                "/api/plans/?route=full",
+                TRIP,
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+        plan = response.json()
+        plan_url = f"/api/plans/{plan['plan_id']}/"
+        self.assertEqual(response["Location"], plan_url)
+        route = plan["route"]
+
+        # Past the pickup and the first fuel stop.
+        points = polyline.decode(route["geometry"])
+        lat, lon = points[len(points) * 3 // 5]
+
+        with mock.patch("trips.planning.call_osrm_route") as call_osrm_route:
+            response = self.client.post(
+                f"{plan_url}replan/",
+                {"lat": lat, "lon": lon, "current_cycle_hours": 20},
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        call_osrm_route.assert_not_called()
+        replan = response.json()
+        self.assertFalse(replan["rerouted"])
+        self.assertEqual(replan["version"], 1)
+        self.assertTrue(replan["progress"]["pickup_done"])
+        self.assertAlmostEqual(
+            replan["progress"]["distance_m"]
+            + replan["progress"]["remaining_distance_m"],
+            route["distance"],
+        )
+        self.assertLess(
+            replan["progress"]["remaining_duration_s"],
+            route["legs"][1]["duration"],
+        )
+        self.assertEqual(
+            [stop["label"] for stop in replan["stops"]],
+            ["Current location", "Fuel stop #2", "Dropoff (1h)"],
+        )
+        activities = [
+            period["activity"]
+            for log in replan["logs"]
+            for period in log["duty_status_timeline"]
+        ]
+        self.assertNotIn("Pickup (1 hour)", activities)
+        self.assertIn("Dropoff (1 hour)", activities)
+
+        with mock.patch(
+            "trips.planning.call_osrm_route", side_effect=route_between
+        ) as call_osrm_route:
+            response = self.client.post(
+                f"{plan_url}replan/",
+                {"lat": 45.0, "lon": -100.0, "current_cycle_hours": 30},
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        call_osrm_route.assert_called_once()
+        replan = response.json()
+        self.assertTrue(replan["rerouted"])
+        self.assertEqual(replan["version"], 2)
+        # Past the pickup, the new route starts with an empty pickup leg.
+        self.assertTrue(
+            call_osrm_route.call_args.kwargs["coords"].startswith(
+                "-100.00000,45.00000;-100.00000,45.00000;"
+            )
+        )
+        self.assertEqual(
+            self.client.get(plan_url).json()["stops"], replan["stops"]
+        )
+
+    def test_unknown_plan_is_not_found(self):
+        response = self.client.post(
+            "/api/plans/00000000-0000-0000-0000-000000000000/replan/",
+            {"lat": 40, "lon": -90, "current_cycle_hours": 0},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+
+class SingleFlightTests(PlanningTestCase):
+    def test_concurrent_geocodes_share_one_request(self):
+        release = threading.Event()
+
+        def slow_geocode(address):
+            release.wait(5)
+            return (41.85, -87.65)
+
+        followers = geocode_flight.followers
+        results = []
+        with mock.patch(
+            "trips.utils._geocode_upstream", side_effect=slow_geocode
+        ) as geocode_upstream:
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(geocode("Chicago, IL"))
+                )
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            while geocode_flight.followers < followers + 7:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        geocode_upstream.assert_called_once()
+        self.assertEqual(results, [(41.85, -87.65)] * 8)
+
+    def test_waits_for_the_worker_holding_the_lock(self):
+        flight = SingleFlight("test", shared_alias="shared")
+        caches["shared"].add(flight._lock_key("lane"), 1)
+        shared = {}
+        threading.Timer(0.1, shared.__setitem__, ("lane", "route")).start()
+        fetch = mock.Mock(return_value="own route")
+
+        self.assertEqual(
+            flight.do("lane", fetch, lookup=lambda: shared.get("lane")),
+            "route",
+        )
+        fetch.assert_not_called()
+
+
+class ConcurrencyTests(PlanningTestCase):
+    def test_geocodes_run_concurrently_on_the_pool(self):
+        # Only passes once all three geocodes are waiting at the same time.
+        barrier = threading.Barrier(len(LOCATION_FIELDS), timeout=5)
+        threads = {}
+
+        def geocode(address):
+            barrier.wait()
+            threads[address] = threading.current_thread().name
+            return (41.67, -88.0)
+
+        with mock.patch("trips.planning.geocode", side_effect=geocode):
+            locations = planning.geocode_locations(TRIP)
+
+        self.assertEqual(set(locations), set(LOCATION_FIELDS))
+        self.assertEqual(len(set(threads.values())), len(LOCATION_FIELDS))
+        for name in threads.values():
+            self.assertTrue(name.startswith("trips-upstream"))
+
+    def test_every_geocoding_error_is_collected(self):
+        errors = {
+            "Rockford, USA": ValueError("not found"),
+            "LA, USA": UpstreamUnavailableError("nominatim", 30),
+        }
+
+        def geocode(address):
+            if address in errors:
+                raise errors[address]
+            return (41.67, -88.0)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=geocode
+        ), self.assertLogs("trips.planning", "ERROR") as logs:
+            with self.assertRaises(planning.PlanningError) as raised:
+                planning.geocode_locations(TRIP)
+
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.retry_after_s, 30)
+        self.assertEqual(len(logs.records), 2)
+        self.assertTrue(any("pickup_location" in line for line in logs.output))
+        self.assertTrue(
+            any("dropoff_location" in line for line in logs.output)
+        )
+
+        results, run_errors = run_all(
+            {field: partial(geocode, TRIP[field]) for field in LOCATION_FIELDS}
+        )
+        self.assertEqual(list(results), ["current_location"])
+        self.assertEqual(
+            run_errors,
+            {
+                "pickup_location": errors["Rockford, USA"],
+                "dropoff_location": errors["LA, USA"],
+            },
+        )
+
+    @mock.patch("trips.concurrency.UPSTREAM_MAX_WORKERS", 1)
+    def test_one_worker_geocodes_sequentially(self):
+        calls = []
+
+        def geocode(address):
+            calls.append((address, threading.current_thread().name))
+            return (41.67, -88.0)
+
+        with mock.patch(
+            "trips.planning.geocode", side_effect=geocode
+        ), mock.patch("trips.concurrency.get_executor") as get_executor:
+            planning.geocode_locations(TRIP)
+
+        get_executor.assert_not_called()
+        self.assertEqual(
+            calls,
+            [
+                (TRIP[field], threading.current_thread().name)
+                for field in LOCATION_FIELDS
+            ],
+        )
+
+
+def upstream_response(status_code: int, content: bytes = b"{}"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+class UpstreamClientTests(TestCase):
+    def make_client(self, *outcomes, failure_threshold=1, reset_timeout_s=0):
+        client = UpstreamClient(
+            name="test",
+            connect_timeout_s=1,
+            read_timeout_s=1,
+            retries=2,
+            backoff_s=0,
+            pool_maxsize=1,
+            failure_threshold=failure_threshold,
+            reset_timeout_s=reset_timeout_s,
+        )
+        client._session = mock.Mock()
+        client._session.get.side_effect = outcomes
+        client._session_pid = os.getpid()
+        return client
+
+    def test_retries_server_errors_then_returns_json(self):
+        client = self.make_client(
+            upstream_response(503),
+            requests.ConnectionError("reset"),
+            upstream_response(200, b'{"ok": true}'),
+        )
+
+        self.assertEqual(client.get_json("http://upstream/"), {"ok": True})
+        self.assertEqual(client._session.get.call_count, 3)
+        self.assertFalse(client.breaker.is_open)
+
+    def test_open_circuit_rejects_calls_until_reset(self):
+        client = self.make_client(
+            *[requests.Timeout("slow")] * 3, reset_timeout_s=60
+        )
+
+        with self.assertRaises(requests.Timeout):
+            client.get_json("http://upstream/")
+        with self.assertRaises(UpstreamUnavailableError):
+            client.get_json("http://upstream/")
+
+        self.assertTrue(client.breaker.is_open)
+        self.assertEqual(client._session.get.call_count, 3)
+
+    def test_failed_trial_call_does_not_wedge_the_circuit(self):
+        client = self.make_client(
+            *[requests.ConnectionError("down")] * 3,
+            requests.exceptions.ChunkedEncodingError("cut"),
+            upstream_response(200, b"not json"),
+            upstream_response(200, b'{"ok": true}'),
+        )
+
+        # Opens the circuit, then two half-open trials fail in ways that
+        # are not retried.
+        with self.assertRaises(requests.ConnectionError):
+            client.get_json("http://upstream/")
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            client.get_json("http://upstream/")
+        with self.assertRaises(requests.exceptions.JSONDecodeError):
+            client.get_json("http://upstream/")
+        self.assertTrue(client.breaker.is_open)
+
+        self.assertEqual(client.get_json("http://upstream/"), {"ok": True})
+        self.assertFalse(client.breaker.is_open)
+
+    def test_bad_requests_do_not_open_the_circuit(self):
+        client = self.make_client(upstream_response(400))
+
+        with self.assertRaises(requests.HTTPError):
+            client.get_json("http://upstream/")
+
+        self.assertFalse(client.breaker.is_open)
+
+
+class RateLimiterTests(PlanningTestCase):
+    def test_interactive_calls_are_served_first(self):
+        limiter = RateLimiter("test", rate_per_s=10, burst=1, max_queue=8)
+        limiter.acquire(UpstreamPriority.INTERACTIVE, max_wait_s=1)
+        served = []
+
+        def call(priority):
+            limiter.acquire(priority, max_wait_s=5)
+            served.append(priority)
+
+        threads = []
+        for priority in (
+            UpstreamPriority.BACKGROUND,
+            UpstreamPriority.INTERACTIVE,
+        ):
+            threads.append(threading.Thread(target=call, args=(priority,)))
+            threads[-1].start()
+            while limiter.queued < len(threads):
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            served,
+            [UpstreamPriority.INTERACTIVE, UpstreamPriority.BACKGROUND],
+        )
+
+    def test_overloaded_geocoder_answers_503_with_retry_after(self):
+        limiter = RateLimiter("nominatim", rate_per_s=1, burst=1, max_queue=8)
+        limiter.acquire(UpstreamPriority.INTERACTIVE, max_wait_s=1)
+
+        with mock.patch.object(
+            nominatim_client, "rate_limiter", limiter
+        ), mock.patch.dict(
+            "trips.upstream.UPSTREAM_QUEUE_MAX_WAIT_S", {"interactive": 0.5}
+        ):
+            response = self.client.post(
+                "/api/route/",
+                TRIP,
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            response.json(), {"message": "Geocoding service unavailable"}
+        )
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
@@ -0,0 +1,367 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from .constants import UPSTREAM_CLIENTS, UPSTREAM_QUEUE_MAX_WAIT_S
+from .enums import UpstreamPriority
+from .metrics import record
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRY_AFTER_S = 10.0
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    The upstream is down or overloaded: the circuit is open, the rate
+    limit queue is too long, or it kept answering 429/5xx.
+    """
+
+    def __init__(self, upstream: str, retry_after_s: float):
+        super().__init__(
+            f"{upstream} is unavailable, retry in {retry_after_s:.0f}s"
+        )
+        self.upstream = upstream
+        self.retry_after_s = retry_after_s
+
+
+# Priority of the upstream calls made in the current context. Worker pool
+# calls inherit it, see `concurrency.iter_completed`.
+_priority: ContextVar[UpstreamPriority] = ContextVar(
+    "trips_upstream_priority", default=UpstreamPriority.INTERACTIVE
+)
+
+
+@contextmanager
+def upstream_priority(priority: UpstreamPriority):
+    """Make the upstream calls of a block queue at `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the threads of a worker: `rate_per_s` calls
+    per second on average, bursts of up to `burst`. Callers wait in
+    priority order, then arrival order. A call that would wait longer
+    than the max wait of its priority, or find `max_queue` callers
+    already waiting, is rejected at once with the estimated wait.
+    """
+
+    def __init__(
+        self, name: str, rate_per_s: float, burst: int, max_queue: int
+    ):
+        self.name = name
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self, priority: UpstreamPriority, max_wait_s: float):
+        with self._cond:
+            self._refill()
+            ahead = sum(1 for p, _ in self._waiters if p <= priority)
+            wait_s = (ahead + 1 - self._tokens) / self.rate_per_s
+            if len(self._waiters) >= self.max_queue or wait_s > max_wait_s:
+                self.rejected += 1
+                raise UpstreamUnavailableError(self.name, max(wait_s, 1.0))
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            # Higher priority callers arriving later can still push this
+            # one back, so the max wait is enforced while waiting too.
+            deadline = time.monotonic() + max_wait_s
+            try:
+                while self._waiters[0] != entry or self._tokens < 1:
+                    timeout_s = deadline - time.monotonic()
+                    if timeout_s <= 0:
+                        self.rejected += 1
+                        raise UpstreamUnavailableError(
+                            self.name, max(ahead / self.rate_per_s, 1.0)
+                        )
+                    if self._waiters[0] == entry:
+                        timeout_s = min(
+                            timeout_s, (1 - self._tokens) / self.rate_per_s
+                        )
+                    self._cond.wait(timeout_s)
+                    self._refill()
+
+                self._tokens -= 1
+                heapq.heappop(self._waiters)
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst,
+            self._tokens + (now - self._updated_at) * self.rate_per_s,
+        )
+        self._updated_at = now
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    until `reset_timeout_s` has passed, then lets a single trial call
+    through (half-open) to decide whether to close again.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int, reset_timeout_s: float
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+
+            elapsed_s = time.monotonic() - self._opened_at
+            if elapsed_s < self.reset_timeout_s or self._trial_in_flight:
+                raise UpstreamUnavailableError(
+                    self.name, max(self.reset_timeout_s - elapsed_s, 1.0)
+                )
+
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+
+            if (
+                self._opened_at is not None
+                or self._failures >= self.failure_threshold
+            ):
+                if self._opened_at is None:
+                    logger.warning(f"Circuit for {self.name} opened")
+                self._opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """
+    Keep-alive HTTP client for one upstream: a bounded connection pool
+    shared by the threads of a worker process, per-upstream timeouts,
+    an optional rate limiter, jittered retries on 429/5xx and a circuit
+    breaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connect_timeout_s: float,
+        read_timeout_s: float,
+        retries: int,
+        backoff_s: float,
+        pool_maxsize: int,
+        failure_threshold: int,
+        reset_timeout_s: float,
+        rate_limiter: Optional[RateLimiter] = None,
+        headers: Optional[dict] = None,
+    ):
+        self.name = name
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.pool_maxsize = pool_maxsize
+        self.headers = headers or {}
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout_s)
+        self.rate_limiter = rate_limiter
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        # Sessions must not be shared across a fork (e.g. gunicorn
+        # --preload), so each worker process builds its own.
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = self._build_session()
+                    self._session_pid = os.getpid()
+
+        return self._session
+
+    def get_json(self, url: str, params: Optional[dict] = None) -> Any:
+        self._wait_for_rate_limit()
+        self.breaker.before_call()
+
+        # Every way out of the call reports to the breaker, or a failed
+        # half-open trial would keep the circuit rejecting calls forever.
+        try:
+            r = self._get_with_retries(url, params)
+            data = r.json() if r.ok else None
+        except Exception:
+            self.breaker.record_failure()
+            raise
+
+        # Other 4xx mean the request itself was bad (e.g. OSRM NoRoute),
+        # not that the upstream is unhealthy.
+        self.breaker.record_success()
+        r.raise_for_status()
+        return data
+
+    def _get_with_retries(
+        self, url: str, params: Optional[dict]
+    ) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            is_last_attempt = attempt == self.retries
+
+            if attempt:
+                self._wait_for_rate_limit()
+
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_attempt(start, type(e).__name__)
+                if is_last_attempt:
+                    raise
+                logger.warning(f"{self.name} request failed: {e}")
+                self._sleep_before_retry(attempt)
+                continue
+            except requests.RequestException as e:
+                self._record_attempt(start, type(e).__name__)
+                raise
+
+            self._record_attempt(start, str(r.status_code))
+
+            if r.status_code in RETRY_STATUSES:
+                if is_last_attempt:
+                    raise UpstreamUnavailableError(
+                        self.name,
+                        _retry_after_s(r.headers.get("Retry-After"))
+                        or self.backoff_s * 2**attempt,
+                    )
+                logger.warning(f"{self.name} responded {r.status_code}")
+                self._sleep_before_retry(
+                    attempt, retry_after=r.headers.get("Retry-After")
+                )
+                continue
+
+            return r
+
+    def _wait_for_rate_limit(self):
+        if self.rate_limiter is not None:
+            priority = _priority.get()
+            self.rate_limiter.acquire(
+                priority, UPSTREAM_QUEUE_MAX_WAIT_S[priority.name.lower()]
+            )
+
+    def _record_attempt(self, start: float, outcome: str):
+        record(
+            "trips_upstream_request_seconds",
+            time.perf_counter() - start,
+            server_timing=self.name,
+            upstream=self.name,
+            outcome=outcome,
+        )
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+
+        return session
+
+    def _sleep_before_retry(
+        self, attempt: int, retry_after: Optional[str] = None
+    ):
+        delay_s = random.uniform(0, self.backoff_s * 2**attempt)
+        delay_s = max(delay_s, _retry_after_s(retry_after) or 0)
+
+        time.sleep(min(delay_s, MAX_RETRY_AFTER_S))
+
+
+def _retry_after_s(retry_after: Optional[str]) -> Optional[float]:
+    """Seconds of a `Retry-After: <seconds>` header, if any."""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    return None
+
+
+def _build_client(name: str, **kwargs) -> UpstreamClient:
+    config = UPSTREAM_CLIENTS[name]
+    rate_limiter = (
+        RateLimiter(
+            name,
+            rate_per_s=config["RATE_PER_S"],
+            burst=config["BURST"],
+            max_queue=config["MAX_QUEUE"],
+        )
+        if config.get("RATE_PER_S")
+        else None
+    )
+
+    return UpstreamClient(
+        name=name,
+        connect_timeout_s=config["CONNECT_TIMEOUT_S"],
+        read_timeout_s=config["READ_TIMEOUT_S"],
+        retries=config["RETRIES"],
+        backoff_s=config["BACKOFF_S"],
+        pool_maxsize=config["POOL_MAXSIZE"],
+        failure_threshold=config["FAILURE_THRESHOLD"],
+        reset_timeout_s=config["RESET_TIMEOUT_S"],
+        rate_limiter=rate_limiter,
+        **kwargs,
+    )
+
+
+nominatim_client = _build_client(
+    "nominatim",
+    headers={"User-Agent": "eld-trip-planner/1.0 (+https://example.com)"},
+)
+osrm_client = _build_client("osrm")
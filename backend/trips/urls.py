@@ -1,7 +1,45 @@
 from django.urls import path
-from .views import TripRouteView, health
+from .views import (
+    JobDetailView,
+    TripPlanDetailView,
+    TripPlanReplanView,
+    TripPlanView,
+    TripRouteView,
+    TripRouteBatchView,
+    TripRouteSweepView,
+    health,
+    metrics,
+)
 
 urlpatterns = [
     path("route/", TripRouteView.as_view(), name="trip-route"),
+    path(
+        "route/<uuid:plan_id>/",
+        TripPlanDetailView.as_view(),
+        name="trip-route-detail",
+    ),
+    path(
+        "route/batch/",
+        TripRouteBatchView.as_view(),
+        name="trip-route-batch",
+    ),
+    path(
+        "route/sweep/",
+        TripRouteSweepView.as_view(),
+        name="trip-route-sweep",
+    ),
+    path("plans/", TripPlanView.as_view(), name="trip-plan"),
+    path(
+        "plans/<uuid:plan_id>/",
+        TripPlanDetailView.as_view(),
+        name="trip-plan-detail",
+    ),
+    path(
+        "plans/<uuid:plan_id>/replan/",
+        TripPlanReplanView.as_view(),
+        name="trip-plan-replan",
+    ),
+    path("jobs/<uuid:job_id>/", JobDetailView.as_view(), name="job-detail"),
     path("health/", health, name="health"),
+    path("metrics/", metrics, name="metrics"),
 ]
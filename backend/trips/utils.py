@@ -1,109 +1,119 @@
 import math
-import requests
-import polyline
-from typing import Optional
-from .enums import TimeLineChangeType
+from functools import partial
+from typing import Iterator, Optional
+from .cache import TieredCache, json_size
+from .gazetteer import get_gazetteer, normalize_address
+from .geometry import RouteGeometryIndex
+from .hos import DayLog, HOSEngine, TripProfile, sweep_cycle_hours
+from .singleflight import single_flight
+from .upstream import nominatim_client, osrm_client
 from .constants import (
     OSRM_ROUTE_URL,
     NOMINATIM_URL,
-    EARTH_RADIUS_M,
+    GEOCODE_CACHE_ALIAS,
+    GEOCODE_CACHE_MAXSIZE,
+    GEOCODE_CACHE_TTL_S,
+    GEOCODE_NEGATIVE_CACHE_TTL_S,
+    GEOCODER_UPSTREAM_ENABLED,
+    ELD_CACHE_ALIAS,
+    ELD_CACHE_MAXSIZE,
+    ELD_CACHE_MAX_BYTES,
+    ELD_CACHE_TTL_S,
+    ELD_CACHE_DURATION_QUANTUM_S,
+    ELD_CACHE_DISTANCE_QUANTUM_M,
+    ELD_CACHE_CYCLE_HOURS_BUCKET,
     FUEL_INTERVAL_M,
     MAX_CYCLE_HOURS,
-    MAX_CYCLE_DAYS,
-    MAX_DRIVING_HOURS_PER_DAY,
-    MAX_DRIVING_HOURS_TO_REST,
-    BREAK_DURATION_H,
-    PICKUP_DURATION_H,
-    DROPOFF_DURATION_H,
-    TRIP_TIV_DURATION_H,
     SECONDS_TO_HOURS,
-    HOURS_IN_DAY,
-    NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX,
     METERS_TO_MILES,
 )
 
+GEOCODE_NOT_FOUND = "not-found"
 
-def geocode(address: str) -> tuple[float, float]:
-    params = {"q": address, "format": "json", "limit": 1}
-    headers = {"User-Agent": "eld-trip-planner/1.0 (+https://example.com)"}
+geocode_cache = TieredCache(
+    name="geocode",
+    maxsize=GEOCODE_CACHE_MAXSIZE,
+    ttl=GEOCODE_CACHE_TTL_S,
+    shared_alias=GEOCODE_CACHE_ALIAS,
+)
+geocode_flight = single_flight("geocode")
+eld_cache = TieredCache(
+    name="eld",
+    maxsize=ELD_CACHE_MAXSIZE,
+    ttl=ELD_CACHE_TTL_S,
+    shared_alias=ELD_CACHE_ALIAS,
+    max_weight=ELD_CACHE_MAX_BYTES,
+    weigher=json_size,
+)
 
-    r = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=10)
-    r.raise_for_status()
-    data = r.json()
 
-    if not data:
-        raise ValueError(f"Address not found: {address}")
+class AddressNotFoundError(ValueError):
+    pass
 
-    return float(data[0]["lat"]), float(data[0]["lon"])
 
+def geocode(address: str) -> tuple[float, float]:
+    key = normalize_address(address)
+
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        known = gazetteer.lookup(key)
+        if known is not None:
+            return known
+
+    cached = _cached_geocode(key, address)
+    if cached is not None:
+        return cached
+
+    # Concurrent lookups of the same address share one upstream request.
+    return geocode_flight.do(
+        key,
+        partial(_geocode_and_cache, key, address),
+        lookup=partial(_cached_geocode, key, address),
+    )
 
-def call_osrm_route(coords: str) -> dict:
-    url = OSRM_ROUTE_URL.format(coords=coords)
 
-    r = requests.get(url, timeout=20)
-    r.raise_for_status()
+def _cached_geocode(key: str, address: str) -> Optional[tuple[float, float]]:
+    cached = geocode_cache.get(key)
 
-    return r.json()
+    if cached == GEOCODE_NOT_FOUND:
+        raise AddressNotFoundError(f"Address not found: {address}")
+    if cached is not None:
+        return tuple(cached)
 
+    return None
 
-def haversine(
-    first_point_coords: list[float, float],
-    second_point_coords: list[float, float],
-) -> float:
-    """
-    Calculate the great-circle distance between two points
-    on the earth (specified in decimal degrees)
-    """
-    # convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(
-        math.radians, [*first_point_coords, *second_point_coords]
-    )
 
-    # haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
+def _geocode_and_cache(key: str, address: str) -> tuple[float, float]:
+    try:
+        coords = _geocode_upstream(address)
+    except AddressNotFoundError:
+        geocode_cache.set(
+            key, GEOCODE_NOT_FOUND, ttl=GEOCODE_NEGATIVE_CACHE_TTL_S
+        )
+        raise
 
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    )
-    c = 2 * math.asin(math.sqrt(a))
+    geocode_cache.set(key, coords)
+    return coords
 
-    return c * EARTH_RADIUS_M
 
+def _geocode_upstream(address: str) -> tuple[float, float]:
+    if not GEOCODER_UPSTREAM_ENABLED:
+        raise AddressNotFoundError(f"Address not found: {address}")
 
-def _interpolate_along_step_geometry(
-    geometry: str, target_m: float
-) -> Optional[list[float]]:
-    """Finds a point at a target distance along a single encoded polyline."""
-    try:
-        points = polyline.decode(geometry)
-        if len(points) < 2:
-            return None
-
-        travelled_m = 0.0
-        for i in range(1, len(points)):
-            p1 = points[i - 1]
-            p2 = points[i]
-            segment_dist_m = haversine(p1, p2)
-
-            if travelled_m + segment_dist_m >= target_m:
-                dist_into_segment_m = target_m - travelled_m
-                fraction = (
-                    dist_into_segment_m / segment_dist_m
-                    if segment_dist_m > 0
-                    else 0
-                )
+    params = {"q": address, "format": "json", "limit": 1}
 
-                lat = p1[0] + fraction * (p2[0] - p1[0])
-                lon = p1[1] + fraction * (p2[1] - p1[1])
-                return [lat, lon]
+    data = nominatim_client.get_json(NOMINATIM_URL, params=params)
 
-            travelled_m += segment_dist_m
-    except (ValueError, KeyError, ImportError):
-        return None
+    if not data:
+        raise AddressNotFoundError(f"Address not found: {address}")
 
-    return None
+    return float(data[0]["lat"]), float(data[0]["lon"])
+
+
+def call_osrm_route(coords: str) -> dict:
+    url = OSRM_ROUTE_URL.format(coords=coords)
+
+    return osrm_client.get_json(url)
 
 
 def interpolate_point_along_legs(
@@ -111,31 +121,21 @@ def interpolate_point_along_legs(
 ) -> Optional[list[float]]:
     """
     Find a lat-lon at a target distance from the start by walking the legs' and steps' geometry.
+    Only the step containing the target is decoded; use RouteGeometryIndex
+    for many lookups along the same route.
     """
+    if target_m < 0:
+        return None
+
     travelled_m = 0.0
     for leg in legs:
-        leg_dist_m = leg.get("distance", 0)
-
-        if travelled_m + leg_dist_m >= target_m:
-            # This leg contains our target point.
-            distance_into_leg_m = target_m - travelled_m
-
-            travelled_on_steps_m = 0.0
-            for step in leg.get("steps", []):
-                step_dist_m = step.get("distance", 0)
-
-                if travelled_on_steps_m + step_dist_m >= distance_into_leg_m:
-                    # This step contains our target point.
-                    distance_into_step_m = (
-                        distance_into_leg_m - travelled_on_steps_m
-                    )
-                    return _interpolate_along_step_geometry(
-                        step.get("geometry"), distance_into_step_m
-                    )
-
-                travelled_on_steps_m += step_dist_m
-
-        travelled_m += leg_dist_m
+        for step in leg.get("steps", []):
+            step_m = float(step.get("distance", 0))
+            if travelled_m + step_m >= target_m:
+                return RouteGeometryIndex([{"steps": [step]}]).point_at(
+                    target_m - travelled_m
+                )
+            travelled_m += step_m
 
     return None
 
@@ -173,13 +173,18 @@ def get_stops(
 
     # Place stops at fuel_interval_m, 2*fuel_interval_m, ... up to
     # before dropoff
-    for i in range(1, num_stops + 1):
-        target_distance_m = min(i * FUEL_INTERVAL_M, route_distance_m - 1)
-        # attempt to interpolate position along legs:
-        fuel_stop_position = interpolate_point_along_legs(
-            legs, target_distance_m
-        )
+    target_distances_m = [
+        min(i * FUEL_INTERVAL_M, route_distance_m - 1)
+        for i in range(1, num_stops + 1)
+    ]
+    # attempt to interpolate positions along legs in one pass:
+    fuel_stop_positions = RouteGeometryIndex(legs).points_at(
+        target_distances_m
+    )
 
+    for i, (target_distance_m, fuel_stop_position) in enumerate(
+        zip(target_distances_m, fuel_stop_positions), start=1
+    ):
         stops.append(
             {
                 "type": "fuel",
@@ -209,67 +214,71 @@ class ELDCalculator:
     def __init__(
         self,
         route: dict,
-        route_from_curr_to_pickup_location: dict,
-        curr_cycle_used_hours: float,
+        route_from_curr_to_pickup_location: Optional[dict] = None,
+        curr_cycle_used_hours: float = 0.0,
     ):
+        """
+        The duration from the current location to the pickup is read from
+        the first leg of the multi-leg `route`, unless a separate
+        current->pickup route is passed (kept for compatibility).
+        """
         self.route = route
         self.route_from_curr_to_pickup_location = (
             route_from_curr_to_pickup_location
         )
+        self.curr_cycle_used_hours = curr_cycle_used_hours
         self.curr_cycle_available = max(
             0, MAX_CYCLE_HOURS - curr_cycle_used_hours
         )
         self._init_calculator()
 
+    @classmethod
+    def from_profile(cls, profile: TripProfile) -> "ELDCalculator":
+        return cls(
+            route={
+                "duration": profile.duration_s,
+                "distance": profile.distance_m,
+                "legs": [{"duration": profile.pickup_duration_s}],
+            },
+            curr_cycle_used_hours=profile.cycle_hours_used,
+        )
+
+    @property
+    def profile(self) -> TripProfile:
+        return TripProfile(
+            duration_s=self.route.get("duration", 0),
+            distance_m=self.route.get("distance", 0),
+            pickup_duration_s=self._get_pickup_leg_duration_s(),
+            cycle_hours_used=self.curr_cycle_used_hours,
+        )
+
     def get_eld_logs(self) -> list[dict]:
-        logs = []
-        remaining_hours = self.route_total_hours
-
-        while remaining_hours > 0:
-            self._init_day_data()
-
-            if self.curr_cycle_available < min(
-                remaining_hours, MAX_DRIVING_HOURS_PER_DAY
-            ):
-                self._reset_cycle_hours(logs)
-                continue
-
-            self._add_start_day_activities()
-            self._add_day_activities(remaining_hours=remaining_hours)
-            self._add_end_day_activities(
-                is_last_day=(remaining_hours - self.driving_hours <= 0)
-            )
-
-            logs.append(
-                {
-                    "day": self.day_index,
-                    "off_duty_hours": round(self.off_duty_hours, 2),
-                    "sleeper_berth_hours": round(self.sleeper_berth_hours, 2),
-                    "driving_hours": round(self.driving_hours, 2),
-                    "on_duty_hours": round(self.on_duty_hours, 2),
-                    "total_on_duty": round(
-                        self.driving_hours + self.on_duty_hours, 2
-                    ),
-                    "daily_distance_miles": round(
-                        self.driving_hours * self.speed_mph, 2
-                    ),
-                    "duty_status_timeline": self.duty_status_timeline,
-                }
-            )
-
-            remaining_hours -= self.driving_hours
-            self.curr_cycle_available -= self.driving_hours
-
-            if not self.pickup_done:
-                self.driving_hours_to_pickup -= self.driving_hours
-
-            self.day_index += 1
-            self.cycle_day += 1
-
-            if self.cycle_day >= MAX_CYCLE_DAYS:
-                self.curr_cycle_available += MAX_DRIVING_HOURS_PER_DAY
-
-        return logs
+        return list(self.iter_eld_logs())
+
+    def iter_eld_logs(self) -> Iterator[dict]:
+        """Yield the daily logs one at a time, as each day is computed."""
+        for day in self.iter_days():
+            yield day.to_dict(self.speed_mph)
+
+    def iter_days(self) -> Iterator[DayLog]:
+        """The daily logs as typed duty periods, before JSON conversion."""
+        return HOSEngine(
+            total_hours=self.route_total_hours,
+            driving_hours_to_pickup=self.driving_hours_to_pickup,
+            cycle_available=self.curr_cycle_available,
+        ).days()
+
+    def sweep_cycle_hours(self, cycle_hours_used: list[float]) -> list[dict]:
+        """
+        Day count, arrival and per-day totals of this route for many
+        `curr_cycle_used_hours` values at once.
+        """
+        return sweep_cycle_hours(
+            total_hours=self.route_total_hours,
+            driving_hours_to_pickup=self.driving_hours_to_pickup,
+            speed_mph=self.speed_mph,
+            cycle_hours_used=cycle_hours_used,
+        )
 
     def _init_calculator(self):
         duration_s = self.route.get("duration", 0)
@@ -282,241 +291,40 @@ class ELDCalculator:
         # include pickup (1h) and dropoff (1h)
         self.route_total_hours = route_driving_hours + 2.0
         self.driving_hours_to_pickup = (
-            self.route_from_curr_to_pickup_location.get("duration", 0)
-            / SECONDS_TO_HOURS
+            self._get_pickup_leg_duration_s() / SECONDS_TO_HOURS
         )
-        self.day_index = 1
-        self.cycle_day = 1
-        self.pickup_done = False
-
-    def _init_day_data(self):
-        self.off_duty_hours = 0
-        self.sleeper_berth_hours = 0
-        self.driving_hours = 0
-        self.on_duty_hours = 0
-        self.current_day_time = 0
-        self.duty_status_timeline: list[dict] = []
-
-    def _add_change_to_time_line(
-        self,
-        status: TimeLineChangeType,
-        time_to_add: float,
-        activity: str,
-    ):
-        self.duty_status_timeline.append(
-            {
-                "status": status,
-                "start": self.current_day_time,
-                "end": self.current_day_time + time_to_add,
-                "activity": activity,
-            }
-        )
-
-        self.off_duty_hours += (
-            time_to_add if status == TimeLineChangeType.OFF_DUTY else 0
-        )
-        self.sleeper_berth_hours += (
-            time_to_add if status == TimeLineChangeType.SLEEPER_BERTH else 0
-        )
-        self.driving_hours += (
-            time_to_add if status == TimeLineChangeType.DRIVING else 0
-        )
-        self.on_duty_hours += (
-            time_to_add if status == TimeLineChangeType.ON_DUTY else 0
-        )
-
-        self.current_day_time += time_to_add
-        if status != TimeLineChangeType.DRIVING:
-            current_covered_distance = round(
-                self.driving_hours * self.speed_mph, 2
-            )
-
-    def _add_start_day_activities(self):
-        start_day_activities = [
-            {
-                "status": TimeLineChangeType.OFF_DUTY,
-                "time_to_add": NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX,
-                "activity": "Off duty",
-            }
-            if self.day_index == 1
-            else {
-                "status": TimeLineChangeType.SLEEPER_BERTH,
-                "time_to_add": NUMBER_OF_HOURS_FROM_MIDNIGHT_TO_SIX,
-                "activity": "Sleeper berth",
-            },
-            {
-                "status": TimeLineChangeType.ON_DUTY,
-                "time_to_add": TRIP_TIV_DURATION_H,
-                "activity": "Pre-Trip/TIV (30 min)",
-            },
-        ]
 
-        if (
-            self.driving_hours_to_pickup <= MAX_DRIVING_HOURS_PER_DAY
-            and not self.pickup_done
-        ):
-            self._include_pickup(start_day_activities)
-            self.pickup_done = True
-
-        for day_activity in start_day_activities:
-            self._add_change_to_time_line(
-                status=day_activity.get("status"),
-                time_to_add=day_activity.get("time_to_add"),
-                activity=day_activity.get("activity"),
-            )
-
-    def _include_pickup(self, day_activities: list[dict]):
-        day_activities.append(
-            {
-                "status": TimeLineChangeType.DRIVING,
-                "time_to_add": min(
-                    self.driving_hours_to_pickup,
-                    MAX_DRIVING_HOURS_TO_REST,
-                ),
-                "activity": "Driving to pickup",
-            },
-        )
-
-        if self.driving_hours_to_pickup > MAX_DRIVING_HOURS_TO_REST:
-            self.driving_hours_to_pickup -= MAX_DRIVING_HOURS_TO_REST
-            day_activities.extend(
-                [
-                    {
-                        "status": TimeLineChangeType.OFF_DUTY,
-                        "time_to_add": BREAK_DURATION_H,
-                        "activity": "Off duty, 8 hours driving break (30 min)",
-                    },
-                    {
-                        "status": TimeLineChangeType.DRIVING,
-                        "time_to_add": self.driving_hours_to_pickup,
-                        "activity": "Driving to pickup",
-                    },
-                ]
-            )
-
-        day_activities.append(
-            {
-                "status": TimeLineChangeType.ON_DUTY,
-                "time_to_add": PICKUP_DURATION_H,
-                "activity": "Pickup (1 hour)",
-            },
-        )
+    def _get_pickup_leg_duration_s(self) -> float:
+        if self.route_from_curr_to_pickup_location is not None:
+            return self.route_from_curr_to_pickup_location.get("duration", 0)
 
-    def _add_end_day_activities(self, is_last_day: bool = False):
-        end_day_activities = [
-            {
-                "status": TimeLineChangeType.ON_DUTY,
-                "time_to_add": DROPOFF_DURATION_H,
-                "activity": "Dropoff (1 hour)",
-            }
-            if is_last_day
-            else {
-                "status": TimeLineChangeType.ON_DUTY,
-                "time_to_add": TRIP_TIV_DURATION_H,
-                "activity": "Post-Trip/TIV (30 min)",
-            },
-            {
-                "status": TimeLineChangeType.OFF_DUTY,
-                "time_to_add": (BREAK_DURATION_H * 3),
-                "activity": "Off duty, end day rest (1.5 hours)",
-            },
-            {
-                "status": TimeLineChangeType.SLEEPER_BERTH,
-                "time_to_add": 0,
-                "activity": "Sleeper berth",
-            }
-            if not is_last_day
-            else {
-                "status": TimeLineChangeType.OFF_DUTY,
-                "time_to_add": 0,
-                "activity": "Off duty, trip is done",
-            },
-        ]
+        legs = self.route.get("legs", [])
+        return legs[0].get("duration", 0) if legs else 0
 
-        for day_activity in end_day_activities:
-            activity = day_activity.get("activity")
-            time_to_add = day_activity.get("time_to_add")
 
-            if activity in ["Sleeper berth", "Off duty, trip is done"]:
-                time_to_add = HOURS_IN_DAY - self.current_day_time
+def eld_profile(route: dict, curr_cycle_used_hours: float) -> TripProfile:
+    """
+    The profile the ELD logs of a trip are computed from: exact, unless
+    the lossy ELD_CACHE_* quanta are opted into.
+    """
+    return ELDCalculator(
+        route=route, curr_cycle_used_hours=curr_cycle_used_hours
+    ).profile.quantized(
+        duration_quantum_s=ELD_CACHE_DURATION_QUANTUM_S,
+        distance_quantum_m=ELD_CACHE_DISTANCE_QUANTUM_M,
+        cycle_hours_bucket=ELD_CACHE_CYCLE_HOURS_BUCKET,
+    )
 
-            self._add_change_to_time_line(
-                status=day_activity.get("status"),
-                time_to_add=time_to_add,
-                activity=activity,
-            )
 
-    def _add_day_activities(self, remaining_hours: float):
-        day_activities = [
-            {
-                "status": TimeLineChangeType.DRIVING,
-                "time_to_add": 0,
-                "activity": "Driving before 8 hours rest",
-            },
-            {
-                "status": TimeLineChangeType.OFF_DUTY,
-                "time_to_add": BREAK_DURATION_H,
-                "activity": "Off duty, 8 hours driving break (30 min)",
-            },
-            {
-                "status": TimeLineChangeType.DRIVING,
-                "time_to_add": 0,
-                "activity": "Driving after 8 hours rest",
-            },
-        ]
+def eld_logs_for_profile(profile: TripProfile) -> list[dict]:
+    """
+    ELD logs of a trip profile, memoized. Logs are a pure function of the
+    profile, so trips with the same profile share them.
+    """
+    key = profile.cache_key()
+    logs = eld_cache.get(key)
+    if logs is None:
+        logs = ELDCalculator.from_profile(profile).get_eld_logs()
+        eld_cache.set(key, logs)
 
-        for day_activity in day_activities:
-            time_to_add = day_activity["time_to_add"]
-            activity = day_activity["activity"]
-
-            match activity:
-                case "Driving before 8 hours rest":
-                    time_to_add = min(
-                        remaining_hours,
-                        MAX_DRIVING_HOURS_TO_REST - self.driving_hours,
-                    )
-                case "Driving after 8 hours rest":
-                    time_to_add = min(
-                        remaining_hours - self.driving_hours,
-                        MAX_DRIVING_HOURS_PER_DAY - self.driving_hours,
-                    )
-
-            self._add_change_to_time_line(
-                status=day_activity["status"],
-                time_to_add=time_to_add,
-                activity=activity,
-            )
-
-            if remaining_hours - self.driving_hours <= 0:
-                break
-
-    def _reset_cycle_hours(self, logs: list[dict]):
-        for _ in range(2):
-            self._init_day_data()
-            self._add_change_to_time_line(
-                status=TimeLineChangeType.OFF_DUTY,
-                time_to_add=HOURS_IN_DAY,
-                activity="Off duty, cycle reset",
-            )
-
-            logs.append(
-                {
-                    "day": self.day_index,
-                    "off_duty_hours": round(self.off_duty_hours, 2),
-                    "sleeper_berth_hours": round(self.sleeper_berth_hours, 2),
-                    "driving_hours": round(self.driving_hours, 2),
-                    "on_duty_hours": round(self.on_duty_hours, 2),
-                    "total_on_duty": round(
-                        self.driving_hours + self.on_duty_hours, 2
-                    ),
-                    "daily_distance_miles": round(
-                        self.driving_hours * self.speed_mph, 2
-                    ),
-                    "duty_status_timeline": self.duty_status_timeline,
-                }
-            )
-
-            self.day_index += 1
-
-        self.curr_cycle_available = MAX_CYCLE_HOURS
-        self.cycle_day = 0
+    return logs
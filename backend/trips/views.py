@@ -1,84 +1,424 @@
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from typing import Iterable, Optional
+import json
 import logging
-from .serializers import TripInputSerializer
-from .utils import geocode, call_osrm_route, get_stops, ELDCalculator
+import math
+from .compression import compressed_cache, compressed_key, negotiate_encoding
+from .constants import ROUTE_STORE_PLANS
+from .enums import LogFormat, UpstreamPriority
+from .jobs import job_response, recover_stale_jobs, submit_job
+from .metrics import render_prometheus
+from .models import PlanningJob, TripPlan
+from .planning import (
+    PlanningError,
+    error_event,
+    iter_planned_trips,
+    plan_trip,
+    plan_trips,
+    project_plan,
+    stream_trip,
+    sweep_trip,
+)
+from .renderers import PLANNING_RENDERER_CLASSES, MsgPackRenderer
+from .plans import (
+    plan_etag,
+    route_plan,
+    save_trip_plan,
+    touch_trip_plan,
+    trip_plan_response,
+)
+from .replan import replan_response, replan_trip
+from .serializers import (
+    ReplanInputSerializer,
+    TripBatchInputSerializer,
+    TripInputSerializer,
+    TripRouteQuerySerializer,
+    TripSweepInputSerializer,
+)
+from .upstream import upstream_priority
 
 logger = logging.getLogger(__name__)
 
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def ndjson_response(events: Iterable[dict]) -> StreamingHttpResponse:
+    """Stream events as newline-delimited JSON, one line per event."""
+    lines = (
+        json.dumps(event, cls=JSONEncoder, separators=(",", ":")) + "\n"
+        for event in events
+    )
+    response = StreamingHttpResponse(lines, content_type=NDJSON_CONTENT_TYPE)
+    response["X-Accel-Buffering"] = "no"
+
+    return response
+
+
+def error_response(e: PlanningError) -> Response:
+    headers = None
+    if e.retry_after_s is not None:
+        headers = {"Retry-After": str(math.ceil(e.retry_after_s))}
+
+    return Response(
+        {"message": e.message}, status=e.status_code, headers=headers
+    )
+
+
+def requested_log_format(request, query: dict) -> str:
+    """The `logs` query parameter, compact by default for MessagePack."""
+    if "logs" in query:
+        return query["logs"]
+    if request.accepted_renderer.format == MsgPackRenderer.format:
+        return LogFormat.COMPACT
+
+    return LogFormat.FULL
+
 
 class TripRouteView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
     def post(self, request):
         serializer = TripInputSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        try:
-            cur_lat, cur_lon = geocode(data["current_location"])
-            pickup_lat, pickup_lon = geocode(data["pickup_location"])
-            dropoff_lat, dropoff_lon = geocode(data["dropoff_location"])
-        except Exception as e:
-            logger.error(f"Error: {e}")
+        query_serializer = TripRouteQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        route_view = query_serializer.validated_data["route"]
+        zoom = query_serializer.validated_data.get("zoom")
+        log_format = requested_log_format(
+            request, query_serializer.validated_data
+        )
+
+        if query_serializer.validated_data["async"]:
+            job = submit_job(data, route_view, zoom, log_format)
+            status_url = reverse("job-detail", args=[job.pk])
+
             return Response(
-                {"message": "Invalid location"},
-                status=status.HTTP_400_BAD_REQUEST,
+                {**job_response(job), "status_url": status_url},
+                status=status.HTTP_202_ACCEPTED,
+                headers={"Location": status_url},
             )
 
-        try:
-            route_resp = call_osrm_route(
-                coords=f"{cur_lon},{cur_lat};{pickup_lon},{pickup_lat};{dropoff_lon},{dropoff_lat}"
-            )
-            route_from_curr_to_pickup_location_resp = call_osrm_route(
-                coords=f"{cur_lon},{cur_lat};{pickup_lon},{pickup_lat}"
-            )
+        if query_serializer.validated_data["stream"]:
+            try:
+                events = stream_trip(data, route_view, zoom)
+            except PlanningError as e:
+                return error_response(e)
+
+            return ndjson_response(events)
+
+        if not ROUTE_STORE_PLANS:
+            try:
+                plan = plan_trip(data)
+            except PlanningError as e:
+                return error_response(e)
 
-            route = route_resp.get("routes", [])[0]
-            route_from_curr_to_pickup_location = (
-                route_from_curr_to_pickup_location_resp.get("routes", [])[0]
-            )
-        except Exception as e:
-            logger.error(f"Error: {e}")
             return Response(
-                {
-                    "message": "No valid route found",
-                },
-                status=status.HTTP_400_BAD_REQUEST,
+                project_plan(plan, route_view, zoom, log_format),
+                status=status.HTTP_200_OK,
             )
 
         try:
-            eld_logs_calculator = ELDCalculator(
-                route=route,
-                route_from_curr_to_pickup_location=route_from_curr_to_pickup_location,
-                curr_cycle_used_hours=data.get("current_cycle_hours", 0),
-            )
+            trip_plan = route_plan(data)
+        except PlanningError as e:
+            return error_response(e)
 
-            stops = get_stops(
-                route=route,
-                cur_coords=[cur_lat, cur_lon],
-                pickup_coords=[pickup_lat, pickup_lon],
-                dropoff_coords=[dropoff_lat, dropoff_lon],
-            )
+        etag = response_etag(
+            request,
+            trip_plan.pk,
+            trip_plan.content_hash,
+            trip_plan.version,
+            route_view,
+            zoom,
+            log_format,
+        )
+        plan_url = reverse("trip-route-detail", args=[trip_plan.pk])
+
+        response = precompressed_response(request, etag)
+        if response is not None:
+            response["Content-Location"] = plan_url
+            return response
+
+        return Response(
+            trip_plan_response(trip_plan, route_view, zoom, log_format),
+            status=status.HTTP_200_OK,
+            headers={"ETag": etag, "Content-Location": plan_url},
+        )
+
+
+class TripRouteBatchView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def post(self, request):
+        serializer = TripBatchInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        trips = serializer.validated_data["trips"]
+
+        query_serializer = TripRouteQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        route_view = query_serializer.validated_data["route"]
+        zoom = query_serializer.validated_data.get("zoom")
+        log_format = requested_log_format(
+            request, query_serializer.validated_data
+        )
+
+        def project(result):
+            if isinstance(result, PlanningError):
+                return error_event(result)
+            return project_plan(result, route_view, zoom, log_format)
+
+        # Batches queue behind interactive requests for upstream tokens.
+        if query_serializer.validated_data["stream"]:
+
+            def events():
+                with upstream_priority(UpstreamPriority.BATCH):
+                    for index, result in iter_planned_trips(trips):
+                        yield {
+                            "type": "result",
+                            "index": index,
+                            **project(result),
+                        }
+                yield {"type": "end"}
+
+            return ndjson_response(events())
+
+        with upstream_priority(UpstreamPriority.BATCH):
+            results = [project(result) for result in plan_trips(trips)]
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class TripRouteSweepView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def post(self, request):
+        serializer = TripSweepInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        query_serializer = TripRouteQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        route_view = query_serializer.validated_data["route"]
+        zoom = query_serializer.validated_data.get("zoom")
+
+        try:
+            sweep = sweep_trip(data, route_view, zoom)
+        except PlanningError as e:
+            return error_response(e)
+
+        return Response(sweep, status=status.HTTP_200_OK)
 
-            logs = eld_logs_calculator.get_eld_logs()
 
+class JobDetailView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def get(self, request, job_id):
+        recover_stale_jobs()
+
+        job = PlanningJob.objects.filter(pk=job_id).first()
+        if job is None:
             return Response(
-                {
-                    "route": route,
-                    "stops": stops,
-                    "logs": logs,
-                },
-                status=200,
+                {"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
-            logger.error(f"Error: {e}")
+
+        return Response(job_response(job), status=status.HTTP_200_OK)
+
+
+def route_query(request) -> tuple[str, Optional[int], str]:
+    """The route view, map zoom and log format asked for in the query."""
+    query_serializer = TripRouteQuerySerializer(data=request.query_params)
+    query_serializer.is_valid(raise_exception=True)
+    query = query_serializer.validated_data
+
+    return (
+        query["route"],
+        query.get("zoom"),
+        requested_log_format(request, query),
+    )
+
+
+def response_etag(
+    request, plan_id, content_hash: str, version: int, *variant
+) -> str:
+    """ETag of a stored plan shaped for `variant` and the accepted type."""
+    return plan_etag(
+        plan_id,
+        content_hash,
+        version,
+        *variant,
+        request.accepted_renderer.media_type,
+    )
+
+
+def precompressed_response(request, etag: str) -> Optional[HttpResponse]:
+    """
+    The body of a response with `etag` as already compressed for the
+    client's encoding, skipping the serialization and compression.
+    """
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return None
+
+    cached = compressed_cache.get(compressed_key(etag, encoding))
+    if cached is None:
+        return None
+
+    content_type, body = cached
+    response = HttpResponse(body, content_type=content_type)
+    response["Content-Encoding"] = encoding
+    response["ETag"] = f"W/{etag}"
+    # The content type was negotiated from `Accept` too.
+    patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+
+    return response
+
+
+def not_modified_response(request, etag: str) -> HttpResponseNotModified:
+    """
+    A 304 for a stored plan, with the ETag the full response would carry:
+    weak for a compressed encoding, as plan bodies are well over
+    COMPRESSION_MIN_BYTES.
+    """
+    response = HttpResponseNotModified()
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    response["ETag"] = etag if encoding is None else f"W/{etag}"
+    patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+
+    return response
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Whether `If-None-Match` matches `etag` (weak comparison)."""
+    return any(
+        tag == "*" or tag.removeprefix("W/") == etag
+        for tag in parse_etags(request.headers.get("If-None-Match", ""))
+    )
+
+
+class TripPlanView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def post(self, request):
+        serializer = TripInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        route_view, zoom, log_format = route_query(request)
+
+        try:
+            trip_plan = save_trip_plan(serializer.validated_data)
+        except PlanningError as e:
+            return error_response(e)
+
+        plan_url = reverse("trip-plan-detail", args=[trip_plan.pk])
+        return Response(
+            trip_plan_response(trip_plan, route_view, zoom, log_format),
+            status=status.HTTP_201_CREATED,
+            headers={
+                "Location": plan_url,
+                "ETag": response_etag(
+                    request,
+                    trip_plan.pk,
+                    trip_plan.content_hash,
+                    trip_plan.version,
+                    route_view,
+                    zoom,
+                    log_format,
+                ),
+            },
+        )
+
+
+class TripPlanDetailView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def get(self, request, plan_id):
+        route_view, zoom, log_format = route_query(request)
+        variant = (route_view, zoom, log_format)
+
+        # Revalidation and precompressed bodies only need the hash
+        # columns, not the plan.
+        stored = (
+            TripPlan.objects.filter(pk=plan_id)
+            .values_list("pk", "content_hash", "version", "updated_at")
+            .first()
+        )
+        if stored is not None:
+            pk, plan_hash, version, updated_at = stored
+            touch_trip_plan(pk, updated_at)
+            etag = response_etag(request, pk, plan_hash, version, *variant)
+            if etag_matches(request, etag):
+                return not_modified_response(request, etag)
+
+            response = precompressed_response(request, etag)
+            if response is not None:
+                response["Cache-Control"] = "no-cache"
+                return response
+
+        trip_plan = TripPlan.objects.filter(pk=plan_id).first()
+        if trip_plan is None:
             return Response(
-                {"message": "Internal Server Error"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                {"message": "Plan not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        return Response(
+            trip_plan_response(trip_plan, *variant),
+            status=status.HTTP_200_OK,
+            headers={
+                "ETag": response_etag(
+                    request,
+                    trip_plan.pk,
+                    trip_plan.content_hash,
+                    trip_plan.version,
+                    *variant,
+                ),
+                "Cache-Control": "no-cache",
+            },
+        )
+
+
+class TripPlanReplanView(APIView):
+    renderer_classes = PLANNING_RENDERER_CLASSES
+
+    def post(self, request, plan_id):
+        serializer = ReplanInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        route_view, zoom, log_format = route_query(request)
+
+        try:
+            trip_plan, replan = replan_trip(
+                plan_id, data["lat"], data["lon"], data["current_cycle_hours"]
             )
+        except PlanningError as e:
+            return error_response(e)
+
+        return Response(
+            replan_response(trip_plan, replan, route_view, zoom, log_format),
+            status=status.HTTP_200_OK,
+        )
 
 
 @api_view(["GET"])
 def health(request):
     return Response({"status": "ok"})
+
+
+def metrics(request):
+    """Prometheus metrics of this worker process."""
+    return HttpResponse(
+        render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE
+    )
@@ -1,7 +1,7 @@
-import React, { useState } from 'react'
+import React, { useEffect, useState } from 'react'
 import MapView from './components/MapView'
 import { ToastContainer, toast } from 'react-toastify'
-import { getRouteAndLogs } from './api'
+import { getPlan, getRouteAndLogs } from './api'
 import type { RouteData } from './types'
 import LogSheet from './components/LogSheet'
 import TruckIcon from './components/icons/TruckIcon'
@@ -58,12 +58,20 @@ export default function App() {
     }))
   }
 
+  const showPlan = (data: RouteData) => {
+    setRouteData(data)
+    if (data.plan_id) {
+      const url = new URL(window.location.href)
+      url.searchParams.set('plan', data.plan_id)
+      window.history.replaceState(null, '', url)
+    }
+  }
+
   const onSubmit = async (e?: React.FormEvent) => {
     e?.preventDefault()
     setLoading(true)
     try {
-      const data = await getRouteAndLogs(inputs)
-      setRouteData(data)
+      showPlan(await getRouteAndLogs(inputs))
     } catch (err: any) {
       toast.error(err?.response?.data?.message || err?.message || 'Error')
     } finally {
@@ -71,6 +79,20 @@ export default function App() {
     }
   }
 
+  // Reopen the plan of a reloaded page or shared link.
+  useEffect(() => {
+    const planId = new URLSearchParams(window.location.search).get('plan')
+    if (!planId) return
+
+    setLoading(true)
+    getPlan(planId)
+      .then(showPlan)
+      .catch((err: any) =>
+        toast.error(err?.response?.data?.message || err?.message || 'Error'),
+      )
+      .finally(() => setLoading(false))
+  }, [])
+
   return (
     <div className="relative h-screen w-screen">
       <ToastContainer
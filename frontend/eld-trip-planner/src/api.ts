@@ -1,5 +1,6 @@
 import axios from 'axios'
-import type { RouteData } from './types'
+import { decodeLogs } from './logs'
+import type { CompactLogs, RouteData } from './types'
 
 const API_BASE_URL = import.meta.env.VITE_API_URL ?? 'http://localhost:8000'
 
@@ -8,12 +9,27 @@ const api = axios.create({
   timeout: 20000,
 })
 
+// Zoom level the map opens at; plans are requested with the route
+// geometry simplified for it
+export const MAP_DEFAULT_ZOOM = 6
+
 export async function getRouteAndLogs(payload: {
   current_location: string
   pickup_location: string
   dropoff_location: string
   current_cycle_hours: number
 }): Promise<RouteData> {
-  const res = await api.post('/api/route/', payload)
-  return res.data as RouteData
+  const res = await api.post('/api/route/', payload, {
+    params: { zoom: MAP_DEFAULT_ZOOM, logs: 'compact' },
+  })
+  return { ...res.data, logs: decodeLogs(res.data.logs as CompactLogs) }
+}
+
+// Stored plans are revalidated with their ETag, so reloads and shared
+// links skip the planning entirely.
+export async function getPlan(planId: string): Promise<RouteData> {
+  const res = await api.get(`/api/route/${planId}/`, {
+    params: { zoom: MAP_DEFAULT_ZOOM, logs: 'compact' },
+  })
+  return { ...res.data, logs: decodeLogs(res.data.logs as CompactLogs) }
 }
@@ -6,6 +6,7 @@ interface DutyStatus {
   status: 'Off Duty' | 'Sleeper Berth' | 'Driving' | 'On Duty'
   start: number
   end: number
+  activity?: string
 }
 
 export interface DailyLogData {
@@ -9,36 +9,39 @@ import {
   useMap,
 } from 'react-leaflet'
 import polyline from '@mapbox/polyline'
+import { MAP_DEFAULT_ZOOM } from '../api'
 import type { RouteData, Stop } from '../types'
 import { defaultIcon, fuelStopIcon } from './icons/map-icons'
 
 // Default to USA
 const MAP_DEFAULT_CENTER = [44.9672, -103.7716]
 
-export default function MapView({ routeData }: { routeData: RouteData | null }) {
-  const positions = useMemo(() => {
-    if (routeData?.route?.geometry) {
-      try {
-        return polyline
-          .decode(routeData.route.geometry)
-          .map((p: number[]) => [p[0], p[1]] as [number, number])
-      } catch {
-        return null
-      }
-    }
+function decodePolyline(geometry?: string): [number, number][] | null {
+  if (!geometry) {
+    return null
+  }
+  try {
+    return polyline.decode(geometry).map((p: number[]) => [p[0], p[1]] as [number, number])
+  } catch {
     return null
-  }, [routeData])
+  }
+}
+
+export default function MapView({ routeData }: { routeData: RouteData | null }) {
+  // The route geometry is sent simplified for MAP_DEFAULT_ZOOM
+  const geometry = routeData?.route?.geometry
+  const positions = useMemo(() => decodePolyline(geometry), [geometry])
 
   const stops: Stop[] = routeData?.stops ?? []
 
   return (
     <MapContainer
       center={MAP_DEFAULT_CENTER as [number, number]}
-      zoom={6}
+      zoom={MAP_DEFAULT_ZOOM}
       style={{ height: '100%', width: '100%' }}
       zoomControl={false} // Explicitly disable the default control
     >
-      <MapCenterAdapter positions={positions} />
+      <MapCenterAdapter stops={stops} />
       <TileLayer
         attribution="&copy; OpenStreetMap contributors"
         url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
@@ -60,16 +63,28 @@ export default function MapView({ routeData }: { routeData: RouteData | null })
   )
 }
 
-function MapCenterAdapter({ positions }: { positions: [number, number][] | null }) {
+// Centered on the middle of the stops, which span the whole route
+function MapCenterAdapter({ stops }: { stops: Stop[] }) {
   const map = useMap()
+  const center = useMemo(() => {
+    const coords = stops.flatMap((s) => (s.coords ? [s.coords] : []))
+    if (!coords.length) {
+      return null
+    }
+    const lats = coords.map((c) => c[0])
+    const lons = coords.map((c) => c[1])
 
-  useEffect(() => {
-    if (positions) {
-      const center = positions[Math.floor(positions.length / 2)]
+    return [
+      (Math.min(...lats) + Math.max(...lats)) / 2,
+      (Math.min(...lons) + Math.max(...lons)) / 2,
+    ] as [number, number]
+  }, [stops])
 
-      map.panTo(center as [number, number])
+  useEffect(() => {
+    if (center) {
+      map.panTo(center)
     }
-  }, [positions])
+  }, [map, center])
 
   return null
 }
@@ -0,0 +1,33 @@
+import type { DailyLogData } from './components/LogSheet'
+import type { CompactLogs } from './types'
+
+type DutyStatus = DailyLogData['duty_status_timeline'][number]
+
+const MINUTES_PER_HOUR = 60
+
+// Expand the columnar logs sent for `?logs=compact` into the per-day
+// objects LogSheet and LogGrid render.
+export function decodeLogs(compact: CompactLogs): DailyLogData[] {
+  let offset = 0
+
+  return compact.periods.map((count, dayIndex) => {
+    const log: Record<string, unknown> = {}
+    for (const [key, values] of Object.entries(compact.totals)) {
+      log[key] = values[dayIndex]
+    }
+
+    const timeline: DutyStatus[] = []
+    for (let i = offset; i < offset + count; i++) {
+      timeline.push({
+        status: compact.statuses[compact.status[i]] as DutyStatus['status'],
+        start: compact.start[i] / MINUTES_PER_HOUR,
+        end: compact.end[i] / MINUTES_PER_HOUR,
+        activity: compact.activities[compact.activity[i]],
+      })
+    }
+    log.duty_status_timeline = timeline
+    offset += count
+
+    return log as unknown as DailyLogData
+  })
+}
@@ -5,12 +5,36 @@ export interface Stop {
   label: string;
 }
 
+export interface LegSummary {
+  distance: number;
+  duration: number;
+  summary: string;
+}
+
+// Day logs as parallel arrays (`?logs=compact`): one array per daily
+// total, and every duty period as a status code, start/end minutes and
+// an index into `activities`. `periods` counts the periods of each day.
+export interface CompactLogs {
+  statuses: string[];
+  activities: string[];
+  totals: Record<string, number[]>;
+  periods: number[];
+  status: number[];
+  start: number[];
+  end: number[];
+  activity: number[];
+}
+
 export interface RouteData {
+  // Id of the stored plan, served again by GET /api/route/<plan_id>/;
+  // only sent when the server stores route plans (ROUTE_STORE_PLANS)
+  plan_id?: string;
   route: {
-    distance_m: number;
-    duration_s: number;
+    distance: number;
+    duration: number;
+    // Simplified for the zoom level the plan was requested with
     geometry?: string;
-    legs?: any[];
+    legs?: LegSummary[];
   };
   stops: Stop[];
   logs: any[];